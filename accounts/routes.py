@@ -1,31 +1,60 @@
-from flask import render_template, redirect, url_for, flash, request, current_app
+from flask import render_template, redirect, url_for, flash, request, current_app, abort, Response, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime
 from .. import db
-from ..models import Account, Transaction, BankSettings
+from ..models import Account, Transaction
 from . import accounts_bp
 from .forms import CreateAccountForm, TransferForm
+from ..utils.history import transaction_history
+from ..utils.money import to_minor, totals_by_currency, from_minor
+from ..utils.statements import export_statement as statement_chunks, parse_date, EXPORT_FORMATS
+from ..utils.fx import get_rates, RateUnavailable
+from ..utils.ledger import post_entries
+from ..utils.page_cache import cached_fragment
+from ..utils.settings import get_bank_settings
+from ..utils.transfer_engine import transfer as transfer_funds, InsufficientFunds
 
 @accounts_bp.route('/dashboard')
 @login_required
 def dashboard():
     """User dashboard showing all accounts and recent transactions."""
-    accounts = Account.query.filter_by(user_id=current_user.id).all()
+    account_ids = list(db.session.execute(
+        db.select(Account.id).where(Account.user_id == current_user.id).order_by(Account.id)
+    ).scalars())
     
-    # Get recent transactions for all user accounts
-    recent_transactions = []
-    for account in accounts:
-        sent = Transaction.query.filter_by(account_from_id=account.id).order_by(Transaction.created_at.desc()).limit(5).all()
-        received = Transaction.query.filter_by(account_to_id=account.id).order_by(Transaction.created_at.desc()).limit(5).all()
-        recent_transactions.extend(sent + received)
-    
-    # Sort transactions by date (newest first)
-    recent_transactions.sort(key=lambda x: x.created_at, reverse=True)
-    recent_transactions = recent_transactions[:10]  # Limit to 10 most recent
+    # Both fragments are cached until a commit changes one of the accounts
+    rates = get_rates()
+    accounts_table = cached_fragment('dashboard-accounts', account_ids,
+                                     lambda: _render_account_table(account_ids, rates), rates.version)
+    recent_transactions = cached_fragment('dashboard-recent', account_ids,
+                                          lambda: _render_recent_transactions(account_ids))
     
     return render_template('accounts/dashboard.html', 
                            title='Dashboard', 
-                           accounts=accounts, 
+                           accounts_table=accounts_table,
+                           recent_transactions=recent_transactions)
+
+def _render_account_table(account_ids, rates):
+    accounts = Account.query.filter(Account.id.in_(account_ids)).order_by(Account.id).all() if account_ids else []
+    
+    # Total of all accounts in the reporting currency, if every rate is known
+    total_currency = current_app.config.get('FX_BASE_CURRENCY', 'EUR')
+    try:
+        totals = totals_by_currency((account.currency, account.total_balance_minor) for account in accounts)
+        total_balance = from_minor(rates.convert_totals(totals, total_currency), total_currency)
+    except RateUnavailable:
+        total_balance = None
+    
+    return render_template('accounts/_account_table.html',
+                           accounts=accounts,
+                           total_balance=total_balance,
+                           total_currency=total_currency)
+
+def _render_recent_transactions(account_ids):
+    # Get the 10 most recent transactions across all user accounts in one query
+    recent_transactions, _ = transaction_history(account_ids, limit=10)
+    return render_template('accounts/_recent_transactions.html',
+                           account_ids=account_ids,
                            transactions=recent_transactions)
 
 @accounts_bp.route('/create', methods=['GET', 'POST'])
@@ -35,7 +64,7 @@ def create_account():
     form = CreateAccountForm()
     if form.validate_on_submit():
         # Get bank settings for the prefix
-        bank_settings = BankSettings.query.first()
+        bank_settings = get_bank_settings()
         if not bank_settings:
             flash('Bank not properly configured. Please contact an administrator.')
             return redirect(url_for('accounts.dashboard'))
@@ -43,14 +72,23 @@ def create_account():
         # Generate account number with bank prefix
         account_number = Account.generate_account_number(bank_settings.bank_prefix)
         
+        try:
+            initial_deposit = to_minor(form.initial_deposit.data, form.currency.data)
+        except ValueError:
+            flash('Invalid initial deposit amount.')
+            return redirect(url_for('accounts.create_account'))
+        
         # Create the account
         account = Account(
             account_number=account_number,
             user_id=current_user.id,
-            balance=form.initial_deposit.data,
+            balance_minor=initial_deposit,
             currency=form.currency.data
         )
         db.session.add(account)
+        if initial_deposit:
+            db.session.flush()
+            post_entries([{'account_id': account.id, 'amount_minor': initial_deposit, 'kind': 'deposit'}])
         db.session.commit()
         
         flash(f'Account {account_number} created successfully!')
@@ -71,19 +109,77 @@ def account_details(account_number):
         flash('You do not have permission to view this account.')
         return redirect(url_for('accounts.dashboard'))
     
-    # Get all transactions for this account
-    sent_transactions = Transaction.query.filter_by(account_from_id=account.id).order_by(Transaction.created_at.desc()).all()
-    received_transactions = Transaction.query.filter_by(account_to_id=account.id).order_by(Transaction.created_at.desc()).all()
-    
-    # Combine and sort transactions
-    transactions = sorted(sent_transactions + received_transactions, 
-                          key=lambda x: x.created_at, 
-                          reverse=True)
+    cursor = request.args.get('cursor')
+    page_size = current_app.config.get('HISTORY_PAGE_SIZE', 50)
+    account_summary = cached_fragment(
+        'account-summary', [account.id],
+        lambda: render_template('accounts/_account_summary.html', account=account)
+    )
+    transaction_history_html = cached_fragment(
+        'account-history', [account.id],
+        lambda: _render_transaction_history(account, cursor, page_size),
+        cursor, page_size
+    )
     
     return render_template('accounts/account_details.html', 
                            title=f'Account {account_number}', 
-                           account=account, 
-                           transactions=transactions)
+                           account_summary=account_summary,
+                           transaction_history=transaction_history_html)
+
+def _render_transaction_history(account, cursor, page_size):
+    # Get one page of this account's transactions, newest first
+    try:
+        transactions, next_cursor = transaction_history([account.id], limit=page_size, cursor=cursor)
+    except ValueError:
+        abort(400)
+    
+    return render_template('accounts/_transaction_history.html',
+                           account=account,
+                           transactions=transactions,
+                           cursor=cursor,
+                           next_cursor=next_cursor)
+
+def _statement_response(account_ids, filename):
+    """Stream a statement in the format and date range given in the query string."""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    try:
+        since = parse_date(request.args.get('since'))
+        until = parse_date(request.args.get('until'))
+    except ValueError:
+        abort(400)
+    
+    chunks = statement_chunks(
+        export_format, account_ids, since=since, until=until,
+        batch_size=current_app.config.get('STATEMENT_EXPORT_BATCH_SIZE', 1000)
+    )
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{export_format}'}
+    )
+
+@accounts_bp.route('/details/<account_number>/export')
+@login_required
+def export_statement(account_number):
+    """Download an account's transactions as CSV or NDJSON."""
+    account = Account.query.filter_by(account_number=account_number).first_or_404()
+    
+    # Ensure the user owns this account
+    if account.user_id != current_user.id and not current_user.is_admin:
+        abort(403)
+    
+    return _statement_response([account.id], f'statement-{account_number}')
+
+@accounts_bp.route('/export')
+@login_required
+def export_all_statements():
+    """Download the transactions of all accounts (admins only)."""
+    if not current_user.is_admin:
+        abort(403)
+    
+    return _statement_response(None, 'statement-all')
 
 @accounts_bp.route('/transfer/<account_number>', methods=['GET', 'POST'])
 @login_required
@@ -98,8 +194,14 @@ def transfer(account_number):
     
     form = TransferForm()
     if form.validate_on_submit():
-        # Check if sufficient funds
-        if account.balance < form.amount.data:
+        try:
+            amount = to_minor(form.amount.data, account.currency)
+        except ValueError:
+            flash('Invalid amount for this account currency.')
+            return redirect(url_for('accounts.transfer', account_number=account_number))
+        
+        # Fail early on insufficient funds; the debit itself re-checks atomically
+        if account.total_balance_minor < amount:
             flash('Insufficient funds for this transfer.')
             return redirect(url_for('accounts.transfer', account_number=account_number))
         
@@ -107,7 +209,7 @@ def transfer(account_number):
         destination_account_number = form.account_to.data
         
         # Get bank settings for the prefix
-        bank_settings = BankSettings.query.first()
+        bank_settings = get_bank_settings()
         if not bank_settings:
             flash('Bank not properly configured. Please contact an administrator.')
             return redirect(url_for('accounts.dashboard'))
@@ -120,23 +222,44 @@ def transfer(account_number):
                 flash('Destination account not found.')
                 return redirect(url_for('accounts.transfer', account_number=account_number))
             
+            # Convert into the destination account's currency if needed
+            converted_amount = None
+            exchange_rate = None
+            if destination_account.currency != account.currency:
+                try:
+                    rates = get_rates()
+                    exchange_rate = rates.rate(account.currency, destination_account.currency)
+                    converted_amount = rates.convert(amount, account.currency, destination_account.currency)
+                except RateUnavailable:
+                    flash(f'No exchange rate from {account.currency} to {destination_account.currency}.')
+                    return redirect(url_for('accounts.transfer', account_number=account_number))
+            
             # Create transaction
             transaction = Transaction(
                 transaction_id=Transaction.generate_transaction_id(),
                 account_from_id=account.id,
                 account_to_id=destination_account.id,
-                amount=form.amount.data,
+                amount_minor=amount,
                 currency=account.currency,
                 explanation=form.explanation.data,
                 status='completed',
                 is_internal=True,
                 completed_at=datetime.utcnow(),
-                receiver_name=destination_account.owner.full_name
+                receiver_name=destination_account.owner.full_name,
+                converted_amount_minor=converted_amount,
+                converted_currency=destination_account.currency if converted_amount is not None else None,
+                exchange_rate=exchange_rate
             )
             
-            # Update account balances
-            account.balance -= form.amount.data
-            destination_account.balance += form.amount.data
+            # Update both balances atomically in the database
+            try:
+                transfer_funds(account.id, destination_account.id, amount,
+                               to_shards=destination_account.balance_shards,
+                               to_amount_minor=converted_amount,
+                               reference=transaction.transaction_id)
+            except InsufficientFunds:
+                flash('Insufficient funds for this transfer.')
+                return redirect(url_for('accounts.transfer', account_number=account_number))
             
             db.session.add(transaction)
             db.session.commit()
@@ -149,13 +272,15 @@ def transfer(account_number):
             result = process_outgoing_transaction(
                 account_from=account,
                 account_to=destination_account_number,
-                amount=form.amount.data,
+                amount_minor=amount,
                 currency=account.currency,
                 explanation=form.explanation.data,
                 sender_name=current_user.full_name
             )
             
-            if result.get('success'):
+            if result.get('pending'):
+                flash('Transfer accepted and queued for delivery to the destination bank.')
+            elif result.get('success'):
                 flash(f'Transfer to {result.get("receiver_name")} completed successfully!')
             else:
                 flash(f'Transfer failed: {result.get("error")}')
@@ -0,0 +1,198 @@
+import hashlib
+from functools import wraps
+from flask import request, jsonify, current_app
+from flask_login import current_user
+from . import api_bp
+from .. import db
+from ..models import Account
+from ..utils.history import transaction_history, history_version
+from ..utils.money import from_minor
+
+
+def _account_from(transaction):
+    if transaction.sender:
+        return transaction.sender.account_number
+    # Incoming transfers keep the external sender in account_to_external
+    return transaction.account_to_external
+
+def _account_to(transaction):
+    if transaction.receiver:
+        return transaction.receiver.account_number
+    return transaction.account_to_external
+
+ACCOUNT_FIELDS = {
+    'account_number': lambda account: account.account_number,
+    'currency': lambda account: account.currency,
+    # Read past the shard-sum cache, so the balance is as new as the ETag
+    'balance': lambda account: str(from_minor(account.current_balance_minor(), account.currency)),
+    'balance_minor': lambda account: account.current_balance_minor(),
+    'is_active': lambda account: account.is_active,
+    'created_at': lambda account: account.created_at.isoformat() if account.created_at else None
+}
+
+TRANSACTION_FIELDS = {
+    'transaction_id': lambda transaction: transaction.transaction_id,
+    'created_at': lambda transaction: transaction.created_at.isoformat() if transaction.created_at else None,
+    'completed_at': lambda transaction: transaction.completed_at.isoformat() if transaction.completed_at else None,
+    'account_from': _account_from,
+    'account_to': _account_to,
+    'amount': lambda transaction: str(transaction.amount),
+    'amount_minor': lambda transaction: transaction.amount_minor,
+    'currency': lambda transaction: transaction.currency,
+    'converted_amount': lambda transaction: str(from_minor(transaction.converted_amount_minor, transaction.converted_currency))
+        if transaction.converted_amount_minor is not None else None,
+    'converted_currency': lambda transaction: transaction.converted_currency,
+    'status': lambda transaction: transaction.status,
+    'explanation': lambda transaction: transaction.explanation,
+    'sender_name': lambda transaction: transaction.sender_name,
+    'receiver_name': lambda transaction: transaction.receiver_name
+}
+
+BALANCE_FIELDS = ('account_number', 'currency', 'balance', 'balance_minor')
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Authentication required'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def _selected_fields(available, default=None):
+    """Return the fields requested with ``?fields=a,b``, or all of them."""
+    requested = request.args.get('fields')
+    if not requested:
+        return list(default or available)
+    fields = [field.strip() for field in requested.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        raise _BadRequest(f"Unknown fields: {', '.join(unknown)}" if unknown else 'No fields selected')
+    return fields
+
+def _serialize(obj, fields, available):
+    return {field: available[field](obj) for field in fields}
+
+def _page_size():
+    try:
+        limit = int(request.args.get('limit', current_app.config.get('HISTORY_PAGE_SIZE', 50)))
+    except ValueError:
+        raise _BadRequest('Invalid limit')
+    return max(1, min(limit, current_app.config.get('API_MAX_PAGE_SIZE', 200)))
+
+def _etag(account_ids):
+    """An ETag for the user's view of the accounts and the current query string."""
+    version = (current_user.id, tuple(account_ids), history_version(account_ids), request.full_path)
+    return hashlib.sha256(repr(version).encode('utf-8')).hexdigest()
+
+def _conditional(account_ids, build):
+    """Answer with 304 if the client's ETag is current, otherwise call ``build``.
+
+    The ETag only needs the account ids and their history version, so a 304
+    is served without loading any account or transaction rows.
+    """
+    try:
+        etag = _etag(account_ids)
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = jsonify(build())
+    except _BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+    response.set_etag(etag)
+    # Clients keep the response but must revalidate it on every use
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _user_account_ids():
+    return list(db.session.execute(
+        db.select(Account.id).where(Account.user_id == current_user.id).order_by(Account.id)
+    ).scalars())
+
+def _account_id(account_number):
+    """Return the id of an account the user may read, or None."""
+    row = db.session.execute(
+        db.select(Account.id, Account.user_id).where(Account.account_number == account_number)
+    ).first()
+    if not row or (row.user_id != current_user.id and not current_user.is_admin):
+        return None
+    return row.id
+
+def _history_page(account_ids):
+    fields = _selected_fields(TRANSACTION_FIELDS)
+    try:
+        transactions, next_cursor = transaction_history(
+            account_ids, limit=_page_size(), cursor=request.args.get('cursor')
+        )
+    except ValueError:
+        raise _BadRequest('Invalid cursor')
+    return {
+        'transactions': [_serialize(transaction, fields, TRANSACTION_FIELDS) for transaction in transactions],
+        'next_cursor': next_cursor
+    }
+
+@api_bp.route('/accounts', methods=['GET'])
+@api_login_required
+def list_accounts():
+    """The user's accounts with their balances."""
+    account_ids = _user_account_ids()
+
+    def build():
+        fields = _selected_fields(ACCOUNT_FIELDS)
+        accounts = Account.query.filter(Account.id.in_(account_ids)).order_by(Account.id).all() if account_ids else []
+        return {'accounts': [_serialize(account, fields, ACCOUNT_FIELDS) for account in accounts]}
+
+    return _conditional(account_ids, build)
+
+@api_bp.route('/accounts/<account_number>', methods=['GET'])
+@api_login_required
+def get_account(account_number):
+    """One account with its balance."""
+    account_id = _account_id(account_number)
+    if account_id is None:
+        return jsonify({'error': 'Account not found'}), 404
+
+    def build():
+        fields = _selected_fields(ACCOUNT_FIELDS)
+        return _serialize(db.session.get(Account, account_id), fields, ACCOUNT_FIELDS)
+
+    return _conditional([account_id], build)
+
+@api_bp.route('/accounts/<account_number>/balance', methods=['GET'])
+@api_login_required
+def get_balance(account_number):
+    """Just the balance of an account, for polling."""
+    account_id = _account_id(account_number)
+    if account_id is None:
+        return jsonify({'error': 'Account not found'}), 404
+
+    def build():
+        return _serialize(db.session.get(Account, account_id), BALANCE_FIELDS, ACCOUNT_FIELDS)
+
+    return _conditional([account_id], build)
+
+@api_bp.route('/accounts/<account_number>/transactions', methods=['GET'])
+@api_login_required
+def account_transactions(account_number):
+    """A page of an account's transactions, newest first.
+
+    Pass the returned ``next_cursor`` as ``?cursor=`` for the next page.
+    """
+    account_id = _account_id(account_number)
+    if account_id is None:
+        return jsonify({'error': 'Account not found'}), 404
+
+    return _conditional([account_id], lambda: _history_page([account_id]))
+
+@api_bp.route('/transactions', methods=['GET'])
+@api_login_required
+def list_transactions():
+    """A page of the transactions of all the user's accounts, newest first."""
+    account_ids = _user_account_ids()
+    return _conditional(account_ids, lambda: _history_page(account_ids))
@@ -1,7 +1,6 @@
 import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from dotenv import load_dotenv
 
@@ -10,7 +9,6 @@ load_dotenv()
 
 # Initialize Flask extensions
 db = SQLAlchemy()
-migrate = Migrate()
 login_manager = LoginManager()
 
 def create_app(test_config=None):
@@ -25,7 +23,76 @@ def create_app(test_config=None):
         BANK_PREFIX=os.environ.get('BANK_PREFIX', 'BNK'),
         CENTRAL_BANK_URL=os.environ.get('CENTRAL_BANK_URL', 'http://localhost:5001'),
         CENTRAL_BANK_API_KEY=os.environ.get('CENTRAL_BANK_API_KEY', 'test_api_key'),
-        TEST_MODE=os.environ.get('TEST_MODE', 'False') == 'True'
+        TEST_MODE=os.environ.get('TEST_MODE', 'False') == 'True',
+        MIGRATE_ENABLED=os.environ.get('MIGRATE_ENABLED', 'True') == 'True',
+        HISTORY_PAGE_SIZE=int(os.environ.get('HISTORY_PAGE_SIZE', 50)),
+        API_MAX_PAGE_SIZE=int(os.environ.get('API_MAX_PAGE_SIZE', 200)),
+        BANK_DIRECTORY_TTL=int(os.environ.get('BANK_DIRECTORY_TTL', 300)),
+        BANK_DIRECTORY_NEGATIVE_TTL=int(os.environ.get('BANK_DIRECTORY_NEGATIVE_TTL', 30)),
+        BANK_DIRECTORY_FAILURE_TTL=int(os.environ.get('BANK_DIRECTORY_FAILURE_TTL', 5)),
+        BANK_DIRECTORY_STALE_TTL=int(os.environ.get('BANK_DIRECTORY_STALE_TTL', 600)),
+        BANK_DIRECTORY_MAX_SIZE=int(os.environ.get('BANK_DIRECTORY_MAX_SIZE', 1024)),
+        JWKS_CACHE_TTL=int(os.environ.get('JWKS_CACHE_TTL', 300)),
+        JWKS_CACHE_MAX_TTL=int(os.environ.get('JWKS_CACHE_MAX_TTL', 86400)),
+        JWKS_REFETCH_INTERVAL=int(os.environ.get('JWKS_REFETCH_INTERVAL', 30)),
+        JWKS_MAX_AGE=int(os.environ.get('JWKS_MAX_AGE', 300)),
+        BANK_SETTINGS_CHECK_INTERVAL=int(os.environ.get('BANK_SETTINGS_CHECK_INTERVAL', os.environ.get('KEY_MATERIAL_CHECK_INTERVAL', 30))),
+        HTTP_CONNECT_TIMEOUT=float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05)),
+        HTTP_READ_TIMEOUT=float(os.environ.get('HTTP_READ_TIMEOUT', 10)),
+        HTTP_POOL_CONNECTIONS=int(os.environ.get('HTTP_POOL_CONNECTIONS', 32)),
+        HTTP_POOL_MAXSIZE=int(os.environ.get('HTTP_POOL_MAXSIZE', 32)),
+        HTTP_RETRIES=int(os.environ.get('HTTP_RETRIES', 2)),
+        HTTP_RETRY_BACKOFF=float(os.environ.get('HTTP_RETRY_BACKOFF', 0.2)),
+        CIRCUIT_BREAKER_THRESHOLD=int(os.environ.get('CIRCUIT_BREAKER_THRESHOLD', 5)),
+        CIRCUIT_BREAKER_RESET=float(os.environ.get('CIRCUIT_BREAKER_RESET', 30)),
+        B2B_HTTP_TIMEOUT=float(os.environ.get('B2B_HTTP_TIMEOUT', 10)),
+        B2B_BATCH_MAX_ITEMS=int(os.environ.get('B2B_BATCH_MAX_ITEMS', 1000)),
+        B2B_OUTBOX_ENABLED=os.environ.get('B2B_OUTBOX_ENABLED', 'False') == 'True',
+        B2B_JWT_TTL=int(os.environ.get('B2B_JWT_TTL', 300)),
+        B2B_JWT_LEEWAY=int(os.environ.get('B2B_JWT_LEEWAY', 30)),
+        B2B_LEGACY_SENDERS=os.environ.get('B2B_LEGACY_SENDERS', ''),
+        B2B_IDEMPOTENCY_TTL=int(os.environ.get('B2B_IDEMPOTENCY_TTL', 7 * 24 * 3600)),
+        B2B_VERIFY_EXECUTOR=os.environ.get('B2B_VERIFY_EXECUTOR', 'inline'),
+        B2B_VERIFY_WORKERS=int(os.environ.get('B2B_VERIFY_WORKERS', 0)),
+        B2B_VERIFY_MIN_BATCH=int(os.environ.get('B2B_VERIFY_MIN_BATCH', 16)),
+        B2B_VERIFY_CHUNK_SIZE=int(os.environ.get('B2B_VERIFY_CHUNK_SIZE', 64)),
+        B2B_VERIFY_MAX_PENDING=int(os.environ.get('B2B_VERIFY_MAX_PENDING', 10000)),
+        B2B_VERIFY_QUEUE_TIMEOUT=float(os.environ.get('B2B_VERIFY_QUEUE_TIMEOUT', 5)),
+        # App processes on this host (e.g. gunicorn workers) sharing its cores
+        B2B_VERIFY_HOST_PROCESSES=int(os.environ.get('B2B_VERIFY_HOST_PROCESSES', os.environ.get('WEB_CONCURRENCY', 1))),
+        B2B_VERIFY_PRESTART=os.environ.get('B2B_VERIFY_PRESTART', 'True') == 'True',
+        INGRESS_MAX_IN_FLIGHT=int(os.environ.get('INGRESS_MAX_IN_FLIGHT', 1000)),
+        INGRESS_DB_WORKERS=int(os.environ.get('INGRESS_DB_WORKERS', 8)),
+        METRICS_ENABLED=os.environ.get('METRICS_ENABLED', 'False') == 'True',
+        METRICS_PATH=os.environ.get('METRICS_PATH', '/metrics'),
+        PROFILE_ENABLED=os.environ.get('PROFILE_ENABLED', 'False') == 'True',
+        PROFILE_SAMPLE_RATE=float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01)),
+        PROFILE_SLOW_THRESHOLD=float(os.environ.get('PROFILE_SLOW_THRESHOLD', 1.0)),
+        PROFILE_ENDPOINTS=os.environ.get('PROFILE_ENDPOINTS', ''),
+        PROFILE_STACK_INTERVAL=float(os.environ.get('PROFILE_STACK_INTERVAL', 0.005)),
+        PROFILE_DIR=os.environ.get('PROFILE_DIR', 'profiles'),
+        PROFILE_MAX_FILES=int(os.environ.get('PROFILE_MAX_FILES', 500)),
+        STATEMENT_EXPORT_BATCH_SIZE=int(os.environ.get('STATEMENT_EXPORT_BATCH_SIZE', 1000)),
+        LEDGER_SNAPSHOT_LAG=int(os.environ.get('LEDGER_SNAPSHOT_LAG', 300)),
+        PAGE_CACHE_BACKEND=os.environ.get('PAGE_CACHE_BACKEND', 'local'),
+        PAGE_CACHE_URL=os.environ.get('PAGE_CACHE_URL', ''),
+        PAGE_CACHE_TTL=int(os.environ.get('PAGE_CACHE_TTL', 300)),
+        PAGE_CACHE_MAX_SIZE=int(os.environ.get('PAGE_CACHE_MAX_SIZE', 10000)),
+        FX_BASE_CURRENCY=os.environ.get('FX_BASE_CURRENCY', 'EUR'),
+        FX_RATE_PROVIDER=os.environ.get('FX_RATE_PROVIDER', 'file'),
+        FX_RATES_FILE=os.environ.get('FX_RATES_FILE', 'fx_rates.json'),
+        FX_STATIC_RATES=os.environ.get('FX_STATIC_RATES', ''),
+        FX_CHECK_INTERVAL=int(os.environ.get('FX_CHECK_INTERVAL', 60)),
+        OUTBOX_WORKERS=int(os.environ.get('OUTBOX_WORKERS', 8)),
+        OUTBOX_PER_BANK_CONCURRENCY=int(os.environ.get('OUTBOX_PER_BANK_CONCURRENCY', 4)),
+        OUTBOX_MAX_ATTEMPTS=int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8)),
+        OUTBOX_BACKOFF_BASE=float(os.environ.get('OUTBOX_BACKOFF_BASE', 2)),
+        OUTBOX_BACKOFF_MAX=float(os.environ.get('OUTBOX_BACKOFF_MAX', 300)),
+        OUTBOX_POLL_INTERVAL=float(os.environ.get('OUTBOX_POLL_INTERVAL', 1)),
+        OUTBOX_LEASE=int(os.environ.get('OUTBOX_LEASE', 60)),
+        OUTBOX_BATCH_SIZE=int(os.environ.get('OUTBOX_BATCH_SIZE', 100)),
+        OUTBOX_B2B_BATCH_SIZE=int(os.environ.get('OUTBOX_B2B_BATCH_SIZE', 1)),
+        OUTBOX_B2B_BATCH_RETRY=int(os.environ.get('OUTBOX_B2B_BATCH_RETRY', 600))
     )
 
     # Override config with test config if passed
@@ -40,9 +107,30 @@ def create_app(test_config=None):
 
     # Initialize extensions with app
     db.init_app(app)
-    migrate.init_app(app, db)
+    if app.config['MIGRATE_ENABLED']:
+        # Alembic is slow to import; processes that never run `flask db` can skip it
+        from flask_migrate import Migrate
+        Migrate(app, db)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
+    
+    # Invalidate cached page fragments when balances change
+    from .utils.page_cache import init_page_cache
+    init_page_cache(app)
+
+    # Opt-in request, DB, HTTP and JWT metrics
+    from .utils.metrics import init_metrics
+    init_metrics(app)
+
+    # Opt-in profiling of sampled and slow requests
+    from .utils.profiling import init_profiling
+    init_profiling(app)
+
+    # Spawn the JWT verification pool now rather than in the first large
+    # batch (imported only here, it loads multiprocessing and cryptography)
+    if app.config['B2B_VERIFY_EXECUTOR'] != 'inline' and app.config['B2B_VERIFY_PRESTART']:
+        from .utils.verification import init_verification
+        init_verification(app)
 
     # Register blueprints
     from .auth import auth_bp
@@ -0,0 +1 @@
+"""Benchmarks and stress tests, run through the ``flask`` CLI commands."""
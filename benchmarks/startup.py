@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+# The top-level package the app lives in
+PACKAGE = __name__.split('.')[0]
+
+# Building the app must not import these; they load on first use
+LAZY_MODULES = ('cryptography', 'jwt', 'requests', 'urllib3', 'multiprocessing', 'httpx', 'cProfile', 'pstats')
+
+DEFAULT_STATEMENT = f'from {PACKAGE}.app import create_app; create_app()'
+
+# Runs the statement and reports its time and the modules it left loaded
+_PROBE = '''
+import json, sys, time
+_started = time.perf_counter()
+exec(compile({statement!r}, '<startup>', 'exec'))
+print(json.dumps({{'seconds': time.perf_counter() - _started, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def _run_probe(statement, env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', _PROBE.format(statement=statement)]
+    started = time.perf_counter()
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{completed.stderr.strip()[-2000:]}")
+    probe = json.loads(completed.stdout.strip().splitlines()[-1])
+    return wall, probe, completed.stderr
+
+def parse_importtime(output):
+    """Parse ``-X importtime`` output into ``{module: (self_us, cumulative_us)}``."""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+def measure_startup(statement=DEFAULT_STATEMENT, runs=5, top=15, env=None):
+    """Time a cold start of the app in fresh interpreters.
+
+    ``runs`` processes run ``statement`` (by default building the app);
+    the median process wall time and statement time are reported. One
+    more run under ``-X importtime`` gives the slowest imports, and which
+    of ``LAZY_MODULES`` got loaded.
+    """
+    env = dict(os.environ if env is None else env)
+    # Children import the package from wherever this process found it
+    env['PYTHONPATH'] = os.pathsep.join([path for path in sys.path if path] + [env.get('PYTHONPATH', '')])
+
+    walls, statements = [], []
+    for _ in range(runs):
+        wall, probe, _ = _run_probe(statement, env)
+        walls.append(wall)
+        statements.append(probe['seconds'])
+
+    _, probe, importtime = _run_probe(statement, env, importtime=True)
+    imports = parse_importtime(importtime)
+    slowest = sorted(imports.items(), key=lambda item: -item[1][1])[:top]
+    loaded = set(probe['modules'])
+    return {
+        'statement': statement,
+        'python': sys.version.split()[0],
+        'runs': runs,
+        'process_ms': round(_median(walls) * 1000, 1),
+        'startup_ms': round(_median(statements) * 1000, 1),
+        'modules_loaded': len(loaded),
+        'lazy_modules_loaded': [name for name in LAZY_MODULES if name in loaded],
+        'slowest_imports': [
+            {'module': name, 'cumulative_ms': round(cumulative / 1000, 1), 'self_ms': round(own / 1000, 1)}
+            for name, (own, cumulative) in slowest
+        ]
+    }
+
+def check_startup_budget(result, budget_ms=None):
+    """Return the problems with a startup result: over budget, or lazy modules loaded eagerly."""
+    problems = []
+    if budget_ms is not None and result['startup_ms'] > budget_ms:
+        problems.append(f"Startup took {result['startup_ms']} ms, over the {budget_ms} ms budget")
+    if result['lazy_modules_loaded']:
+        problems.append(f"Imported at startup instead of on first use: {', '.join(result['lazy_modules_loaded'])}")
+    return problems
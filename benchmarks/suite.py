@@ -0,0 +1,308 @@
+import math
+import platform
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import func
+
+from ..models import User, Account, Transaction, BankSettings
+from .. import db
+from ..utils.crypto import generate_key_pair, load_public_key
+from ..utils.ledger import post_entries, ledger_drift
+from ..utils.query_timing import add_query_listener, remove_query_listener
+from ..utils.settings import invalidate_bank_settings
+from ..simulator import FaultProfile, SimulatedBank, SimulatorServer
+
+SCENARIOS = ('internal', 'outgoing', 'incoming', 'history')
+
+# Metrics compared between runs, and whether a higher value is better
+COMPARED_METRICS = {
+    'throughput': True,
+    'latency_ms.p50': False,
+    'latency_ms.p95': False,
+    'latency_ms.p99': False,
+    'queries.mean': False
+}
+
+BENCH_PASSWORD = 'bench-password'
+BENCH_API_KEY = 'bench-api-key'
+PARTNER_PREFIX = 'PTR'
+
+
+class _QueryCounter:
+    """Counts the queries and their time of the request on the current thread."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.local = threading.local()
+
+    def _record(self, statement, seconds):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+        self.local.time = getattr(self.local, 'time', 0.0) + seconds
+
+    def __enter__(self):
+        add_query_listener(self.engine, self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_query_listener(self.engine, self._record)
+
+    def reset(self):
+        self.local.count = 0
+        self.local.time = 0.0
+
+    def read(self):
+        return getattr(self.local, 'count', 0), getattr(self.local, 'time', 0.0)
+
+
+def _percentile(values, fraction):
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+def _summary(values, scale=1.0):
+    values = sorted(value * scale for value in values)
+    if not values:
+        return {}
+    return {
+        'mean': round(sum(values) / len(values), 3),
+        'p50': round(_percentile(values, 0.50), 3),
+        'p90': round(_percentile(values, 0.90), 3),
+        'p95': round(_percentile(values, 0.95), 3),
+        'p99': round(_percentile(values, 0.99), 3),
+        'max': round(values[-1], 3)
+    }
+
+def _setup_bank(app, users, accounts_per_user, initial_balance_minor):
+    """Create our bank's settings and the benchmark users and accounts."""
+    with app.app_context():
+        db.create_all()
+        bank_settings = BankSettings.query.first()
+        if not bank_settings:
+            bank_settings = BankSettings(bank_name='Benchmark Bank', bank_prefix=app.config.get('BANK_PREFIX'))
+            db.session.add(bank_settings)
+        if not bank_settings.private_key:
+            bank_settings.private_key, bank_settings.public_key = generate_key_pair()
+        bank_settings.api_key = BENCH_API_KEY
+        bank_settings.updated_at = datetime.utcnow()
+
+        run = uuid.uuid4().hex[:6]
+        owners = []
+        for index in range(users):
+            user = User(username=f'bench-{run}-{index}', full_name=f'Bench User {index}')
+            user.set_password(BENCH_PASSWORD)
+            db.session.add(user)
+            owners.append(user)
+        db.session.flush()
+        accounts = [
+            Account(account_number=Account.generate_account_number(bank_settings.bank_prefix),
+                    user_id=user.id, balance_minor=initial_balance_minor, currency='EUR')
+            for user in owners
+            for _ in range(accounts_per_user)
+        ]
+        db.session.add_all(accounts)
+        db.session.flush()
+        post_entries([
+            {'account_id': account.id, 'amount_minor': initial_balance_minor, 'kind': 'opening'}
+            for account in accounts
+        ])
+        db.session.commit()
+        invalidate_bank_settings()
+
+        numbers = {}
+        for account in accounts:
+            numbers.setdefault(account.user_id, []).append(account.account_number)
+        sender_key = load_public_key(bank_settings.public_key)
+        return [(user.username, numbers[user.id]) for user in owners], bank_settings.bank_prefix, sender_key
+
+def _login(app, username):
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': username, 'password': BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f'Could not log in benchmark user {username}')
+    return client
+
+def _incoming_token(partner, account_to, amount_minor):
+    return partner.sign({
+        'accountFrom': partner.account_number(),
+        'accountTo': account_to,
+        'currency': 'EUR',
+        'amountMinor': amount_minor,
+        'explanation': 'benchmark incoming',
+        'senderName': 'Partner Customer',
+        'transferId': uuid.uuid4().hex
+    })
+
+def _request_plan(scenario, count, owners, partner, rng):
+    """Return ``count`` requests as ``(method, url, kwargs)``.
+
+    Request ``i`` is sent by worker ``i % len(owners)`` as that worker's user.
+    """
+    all_accounts = [number for _, numbers in owners for number in numbers]
+    plan = []
+    for index in range(count):
+        account_from = rng.choice(owners[index % len(owners)][1])
+        amount = f'{rng.randint(1, 500) / 100:.2f}'
+        if scenario == 'internal':
+            account_to = rng.choice([number for number in all_accounts if number != account_from])
+            plan.append(('POST', f'/accounts/transfer/{account_from}',
+                         {'data': {'account_to': account_to, 'amount': amount, 'explanation': 'benchmark internal'}}))
+        elif scenario == 'outgoing':
+            plan.append(('POST', f'/accounts/transfer/{account_from}',
+                         {'data': {'account_to': partner.account_number(), 'amount': amount, 'explanation': 'benchmark outgoing'}}))
+        elif scenario == 'incoming':
+            # Signed up front, so the partner's signing is not timed
+            token = _incoming_token(partner, rng.choice(all_accounts), rng.randint(1, 500))
+            plan.append(('POST', '/transactions/b2b', {'json': {'jwt': token}}))
+        elif scenario == 'history':
+            plan.append(('GET', f'/api/accounts/{account_from}/transactions?limit=50', {}))
+        else:
+            raise ValueError(f'Unknown benchmark scenario: {scenario}')
+    return plan
+
+def _run_scenario(counter, clients, plan):
+    latencies = []
+    queries = []
+    query_times = []
+    statuses = Counter()
+    errors = []
+    lock = threading.Lock()
+
+    def worker(client, requests):
+        # Test clients are not thread safe, so every worker has its own
+        for method, url, kwargs in requests:
+            counter.reset()
+            started = time.perf_counter()
+            try:
+                status = client.open(url, method=method, **kwargs).status_code
+            except Exception as e:
+                status = 'exception'
+                with lock:
+                    if len(errors) < 10:
+                        errors.append(repr(e))
+            elapsed = time.perf_counter() - started
+            count, query_time = counter.read()
+            with lock:
+                latencies.append(elapsed)
+                queries.append(count)
+                query_times.append(query_time)
+                statuses[str(status)] += 1
+
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=worker, args=(client, plan[index::len(clients)]))
+        for index, client in enumerate(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    failed = sum(count for status, count in statuses.items() if status == 'exception' or int(status) >= 500)
+    return {
+        'requests': len(plan),
+        'failed': failed,
+        'statuses': dict(statuses),
+        'errors': errors,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(plan) / elapsed, 1) if elapsed else None,
+        'latency_ms': _summary(latencies, 1000),
+        'queries': _summary(queries),
+        'query_time_ms': _summary(query_times, 1000)
+    }
+
+def _transaction_outcomes(explanation):
+    return dict(db.session.query(Transaction.status, func.count(Transaction.id))
+                .filter(Transaction.explanation == explanation)
+                .group_by(Transaction.status).all())
+
+def run_benchmarks(app, scenarios=SCENARIOS, workers=8, requests=200, warmup=10,
+                   accounts_per_user=2, initial_balance_minor=10 ** 9, partner_faults=None, seed=None):
+    """Run the benchmark scenarios against ``app`` and return the results.
+
+    A simulated Central Bank and partner bank are started on a local port
+    and the app is pointed at them, so the run needs no network and
+    exercises the real HTTP, JWKS and RS256 signing and verification code.
+    ``partner_faults`` (a ``FaultProfile``) makes the partner slow or
+    unreliable. Each scenario sends ``warmup`` untimed requests and then
+    ``requests`` timed ones from ``workers`` threads, each logged in as its
+    own user through a Flask test client (client-side HTTP is not
+    measured). Results hold the throughput, latency percentiles and DB
+    queries per request of every scenario.
+    """
+    rng = random.Random(seed)
+    partner = SimulatedBank(PARTNER_PREFIX, faults=partner_faults or FaultProfile())
+    app.config.update(TEST_MODE=False, B2B_OUTBOX_ENABLED=False, WTF_CSRF_ENABLED=False)
+
+    owners, bank_prefix, sender_key = _setup_bank(app, workers, accounts_per_user, initial_balance_minor)
+    # The partner checks our signatures like a real bank would
+    server = SimulatorServer([partner], api_key=BENCH_API_KEY, sender_keys={bank_prefix: sender_key})
+    app.config['CENTRAL_BANK_URL'] = server.url
+
+    with app.app_context():
+        engine = db.engine
+        dialect = engine.dialect.name
+
+    results = {
+        'started_at': datetime.utcnow().isoformat(),
+        'database': dialect,
+        'python': platform.python_version(),
+        'workers': workers,
+        'requests': requests,
+        'partner_faults': partner.faults.as_dict(),
+        'scenarios': {}
+    }
+    with server, _QueryCounter(engine) as counter:
+        clients = [_login(app, username) for username, _ in owners]
+        for scenario in scenarios:
+            if warmup:
+                _run_scenario(counter, clients, _request_plan(scenario, warmup, owners, partner, rng))
+            plan = _request_plan(scenario, requests, owners, partner, rng)
+            results['scenarios'][scenario] = _run_scenario(counter, clients, plan)
+
+    with app.app_context():
+        # Outcomes of the transfers each scenario created, warm-up included
+        for scenario in ('internal', 'outgoing', 'incoming'):
+            if scenario in results['scenarios']:
+                results['scenarios'][scenario]['transactions'] = _transaction_outcomes(f'benchmark {scenario}')
+        results['partner_received'] = partner.stats['received']
+        results['ledger_drift_accounts'] = sum(1 for _ in ledger_drift())
+    return results
+
+def _metric(scenario_result, name):
+    value = scenario_result
+    for part in name.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def compare_results(baseline, current, threshold=0.1):
+    """Compare two benchmark results scenario by scenario.
+
+    Returns rows of ``(scenario, metric, baseline, current, change,
+    regression)``. ``change`` is relative; a metric regressed if it got
+    worse by more than ``threshold``, or, for query counts, by any amount.
+    """
+    rows = []
+    for scenario, current_result in current.get('scenarios', {}).items():
+        baseline_result = baseline.get('scenarios', {}).get(scenario)
+        if baseline_result is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before = _metric(baseline_result, metric)
+            after = _metric(current_result, metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            if metric.startswith('queries.'):
+                regression = after > before
+            else:
+                regression = worse > threshold
+            rows.append((scenario, metric, before, after, round(change, 4), regression))
+    return rows
@@ -0,0 +1,195 @@
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from ..models import User, Account, AccountBalanceShard, Transaction
+from .. import db
+from ..utils.transfer_engine import transfer, credit, set_balance_shards, InsufficientFunds
+from ..utils.ledger import post_entries
+
+
+def _setup_accounts(count, initial_balance_minor):
+    db.create_all()
+    user = User(username=f'stress-{uuid.uuid4().hex[:8]}', full_name='Stress Test')
+    db.session.add(user)
+    db.session.flush()
+    accounts = [
+        Account(account_number=Account.generate_account_number('STR'), user_id=user.id,
+                balance_minor=initial_balance_minor, currency='EUR')
+        for _ in range(count)
+    ]
+    db.session.add_all(accounts)
+    db.session.flush()
+    post_entries([
+        {'account_id': account.id, 'amount_minor': initial_balance_minor, 'kind': 'opening'}
+        for account in accounts
+    ])
+    db.session.commit()
+    return [account.id for account in accounts]
+
+def _record(from_id, to_id, amount_minor):
+    db.session.add(Transaction(
+        transaction_id=Transaction.generate_transaction_id(),
+        account_from_id=from_id,
+        account_to_id=to_id,
+        amount_minor=amount_minor,
+        currency='EUR',
+        explanation='stress test',
+        status='completed',
+        is_internal=from_id is not None,
+        completed_at=datetime.utcnow()
+    ))
+
+def _atomic_transfer(from_id, to_id, amount_minor, shards=0):
+    transfer(from_id, to_id, amount_minor, to_shards=shards)
+    _record(from_id, to_id, amount_minor)
+    db.session.commit()
+
+def _atomic_credit(to_id, amount_minor, shards=0):
+    credit(to_id, amount_minor, shards=shards)
+    _record(None, to_id, amount_minor)
+    db.session.commit()
+
+def _naive_transfer(from_id, to_id, amount_minor, shards=0):
+    # The read-check-write pattern the views used before the transfer engine
+    source = db.session.get(Account, from_id)
+    destination = db.session.get(Account, to_id)
+    if source.balance_minor < amount_minor:
+        db.session.rollback()
+        raise InsufficientFunds()
+    source.balance_minor -= amount_minor
+    destination.balance_minor += amount_minor
+    _record(from_id, to_id, amount_minor)
+    db.session.commit()
+
+def _naive_credit(to_id, amount_minor, shards=0):
+    destination = db.session.get(Account, to_id)
+    destination.balance_minor += amount_minor
+    _record(None, to_id, amount_minor)
+    db.session.commit()
+
+def check_balances(account_ids, initial_balance_minor):
+    """Compare every balance with the transactions recorded against it.
+
+    Returns the number of accounts whose balance drifted from
+    ``initial + received - sent``, the total drift, and the number of
+    negative balances.
+    """
+    received = dict(db.session.query(Transaction.account_to_id, func.sum(Transaction.amount_minor))
+                    .filter(Transaction.account_to_id.in_(account_ids))
+                    .group_by(Transaction.account_to_id).all())
+    sent = dict(db.session.query(Transaction.account_from_id, func.sum(Transaction.amount_minor))
+                .filter(Transaction.account_from_id.in_(account_ids))
+                .group_by(Transaction.account_from_id).all())
+    balances = dict(db.session.query(Account.id, Account.balance_minor).filter(Account.id.in_(account_ids)).all())
+    shard_balances = db.session.query(AccountBalanceShard.account_id, func.sum(AccountBalanceShard.balance_minor)) \
+        .filter(AccountBalanceShard.account_id.in_(account_ids)) \
+        .group_by(AccountBalanceShard.account_id).all()
+    for account_id, shard_total in shard_balances:
+        balances[account_id] += int(shard_total or 0)
+
+    drifted = 0
+    total_drift = 0
+    for account_id in account_ids:
+        expected = initial_balance_minor + int(received.get(account_id) or 0) - int(sent.get(account_id) or 0)
+        drift = balances[account_id] - expected
+        if drift:
+            drifted += 1
+            total_drift += drift
+    negative = sum(1 for balance in balances.values() if balance < 0)
+    return drifted, total_drift, negative
+
+def run_transfer_stress(app, accounts=4, workers=16, operations=2000, initial_balance_minor=100000,
+                        credit_ratio=0.3, naive=False, hot_shards=0, seed=None):
+    """Hammer a few hot accounts with concurrent transfers and credits.
+
+    ``workers`` threads share ``operations`` random internal transfers and
+    incoming credits (``credit_ratio`` of them) over ``accounts`` accounts,
+    committing each one separately. Afterwards every balance is checked
+    against the recorded transactions. ``naive`` uses ORM read-modify-write
+    instead of the transfer engine, to show the lost updates it causes.
+    ``hot_shards`` turns the credited account into a sharded hot account.
+    """
+    rng = random.Random(seed)
+    with app.app_context():
+        account_ids = _setup_accounts(accounts, initial_balance_minor)
+        if hot_shards:
+            set_balance_shards(account_ids[0], hot_shards)
+            db.session.commit()
+    shards = {account_ids[0]: hot_shards}
+
+    do_transfer, do_credit = (_naive_transfer, _naive_credit) if naive else (_atomic_transfer, _atomic_credit)
+    plan = []
+    for _ in range(operations):
+        amount_minor = rng.randint(1, initial_balance_minor // 20)
+        if rng.random() < credit_ratio:
+            # Incoming credits all land on the first (merchant) account
+            plan.append((None, account_ids[0], amount_minor))
+        else:
+            from_id, to_id = rng.sample(account_ids, 2)
+            plan.append((from_id, to_id, amount_minor))
+
+    counters = {'completed': 0, 'rejected': 0, 'retries': 0, 'errors': 0}
+    lock = threading.Lock()
+    next_index = iter(range(len(plan)))
+
+    def count(name):
+        with lock:
+            counters[name] += 1
+
+    def worker():
+        with app.app_context():
+            while True:
+                with lock:
+                    index = next(next_index, None)
+                if index is None:
+                    return
+                from_id, to_id, amount_minor = plan[index]
+                for _ in range(20):
+                    try:
+                        if from_id is None:
+                            do_credit(to_id, amount_minor, shards.get(to_id, 0))
+                        else:
+                            do_transfer(from_id, to_id, amount_minor, shards.get(to_id, 0))
+                        count('completed')
+                        break
+                    except InsufficientFunds:
+                        count('rejected')
+                        break
+                    except OperationalError:
+                        # Lock timeouts and deadlock victims are retried
+                        db.session.rollback()
+                        count('retries')
+                        time.sleep(0.001)
+                else:
+                    count('errors')
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        drifted, total_drift, negative = check_balances(account_ids, initial_balance_minor)
+
+    return dict(
+        counters,
+        mode='naive' if naive else 'atomic',
+        accounts=accounts,
+        hot_shards=hot_shards,
+        workers=workers,
+        operations=operations,
+        elapsed=round(elapsed, 3),
+        operations_per_second=round(operations / elapsed, 1) if elapsed else None,
+        drifted_accounts=drifted,
+        total_drift_minor=total_drift,
+        negative_balances=negative,
+        ok=not drifted and not negative
+    )
@@ -1,8 +1,36 @@
 import click
+import time
+from datetime import datetime
+from flask import current_app
 from flask.cli import with_appcontext
-from ..models import User, Account, Transaction
+from sqlalchemy import text
+from ..models import User, Account, Transaction, BankSettings
 from .. import db
-from ..utils.crypto import generate_key_pair
+from ..utils.settings import invalidate_bank_settings
+from ..utils.money import exponent
+
+# Columns added to tables that already existed in older versions, for
+# `flask upgrade-schema`: (table, column, definition, SQL filling old rows)
+SCHEMA_COLUMNS = (
+    ('account', 'balance_shards', 'INTEGER NOT NULL DEFAULT 0', None),
+    ('transaction', 'sender_name', 'VARCHAR(128)', None),
+    ('transaction', 'attempts', 'INTEGER DEFAULT 0', None),
+    ('transaction', 'next_attempt_at', 'TIMESTAMP', None),
+    ('transaction', 'converted_amount_minor', 'BIGINT', None),
+    ('transaction', 'converted_currency', 'VARCHAR(3)', None),
+    ('transaction', 'exchange_rate', 'NUMERIC(24, 10)', None),
+    ('transaction', 'updated_at', 'TIMESTAMP',
+     'UPDATE "transaction" SET updated_at = COALESCE(completed_at, created_at)'),
+)
+
+# Indexes added to tables that already existed: (table, index name)
+SCHEMA_INDEXES = (
+    ('transaction', 'ix_transaction_from_created'),
+    ('transaction', 'ix_transaction_to_created'),
+    ('transaction', 'ix_transaction_status_next_attempt'),
+    ('transaction', 'ix_transaction_from_updated'),
+    ('ledger_entry', 'ix_ledger_entry_account_id'),
+)
 
 def register_commands(app):
     """Register custom commands for the Flask CLI."""
@@ -18,11 +46,115 @@ def register_commands(app):
     @with_appcontext
     def generate_keys_command():
         """Generate RSA key pair for the bank."""
+        from ..utils.crypto import generate_key_pair
         private_key, public_key = generate_key_pair()
+        
+        bank_settings = BankSettings.query.first()
+        if not bank_settings:
+            bank_settings = BankSettings(bank_prefix=current_app.config.get('BANK_PREFIX'))
+            db.session.add(bank_settings)
+        bank_settings.private_key = private_key
+        bank_settings.public_key = public_key
+        bank_settings.updated_at = datetime.utcnow()
+        db.session.commit()
+        invalidate_bank_settings()
+        
         click.echo('Generated RSA key pair.')
         click.echo(f'Private key: {private_key[:20]}...')
         click.echo(f'Public key: {public_key[:20]}...')
     
+    def _add_columns(inspector):
+        for table, column, definition, fill in SCHEMA_COLUMNS:
+            if column in {existing['name'] for existing in inspector.get_columns(table)}:
+                continue
+            db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'))
+            if fill:
+                db.session.execute(text(fill))
+            click.echo(f'Added column {table}.{column}.')
+    
+    def _migrate_money(inspector):
+        for table, legacy_column, minor_column in (('account', 'balance', 'balance_minor'),
+                                                   ('transaction', 'amount', 'amount_minor')):
+            columns = {column['name'] for column in inspector.get_columns(table)}
+            if minor_column not in columns:
+                default = ' NOT NULL DEFAULT 0' if table == 'account' else ''
+                db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {minor_column} BIGINT{default}'))
+                click.echo(f'Added column {table}.{minor_column}.')
+            if legacy_column not in columns:
+                continue
+            
+            # Convert each currency with its own exponent, rounding away float drift
+            currencies = db.session.execute(text(f'SELECT DISTINCT currency FROM "{table}"')).scalars().all()
+            for currency in currencies:
+                factor = 10 ** exponent(currency)
+                where = 'currency = :currency' if currency is not None else 'currency IS NULL'
+                converted = db.session.execute(
+                    text(f'UPDATE "{table}" SET {minor_column} = CAST(ROUND({legacy_column} * {factor}) AS BIGINT) '
+                         f'WHERE {legacy_column} IS NOT NULL AND {where}'),
+                    {'currency': currency}
+                ).rowcount
+                click.echo(f'Converted {converted} {table} rows in {currency}.')
+            
+            # Keep the Float values for reference, but out of the way of a rerun
+            db.session.execute(text(f'ALTER TABLE "{table}" RENAME COLUMN {legacy_column} TO {legacy_column}_float'))
+            click.echo(f'Renamed {table}.{legacy_column} to {legacy_column}_float.')
+    
+    def _add_indexes(inspector):
+        for table, name in SCHEMA_INDEXES:
+            if name in {existing['name'] for existing in inspector.get_indexes(table)}:
+                continue
+            index = next(index for index in db.metadata.tables[table].indexes if index.name == name)
+            index.create(db.session.connection())
+            click.echo(f'Created index {name}.')
+    
+    @app.cli.command('upgrade-schema')
+    @with_appcontext
+    def upgrade_schema_command():
+        """Bring a database created by an older version up to the current models."""
+        # New tables come from create_all; columns and indexes added to
+        # existing tables are listed in SCHEMA_COLUMNS and SCHEMA_INDEXES
+        db.create_all()
+        inspector = db.inspect(db.session.connection())
+        _add_columns(inspector)
+        _migrate_money(inspector)
+        _add_indexes(inspector)
+        db.session.commit()
+        click.echo('Database schema is up to date.')
+    
+    @app.cli.command('migrate-money')
+    @click.pass_context
+    def migrate_money_command(ctx):
+        """Move Float balances and amounts to integer minor unit columns (runs upgrade-schema)."""
+        ctx.invoke(upgrade_schema_command)
+    
+    @app.cli.command('set-hot-account')
+    @click.argument('account_number')
+    @click.option('--shards', type=int, default=8, help='Number of sub-balances (0 turns sharding off).')
+    @with_appcontext
+    def set_hot_account_command(account_number, shards):
+        """Spread incoming credits to an account over sharded sub-balances."""
+        from ..utils.transfer_engine import set_balance_shards
+        account = Account.query.filter_by(account_number=account_number).first()
+        if not account:
+            click.echo(f'Account not found: {account_number}')
+            raise SystemExit(1)
+        set_balance_shards(account.id, shards)
+        db.session.commit()
+        click.echo(f'Account {account_number} now has {shards} balance shards.')
+    
+    @app.cli.command('consolidate-shards')
+    @with_appcontext
+    def consolidate_shards_command():
+        """Fold the sub-balances of all sharded accounts into their balances."""
+        from ..utils.transfer_engine import consolidate_shards
+        account_ids = db.session.query(Account.id).filter(Account.balance_shards > 0).all()
+        moved_total = 0
+        for (account_id,) in account_ids:
+            moved_total += consolidate_shards(account_id)
+            # One short transaction per account keeps shard locks brief
+            db.session.commit()
+        click.echo(f'Consolidated {len(account_ids)} accounts ({moved_total} minor units moved).')
+    
     @app.cli.command('create-admin')
     @click.argument('username')
     @click.argument('password')
@@ -47,3 +179,384 @@ def register_commands(app):
             click.echo(f'API key: {result.get("api_key")}')
         else:
             click.echo(f'Failed to register with Central Bank: {result.get("error")}')
+    
+    @app.cli.command('outbox-worker')
+    @click.option('--workers', type=int, default=None, help='Number of delivery threads.')
+    @click.option('--per-bank', type=int, default=None, help='Concurrent deliveries per destination bank.')
+    @click.option('--once', is_flag=True, help='Exit when the outbox is drained.')
+    @with_appcontext
+    def outbox_worker_command(workers, per_bank, once):
+        """Deliver queued outgoing B2B transfers."""
+        from ..utils.outbox import OutboxWorker
+        worker = OutboxWorker.from_config(current_app._get_current_object(), workers=workers, per_bank=per_bank)
+        click.echo(f'Outbox worker started with {worker.workers} threads.')
+        started = time.monotonic()
+        try:
+            worker.run(once=once)
+        except KeyboardInterrupt:
+            worker.stop()
+        stats = worker.stats()
+        elapsed = time.monotonic() - started
+        delivered = stats.get('completed', 0)
+        click.echo(f'Completed: {delivered}, retried: {stats.get("retried", 0)}, failed: {stats.get("failed", 0)} '
+                   f'({delivered / elapsed if elapsed else 0:.1f} transfers/s)')
+    
+    @app.cli.command('outbox-status')
+    @with_appcontext
+    def outbox_status_command():
+        """Show outgoing B2B transfers by status."""
+        from ..utils.outbox import outbox_status
+        for status, count in sorted(outbox_status().items()):
+            click.echo(f'{status}: {count}')
+    
+    @app.cli.command('load-fx-rates')
+    @click.option('--provider', default=None, help='Rate provider (file or static, default: FX_RATE_PROVIDER).')
+    @click.option('--file', 'path', default=None, help='JSON rate file for the file provider.')
+    @with_appcontext
+    def load_fx_rates_command(provider, path):
+        """Load exchange rates from the rate provider into the database."""
+        from ..utils.fx import get_rate_provider, FileRateProvider, store_rates
+        try:
+            rate_provider = FileRateProvider(path) if path else get_rate_provider(provider)
+            rates = rate_provider.fetch_rates()
+        except (OSError, ValueError) as e:
+            click.echo(f'Could not load exchange rates: {e}')
+            return
+        count = store_rates(rates, source=rate_provider.name)
+        click.echo(f'Loaded {count} exchange rates.')
+    
+    @app.cli.command('export-statements')
+    @click.option('--account', 'account_number', default=None, help='Account number (default: all accounts).')
+    @click.option('--since', default=None, help='Start date (inclusive), e.g. 2024-01-01.')
+    @click.option('--until', default=None, help='End date (exclusive).')
+    @click.option('--format', 'export_format', type=click.Choice(['csv', 'ndjson']), default='csv')
+    @click.option('--output', type=click.File('w'), default='-', help='Output file (default: stdout).')
+    @with_appcontext
+    def export_statements_command(account_number, since, until, export_format, output):
+        """Stream transactions as CSV or NDJSON."""
+        from ..utils.statements import export_statement, parse_date
+        account_ids = None
+        if account_number:
+            account = Account.query.filter_by(account_number=account_number).first()
+            if not account:
+                click.echo(f'Account {account_number} not found.', err=True)
+                return
+            account_ids = [account.id]
+        try:
+            since, until = parse_date(since), parse_date(until)
+        except ValueError as e:
+            click.echo(f'Invalid date: {e}', err=True)
+            return
+        for chunk in export_statement(export_format, account_ids, since=since, until=until,
+                                      batch_size=current_app.config.get('STATEMENT_EXPORT_BATCH_SIZE', 1000)):
+            output.write(chunk)
+    
+    def _run_import(import_function, source, file_format, chunk_size, rebuild):
+        from ..utils.bulk_import import read_records
+        
+        def progress(stats):
+            click.echo(f'{stats.rows} records read, {stats.inserted} inserted', err=True)
+        
+        result = import_function(read_records(source, file_format), chunk_size=chunk_size,
+                                 rebuild=rebuild, progress=progress)
+        for error in result['errors']:
+            click.echo(f'Skipped {error}', err=True)
+        click.echo(f"Imported {result['inserted']} of {result['rows']} records "
+                   f"({result['skipped']} skipped) in {result['elapsed']}s, "
+                   f"{result['rows_per_second']} rows/s.")
+    
+    @app.cli.command('import-accounts')
+    @click.argument('source', type=click.File('r'))
+    @click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default=None,
+                  help='File format (default: from the file extension).')
+    @click.option('--chunk-size', type=int, default=5000, help='Records per INSERT batch and commit.')
+    @click.option('--no-rebuild', is_flag=True, help='Do not rebuild balances from the ledger afterwards.')
+    @with_appcontext
+    def import_accounts_command(source, file_format, chunk_size, no_rebuild):
+        """Bulk import users and accounts from a CSV or NDJSON file."""
+        from ..utils.bulk_import import import_accounts
+        _run_import(import_accounts, source, file_format, chunk_size, not no_rebuild)
+    
+    @app.cli.command('import-transactions')
+    @click.argument('source', type=click.File('r'))
+    @click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), default=None,
+                  help='File format (default: from the file extension).')
+    @click.option('--chunk-size', type=int, default=5000, help='Records per INSERT batch and commit.')
+    @click.option('--no-rebuild', is_flag=True, help='Do not rebuild balances from the ledger afterwards.')
+    @with_appcontext
+    def import_transactions_command(source, file_format, chunk_size, no_rebuild):
+        """Bulk import transactions from a CSV or NDJSON file."""
+        from ..utils.bulk_import import import_transactions
+        _run_import(import_transactions, source, file_format, chunk_size, not no_rebuild)
+    
+    @app.cli.command('backfill-ledger')
+    @with_appcontext
+    def backfill_ledger_command():
+        """Create ledger entries for accounts from before the ledger."""
+        from ..utils.ledger import backfill_ledger
+        count = backfill_ledger()
+        db.session.commit()
+        click.echo(f'Backfilled ledger entries for {count} accounts.')
+    
+    @app.cli.command('verify-ledger')
+    @with_appcontext
+    def verify_ledger_command():
+        """Check every account balance against the sum of its ledger entries."""
+        from ..utils.ledger import ledger_drift
+        drifted = 0
+        for account_id, balance, ledger_total in ledger_drift():
+            drifted += 1
+            click.echo(f'Account {account_id}: balance {balance}, ledger {ledger_total}')
+        click.echo(f'{drifted} accounts differ from the ledger.')
+    
+    @app.cli.command('rebuild-balances')
+    @with_appcontext
+    def rebuild_balances_command():
+        """Set every account balance to the sum of its ledger entries."""
+        from ..utils.ledger import rebuild_balances
+        count = rebuild_balances()
+        db.session.commit()
+        click.echo(f'Rebuilt {count} balances from the ledger.')
+    
+    @app.cli.command('snapshot-balances')
+    @click.option('--as-of', default=None, help='Snapshot time (default: now minus LEDGER_SNAPSHOT_LAG).')
+    @with_appcontext
+    def snapshot_balances_command(as_of):
+        """Snapshot the balances of accounts with new ledger entries."""
+        from datetime import timedelta
+        from ..utils.ledger import take_snapshots
+        if as_of:
+            as_of = datetime.fromisoformat(as_of)
+        else:
+            as_of = datetime.utcnow() - timedelta(seconds=current_app.config.get('LEDGER_SNAPSHOT_LAG', 300))
+        click.echo(f'Took {take_snapshots(as_of)} balance snapshots as of {as_of.isoformat()}.')
+    
+    @app.cli.command('balance-at')
+    @click.argument('account_number')
+    @click.argument('at')
+    @with_appcontext
+    def balance_at_command(account_number, at):
+        """Show an account's balance at a point in time (ISO date or datetime)."""
+        from ..utils.ledger import balance_at
+        from ..utils.money import format_amount
+        account = Account.query.filter_by(account_number=account_number).first()
+        if not account:
+            click.echo(f'Account {account_number} not found.')
+            return
+        click.echo(format_amount(balance_at(account.id, datetime.fromisoformat(at)), account.currency))
+    
+    @app.cli.command('purge-idempotency-keys')
+    @with_appcontext
+    def purge_idempotency_keys_command():
+        """Delete expired B2B idempotency keys."""
+        from ..utils.idempotency import purge_expired
+        click.echo(f'Deleted {purge_expired()} expired idempotency keys.')
+    
+    @app.cli.command('stress-transfers')
+    @click.option('--database-url', default=None, help='Database to run against (default: a temporary SQLite file).')
+    @click.option('--accounts', type=int, default=4, help='Number of hot accounts.')
+    @click.option('--workers', type=int, default=16, help='Concurrent worker threads.')
+    @click.option('--operations', type=int, default=2000, help='Total transfers and credits.')
+    @click.option('--naive', is_flag=True, help='Use ORM read-modify-write instead of the transfer engine.')
+    @click.option('--hot-shards', type=int, default=0, help='Shard the credited merchant account into N sub-balances.')
+    @click.option('--seed', type=int, default=None, help='Random seed.')
+    def stress_transfers_command(database_url, accounts, workers, operations, naive, hot_shards, seed):
+        """Run concurrent transfers on hot accounts and check for balance drift."""
+        import json
+        import os
+        import tempfile
+        from ..app import create_app
+        from ..benchmarks.transfer_stress import run_transfer_stress
+        
+        if database_url is None:
+            handle, path = tempfile.mkstemp(suffix='.db')
+            os.close(handle)
+            database_url = f'sqlite:///{path}'
+        engine_options = {'connect_args': {'timeout': 30}} if database_url.startswith('sqlite') else {}
+        stress_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': database_url,
+            'SQLALCHEMY_ENGINE_OPTIONS': engine_options
+        })
+        
+        result = run_transfer_stress(stress_app, accounts=accounts, workers=workers,
+                                     operations=operations, naive=naive, hot_shards=hot_shards, seed=seed)
+        click.echo(json.dumps(result, indent=2))
+        if not result['ok']:
+            raise SystemExit(1)
+    
+    @app.cli.command('benchmark')
+    @click.option('--database-url', default=None, help='Database to run against (default: a temporary SQLite file).')
+    @click.option('--scenario', 'scenarios', multiple=True,
+                  type=click.Choice(['internal', 'outgoing', 'incoming', 'history']),
+                  help='Scenario to run; repeat for several (default: all).')
+    @click.option('--workers', type=int, default=8, help='Concurrent clients.')
+    @click.option('--requests', 'request_count', type=int, default=200, help='Timed requests per scenario.')
+    @click.option('--warmup', type=int, default=10, help='Untimed requests per scenario.')
+    @click.option('--partner-latency', default='none', help='Partner latency, e.g. lognormal:50,0.8 (milliseconds).')
+    @click.option('--partner-error-rate', type=float, default=0.0, help='Share of partner requests that fail with 503.')
+    @click.option('--partner-timeout-rate', type=float, default=0.0, help='Share of partner requests that hang.')
+    @click.option('--seed', type=int, default=None, help='Random seed.')
+    @click.option('--output', type=click.Path(dir_okay=False), default=None, help='Write the results as JSON to this file.')
+    @click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False), default=None,
+                  help='Compare with an earlier results file and fail on regressions.')
+    @click.option('--threshold', type=float, default=0.1, help='Relative change counted as a regression.')
+    def benchmark_command(database_url, scenarios, workers, request_count, warmup, partner_latency,
+                          partner_error_rate, partner_timeout_rate, seed, output, baseline_path, threshold):
+        """Benchmark transfers, B2B and history reads against simulated banks."""
+        import json
+        import os
+        import tempfile
+        from ..app import create_app
+        from ..benchmarks.suite import run_benchmarks, SCENARIOS
+        from ..simulator import FaultProfile
+        
+        if database_url is None:
+            handle, path = tempfile.mkstemp(suffix='.db')
+            os.close(handle)
+            database_url = f'sqlite:///{path}'
+        engine_options = {'connect_args': {'timeout': 30}} if database_url.startswith('sqlite') else {}
+        bench_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': database_url,
+            'SQLALCHEMY_ENGINE_OPTIONS': engine_options
+        })
+        
+        try:
+            partner_faults = FaultProfile(partner_latency, error_rate=partner_error_rate, timeout_rate=partner_timeout_rate)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        results = run_benchmarks(bench_app, scenarios=scenarios or SCENARIOS, workers=workers,
+                                 requests=request_count, warmup=warmup, partner_faults=partner_faults, seed=seed)
+        for name, result in results['scenarios'].items():
+            latency = result['latency_ms']
+            click.echo(f"{name:<10} {result['throughput']:>8} req/s  p50 {latency['p50']:>8} ms  "
+                       f"p95 {latency['p95']:>8} ms  p99 {latency['p99']:>8} ms  "
+                       f"queries {result['queries']['mean']:>6}  failed {result['failed']}")
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+            click.echo(f'Wrote results to {output}.')
+        
+        failed = any(result['failed'] for result in results['scenarios'].values()) or results['ledger_drift_accounts']
+        if baseline_path:
+            with open(baseline_path) as f:
+                failed = _echo_comparison(json.load(f), results, threshold) or failed
+        if failed:
+            raise SystemExit(1)
+    
+    @app.cli.command('benchmark-compare')
+    @click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+    @click.argument('current', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--threshold', type=float, default=0.1, help='Relative change counted as a regression.')
+    def benchmark_compare_command(baseline, current, threshold):
+        """Compare two benchmark results files and fail on regressions."""
+        import json
+        
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+        with open(current) as f:
+            current_results = json.load(f)
+        if _echo_comparison(baseline_results, current_results, threshold):
+            raise SystemExit(1)
+
+    @app.cli.command('startup-benchmark')
+    @click.option('--runs', type=int, default=5, help='Cold starts to time.')
+    @click.option('--budget-ms', type=float, default=None, help='Fail if building the app takes longer (median).')
+    @click.option('--statement', default=None, help='Python code to time instead of building the app.')
+    @click.option('--top', type=int, default=15, help='Slowest imports to list.')
+    @click.option('--output', type=click.Path(dir_okay=False), default=None, help='Write the results as JSON to this file.')
+    def startup_benchmark_command(runs, budget_ms, statement, top, output):
+        """Time app startup in fresh processes and check the import budget."""
+        import json
+        from ..benchmarks.startup import measure_startup, check_startup_budget, DEFAULT_STATEMENT
+
+        try:
+            result = measure_startup(statement or DEFAULT_STATEMENT, runs=max(1, runs), top=top)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Startup: {result['startup_ms']} ms (process {result['process_ms']} ms, "
+                   f"median of {result['runs']}), {result['modules_loaded']} modules loaded")
+        for entry in result['slowest_imports']:
+            click.echo(f"  {entry['cumulative_ms']:>8.1f} ms  {entry['module']}")
+        if output:
+            with open(output, 'w') as f:
+                json.dump(result, f, indent=2)
+            click.echo(f'Wrote results to {output}.')
+
+        problems = check_startup_budget(result, budget_ms)
+        for problem in problems:
+            click.echo(problem)
+        if problems:
+            raise SystemExit(1)
+
+    @app.cli.command('simulate-banks')
+    @click.option('--host', default='127.0.0.1', help='Interface to listen on.')
+    @click.option('--port', type=int, default=5001, help='Port to listen on (the default CENTRAL_BANK_URL port).')
+    @click.option('--partner', 'partner_prefixes', multiple=True, help='Partner bank prefix; repeat for several (default: PTR).')
+    @click.option('--api-key', default='sim-api-key', help='API key handed out on registration.')
+    @click.option('--bank-prefix', 'bank_prefixes', multiple=True, help='Prefix to give registering banks, in order (default: BNK).')
+    @click.option('--latency', default='none', help='Partner latency, e.g. lognormal:50,0.8 (milliseconds).')
+    @click.option('--error-rate', type=float, default=0.0, help='Share of partner requests that fail.')
+    @click.option('--error-status', type=int, default=503, help='Status code of failed partner requests.')
+    @click.option('--timeout-rate', type=float, default=0.0, help='Share of partner requests that hang.')
+    @click.option('--hang', type=float, default=30.0, help='Seconds a hanging request takes to answer.')
+    @click.option('--cb-latency', default='none', help='Central Bank latency.')
+    @click.option('--cb-error-rate', type=float, default=0.0, help='Share of Central Bank requests that fail.')
+    @click.option('--rotate-keys', type=float, default=0, help='Rotate partner keys every N seconds (0: only on request).')
+    @click.option('--keep-keys', type=int, default=2, help='Number of partner keys published in the JWKS.')
+    @click.option('--jwks-max-age', type=int, default=300, help='Cache-Control max-age of partner JWKS responses.')
+    @click.option('--seed', type=int, default=None, help='Random seed.')
+    def simulate_banks_command(host, port, partner_prefixes, api_key, bank_prefixes, latency, error_rate, error_status,
+                               timeout_rate, hang, cb_latency, cb_error_rate, rotate_keys, keep_keys, jwks_max_age, seed):
+        """Run a simulated Central Bank and partner banks."""
+        import random
+        from ..simulator import FaultProfile, KeyRing, SimulatedBank, SimulatorServer
+        
+        rng = random.Random(seed)
+        try:
+            partners = [
+                SimulatedBank(
+                    prefix,
+                    faults=FaultProfile(latency, error_rate=error_rate, error_status=error_status,
+                                        timeout_rate=timeout_rate, hang_seconds=hang, rng=random.Random(rng.random())),
+                    keys=KeyRing(keep=keep_keys, rotate_every=rotate_keys)
+                )
+                for prefix in partner_prefixes or ('PTR',)
+            ]
+            central_bank_faults = FaultProfile(cb_latency, error_rate=cb_error_rate, rng=random.Random(rng.random()))
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        
+        server = SimulatorServer(partners, host=host, port=port, quiet=False, api_key=api_key,
+                                 central_bank_faults=central_bank_faults,
+                                 bank_prefixes=bank_prefixes or ('BNK',), jwks_max_age=jwks_max_age)
+        click.echo(f'Central Bank at {server.url} (API key {api_key})')
+        for partner in partners:
+            click.echo(f'Partner {partner.prefix} at {server.url}/partners/{partner.prefix} ({partner.faults.as_dict()})')
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    
+    @app.cli.command('serve-ingress')
+    @click.option('--host', default='127.0.0.1', help='Interface to listen on.')
+    @click.option('--port', type=int, default=5002, help='Port to listen on.')
+    @with_appcontext
+    def serve_ingress_command(host, port):
+        """Serve the B2B endpoints with the asyncio ingress (needs uvicorn)."""
+        from ..ingress import create_ingress_app
+        
+        try:
+            import uvicorn
+        except ImportError:
+            raise click.ClickException('serve-ingress needs an ASGI server; install uvicorn (and httpx for async HTTP).')
+        uvicorn.run(create_ingress_app(current_app._get_current_object()), host=host, port=port)
+
+def _echo_comparison(baseline, current, threshold):
+    """Print a comparison of two benchmark results; return True on regressions."""
+    from ..benchmarks.suite import compare_results
+    
+    rows = compare_results(baseline, current, threshold)
+    for scenario, metric, before, after, change, regression in rows:
+        click.echo(f"{scenario:<10} {metric:<16} {before:>10} -> {after:>10}  {change:+.1%}"
+                   f"{'  REGRESSION' if regression else ''}")
+    return any(row[5] for row in rows)
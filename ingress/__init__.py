@@ -0,0 +1,7 @@
+"""Optional asyncio ingress for incoming B2B transfers.
+
+Serves the B2B and JWKS endpoints as an ASGI app, for deployments where
+partner banks send bursts of transfers. Run it with ``flask serve-ingress``
+or any ASGI server.
+"""
+from .asgi import AsyncHttpClient, IngressApp, create_ingress_app
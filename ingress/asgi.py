@@ -0,0 +1,319 @@
+import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import jwt
+import requests
+
+from ..utils.central_bank import get_bank_directory, bank_details_request, bank_details_from_response
+from ..utils.http import get_http_client, CircuitOpenError
+from ..utils.metrics import record_http, status_outcome
+from ..utils.jwks import JWKSCache, get_jwks_cache
+from ..utils.settings import get_key_material
+from ..utils.transaction_handler import process_incoming_transaction, process_incoming_batch
+from ..utils.verification import get_verification_executor
+
+
+class AsyncHttpClient:
+    """Non-blocking GETs for the ingress.
+
+    Uses httpx when it is installed and otherwise runs each call on the
+    shared sync client in a thread. Either way the sync client's circuit
+    breakers are used, so both paths see the same destination health.
+    Calls are recorded in ``metrics`` when it is given.
+    """
+
+    def __init__(self, sync_client, executor=None, metrics=None):
+        self.sync_client = sync_client
+        self.executor = executor
+        self.metrics = metrics
+        try:
+            import httpx
+        except ImportError:
+            self.client = None
+        else:
+            connect_timeout, read_timeout = sync_client.timeout
+            self.client = httpx.AsyncClient(timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+
+    async def get(self, url, headers=None, breaker_key=None):
+        """Return ``(status_code, headers, body)``. Raises requests.RequestException on failure."""
+        key = breaker_key or urlsplit(url).netloc
+        started = time.perf_counter()
+        try:
+            status_code, response_headers, content = await self._get(url, headers, key)
+        except CircuitOpenError:
+            self._record(key, 'circuit_open', 0.0)
+            raise
+        except requests.RequestException:
+            self._record(key, 'error', time.perf_counter() - started)
+            raise
+        self._record(key, status_outcome(status_code), time.perf_counter() - started)
+        return status_code, response_headers, content
+
+    async def _get(self, url, headers, key):
+        if self.client is None:
+            # Without an app context the sync client records nothing itself
+            call = functools.partial(self.sync_client.get, url, headers=headers, breaker_key=key)
+            response = await asyncio.get_running_loop().run_in_executor(self.executor, call)
+            return response.status_code, response.headers, response.content
+
+        import httpx
+        breaker = self.sync_client.breaker(key)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit breaker open for {key}")
+        try:
+            response = await self.client.get(url, headers=headers)
+        except BaseException as e:
+            # Including cancellation, which must not keep a half-open trial
+            breaker.record_failure()
+            if isinstance(e, httpx.HTTPError):
+                raise requests.ConnectionError(str(e)) from e
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response.status_code, response.headers, response.content
+
+    def _record(self, key, outcome, seconds):
+        if self.metrics is not None:
+            record_http(key, 'GET', outcome, seconds, metrics=self.metrics)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+
+class IngressApp:
+    """ASGI app serving ``/transactions/b2b``, ``/transactions/b2b/batch`` and
+    ``/transactions/jwks`` of a Flask bank app.
+
+    Waiting on the Central Bank and partner JWKS endpoints happens on the
+    event loop: before a token is processed, the bank directory and JWKS
+    caches are filled with async requests. Verification and crediting then
+    run the same code as the Flask views (which now finds everything
+    cached) on a pool of INGRESS_DB_WORKERS threads, one DB connection
+    each; signatures in large batches are checked by the verification
+    executor's pool. At most INGRESS_MAX_IN_FLIGHT requests are accepted
+    at once; more get 503 with Retry-After.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        self.max_in_flight = config.get('INGRESS_MAX_IN_FLIGHT', 1000)
+        self.in_flight = 0
+        self.executor = ThreadPoolExecutor(max_workers=config.get('INGRESS_DB_WORKERS', 8),
+                                           thread_name_prefix='ingress-db')
+        with flask_app.app_context():
+            self.directory = get_bank_directory()
+            self.jwks_cache = get_jwks_cache()
+            self.http = AsyncHttpClient(get_http_client(), metrics=flask_app.extensions.get('metrics'))
+            self.verifier = get_verification_executor()
+        # Concurrent misses for the same bank share one fetch
+        self.fetches = {}
+        self.routes = {
+            ('POST', '/transactions/b2b'): self.b2b_transaction,
+            ('POST', '/transactions/b2b/batch'): self.b2b_batch_transaction,
+            ('GET', '/transactions/jwks'): self.jwks
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            await self.respond(send, 404, {'error': 'Not found'})
+            return
+        if self.in_flight >= self.max_in_flight:
+            await self.respond(send, 503, {'error': 'Too many requests in flight'}, [(b'retry-after', b'1')])
+            return
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            body = b''
+            while True:
+                message = await receive()
+                body += message.get('body', b'')
+                if not message.get('more_body'):
+                    break
+            try:
+                status, payload, headers = await handler(scope, body)
+            except Exception as e:
+                self.flask_app.logger.error(f"Error in B2B ingress: {str(e)}")
+                status, payload, headers = 500, {'error': 'Internal server error'}, []
+            await self.respond(send, status, payload, headers)
+            if self.http.metrics is not None:
+                self.http.metrics.observe('bank_request_duration_seconds', time.perf_counter() - started,
+                                          endpoint=f'ingress.{handler.__name__}', method=scope['method'],
+                                          status=status_outcome(status))
+        finally:
+            self.in_flight -= 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.http.close()
+                self.executor.shutdown(wait=True)
+                self.verifier.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def respond(self, send, status, payload, headers=()):
+        if isinstance(payload, bytes) or payload is None:
+            body = payload or b''
+            content_type = []
+        else:
+            body = json.dumps(payload).encode('utf-8')
+            content_type = [(b'content-type', b'application/json')]
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': content_type + [(b'content-length', str(len(body)).encode('ascii'))] + list(headers)
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def run_sync(self, func, *args):
+        """Run a function in an app context on the DB thread pool."""
+        def call():
+            with self.flask_app.app_context():
+                return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def b2b_transaction(self, scope, body):
+        data = self.parse_json(body)
+        if not isinstance(data, dict) or 'jwt' not in data:
+            return 400, {'error': 'Invalid request format'}, []
+        await self.prefetch([data['jwt']])
+        response, status_code = await self.run_sync(process_incoming_transaction, data['jwt'])
+        return status_code, response, []
+
+    async def b2b_batch_transaction(self, scope, body):
+        data = self.parse_json(body)
+        if not isinstance(data, dict) or ('jwts' not in data and 'jwt' not in data):
+            return 400, {'error': 'Invalid request format'}, []
+        jwt_tokens = data['jwts'] if 'jwts' in data else [data['jwt']]
+        if not isinstance(jwt_tokens, list) or not jwt_tokens:
+            return 400, {'error': 'Invalid request format'}, []
+        if len(jwt_tokens) > self.flask_app.config.get('B2B_BATCH_MAX_ITEMS', 1000):
+            return 413, {'error': 'Too many transfers in one batch'}, []
+        await self.prefetch(jwt_tokens)
+        results = await self.run_sync(process_incoming_batch, jwt_tokens)
+        return 200, {'results': results}, []
+
+    async def jwks(self, scope, body):
+        key_material = await self.run_sync(get_key_material)
+        if not key_material or not key_material.jwks_bytes:
+            return 500, {'error': 'Bank not properly configured with keys'}, []
+        etag = f'"{key_material.etag}"'
+        headers = [
+            (b'etag', etag.encode('ascii')),
+            (b'cache-control', f"public, max-age={self.flask_app.config.get('JWKS_MAX_AGE', 300)}".encode('ascii'))
+        ]
+        if_none_match = dict(scope.get('headers') or []).get(b'if-none-match', b'').decode('latin-1')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return 304, None, headers
+        return 200, key_material.jwks_bytes, headers + [(b'content-type', b'application/json')]
+
+    @staticmethod
+    def parse_json(body):
+        try:
+            return json.loads(body or b'null')
+        except ValueError:
+            return None
+
+    async def prefetch(self, jwt_tokens):
+        """Fill the Central Bank and JWKS caches the tokens will need."""
+        needed = {}
+        for jwt_token in jwt_tokens:
+            try:
+                header = jwt.get_unverified_header(jwt_token)
+                payload = jwt.decode(jwt_token, options={'verify_signature': False})
+            except (jwt.InvalidTokenError, TypeError):
+                # Rejected by the verification itself
+                continue
+            transfers = payload.get('transfers') if 'transfers' in payload else [payload]
+            if isinstance(transfers, list) and transfers and isinstance(transfers[0], dict):
+                prefix = str(transfers[0].get('accountFrom') or '')[:3]
+                if prefix:
+                    needed[(prefix, header.get('kid'))] = True
+        if needed and not self.flask_app.config.get('TEST_MODE'):
+            # One bank failing must not keep the others from being prefetched
+            results = await asyncio.gather(*(self.prefetch_key(prefix, kid) for prefix, kid in needed),
+                                           return_exceptions=True)
+            for (prefix, _), result in zip(needed, results):
+                if isinstance(result, Exception):
+                    self.flask_app.logger.error(f"Error prefetching keys of bank {prefix}: {str(result)}")
+
+    async def prefetch_key(self, bank_prefix, kid):
+        details = await self.once(('bank', bank_prefix), lambda: self.fetch_bank_details(bank_prefix))
+        if details and details.get('success') and details.get('jwks_url'):
+            await self.once(('jwks', bank_prefix, kid), lambda: self.fetch_jwks(bank_prefix, details['jwks_url'], kid))
+
+    async def once(self, key, fetch):
+        """Run ``fetch`` unless the same fetch is already running, and return its result."""
+        future = self.fetches.get(key)
+        if future is None:
+            future = self.fetches[key] = asyncio.ensure_future(fetch())
+            future.add_done_callback(lambda _: self.fetches.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def fetch_bank_details(self, bank_prefix):
+        if self.directory.peek(bank_prefix):
+            with self.flask_app.app_context():
+                return self.directory.get(bank_prefix)
+        # Reads the API key from the settings snapshot, which may query the DB
+        request, error = await self.run_sync(bank_details_request, bank_prefix)
+        if error:
+            return error
+        url, headers = request
+        try:
+            status, _, content = await self.http.get(url, headers=headers, breaker_key='central-bank')
+            data = json.loads(content) if status == 200 else None
+        except (requests.RequestException, ValueError) as e:
+            # Cached briefly as a failure, which the sync lookup then reports
+            self.flask_app.logger.error(f"Error getting bank details: {str(e)}")
+            details = {'success': False, 'error': str(e)}
+        else:
+            details = bank_details_from_response(status, data, content.decode('utf-8', 'replace'))
+        self.directory.store(bank_prefix, details)
+        return details
+
+    async def fetch_jwks(self, bank_prefix, jwks_url, kid):
+        needed, etag = self.jwks_cache.fetch_plan(bank_prefix, jwks_url, kid)
+        if not needed:
+            return
+        try:
+            status, headers, content = await self.http.get(
+                jwks_url, headers=JWKSCache.request_headers(etag), breaker_key=f'bank:{bank_prefix}'
+            )
+            response = (status, json.loads(content) if status == 200 else None, headers)
+        except (requests.RequestException, ValueError) as e:
+            # Stored as a failure, so the sync path does not retry it at once
+            self.flask_app.logger.error(f"Error fetching JWKS for bank {bank_prefix}: {str(e)}")
+            response = None
+        # store() takes the bank's lock, which a sync get_key() holds while it
+        # fetches, so it must not run on the event loop
+        await self.run_sync(self.jwks_cache.store, bank_prefix, jwks_url, response)
+
+
+def create_ingress_app(flask_app=None):
+    """Return the ASGI ingress for a Flask app (by default a new one).
+
+    Usable as an ASGI server factory, e.g.
+    ``uvicorn --factory package.ingress:create_ingress_app``.
+    """
+    if flask_app is None:
+        from ..app import create_app
+        flask_app = create_app()
+    return IngressApp(flask_app)
@@ -4,6 +4,19 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
 
 from .. import db, login_manager
+from ..utils.money import from_minor, totals_by_currency
+from ..utils.cache import TTLCache
+
+# Recently read shard sums of hot accounts, keyed by account id
+_shard_totals = TTLCache(max_size=4096, ttl=1)
+
+def invalidate_shard_totals(account_ids=None):
+    """Forget the cached shard sums of some accounts, or of every account."""
+    if account_ids is None:
+        _shard_totals.invalidate()
+        return
+    for account_id in account_ids:
+        _shard_totals.invalidate(account_id)
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -29,10 +42,14 @@ class Account(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     account_number = db.Column(db.String(64), unique=True, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    balance = db.Column(db.Float, default=0.0)
+    # Balance in integer minor units (cents for EUR); see utils.money. Kept
+    # in step with the account's ledger entries, see utils.ledger
+    balance_minor = db.Column(db.BigInteger, default=0, nullable=False)
     currency = db.Column(db.String(3), default='EUR')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    # Number of sub-balance rows that take incoming credits (0 = not sharded)
+    balance_shards = db.Column(db.Integer, default=0, nullable=False)
     sent_transactions = db.relationship('Transaction', 
                                        foreign_keys='Transaction.account_from_id',
                                        backref='sender', lazy='dynamic')
@@ -40,41 +57,222 @@ class Account(db.Model):
                                            foreign_keys='Transaction.account_to_id',
                                            backref='receiver', lazy='dynamic')
     
+    @property
+    def total_balance_minor(self):
+        """The balance in minor units, including unconsolidated shard credits.
+        
+        For sharded accounts the shard sum is cached for a short time, so the
+        value may lag recent credits by up to a second.
+        """
+        return self._total_balance_minor(cached=True)
+    
+    def current_balance_minor(self):
+        """Like total_balance_minor, but always reads the shard sum.
+        
+        For responses that must agree with a version read in the same
+        request, such as ETagged API responses.
+        """
+        return self._total_balance_minor(cached=False)
+    
+    def _total_balance_minor(self, cached):
+        if not self.balance_shards:
+            return self.balance_minor or 0
+        shard_total = _shard_totals.get(self.id) if cached else None
+        if shard_total is None:
+            shard_total = db.session.query(db.func.coalesce(db.func.sum(AccountBalanceShard.balance_minor), 0)) \
+                .filter(AccountBalanceShard.account_id == self.id).scalar()
+            _shard_totals.set(self.id, int(shard_total))
+        return (self.balance_minor or 0) + shard_total
+    
+    @property
+    def balance(self):
+        """The balance as a Decimal in the account currency."""
+        return from_minor(self.total_balance_minor, self.currency)
+    
     @staticmethod
     def generate_account_number(bank_prefix):
         """Generate a unique account number with the bank prefix."""
         unique_id = uuid.uuid4().hex
         return f"{bank_prefix}{unique_id}"
     
+    @staticmethod
+    def totals_by_currency():
+        """Sum all account balances per currency in the database."""
+        rows = db.session.query(Account.currency, db.func.sum(Account.balance_minor)) \
+            .group_by(Account.currency).all()
+        shard_rows = db.session.query(Account.currency, db.func.sum(AccountBalanceShard.balance_minor)) \
+            .join(AccountBalanceShard, AccountBalanceShard.account_id == Account.id) \
+            .group_by(Account.currency).all()
+        return totals_by_currency(
+            [(currency, int(total or 0)) for currency, total in rows + shard_rows]
+        )
+    
     def __repr__(self):
         return f'<Account {self.account_number}>'
 
 
+class AccountBalanceShard(db.Model):
+    """A sub-balance of a hot account.
+    
+    Incoming credits to a sharded account are spread over its shard rows so
+    they do not all wait on the account row lock. An account's balance is
+    its own balance_minor plus the sum of its shards.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    shard_no = db.Column(db.Integer, nullable=False)
+    balance_minor = db.Column(db.BigInteger, default=0, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'shard_no', name='uq_account_balance_shard'),
+    )
+    
+    def __repr__(self):
+        return f'<AccountBalanceShard {self.account_id}/{self.shard_no}>'
+
+
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(64), unique=True, index=True)
     account_from_id = db.Column(db.Integer, db.ForeignKey('account.id'))
     account_to_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
     account_to_external = db.Column(db.String(64), nullable=True)
-    amount = db.Column(db.Float)
+    # Amount in integer minor units of the transaction currency
+    amount_minor = db.Column(db.BigInteger)
     currency = db.Column(db.String(3))
     explanation = db.Column(db.String(256))
-    status = db.Column(db.String(20), default='pending')  # pending, completed, failed
+    status = db.Column(db.String(20), default='pending')  # pending, processing, completed, failed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
     is_internal = db.Column(db.Boolean, default=True)
     receiver_name = db.Column(db.String(128), nullable=True)
+    sender_name = db.Column(db.String(128), nullable=True)
     error_message = db.Column(db.String(256), nullable=True)
+    # Set when the receiving account was credited in another currency
+    converted_amount_minor = db.Column(db.BigInteger, nullable=True)
+    converted_currency = db.Column(db.String(3), nullable=True)
+    exchange_rate = db.Column(db.Numeric(24, 10), nullable=True)
+    # Outbox delivery state for outgoing B2B transfers
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_transaction_status_next_attempt', 'status', 'next_attempt_at'),
+        # Keyset pagination of each account's history on (created_at, id)
+        db.Index('ix_transaction_from_created', 'account_from_id', 'created_at', 'id'),
+        db.Index('ix_transaction_to_created', 'account_to_id', 'created_at', 'id'),
+        # Latest status change of an account's outgoing transfers (API ETags)
+        db.Index('ix_transaction_from_updated', 'account_from_id', 'updated_at'),
+    )
+    
+    @property
+    def amount(self):
+        """The amount as a Decimal in the transaction currency."""
+        return from_minor(self.amount_minor or 0, self.currency)
     
     @staticmethod
     def generate_transaction_id():
         """Generate a unique transaction ID."""
         return uuid.uuid4().hex
     
+    @staticmethod
+    def statement_totals(account_id, since=None, until=None):
+        """Sum an account's completed credits and debits per currency in SQL."""
+        credit = db.case((Transaction.account_to_id == account_id, Transaction.amount_minor), else_=0)
+        debit = db.case((Transaction.account_from_id == account_id, Transaction.amount_minor), else_=0)
+        query = db.session.query(Transaction.currency, db.func.sum(credit), db.func.sum(debit)) \
+            .filter(
+                db.or_(Transaction.account_from_id == account_id, Transaction.account_to_id == account_id),
+                Transaction.status == 'completed'
+            )
+        if since:
+            query = query.filter(Transaction.created_at >= since)
+        if until:
+            query = query.filter(Transaction.created_at < until)
+        return {
+            currency: {'credits': int(credits or 0), 'debits': int(debits or 0)}
+            for currency, credits, debits in query.group_by(Transaction.currency).all()
+        }
+    
     def __repr__(self):
         return f'<Transaction {self.transaction_id}>'
 
 
+class LedgerEntry(db.Model):
+    """One leg of a balance change, in the account's currency.
+    
+    Append-only: a debit is a negative ``amount_minor``, a credit a positive
+    one. An account's balance_minor plus its shards always equals the sum of
+    its entries; ``transaction_ref`` is the Transaction.transaction_id the
+    leg belongs to, if any.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    amount_minor = db.Column(db.BigInteger, nullable=False)
+    kind = db.Column(db.String(16), nullable=False)  # transfer, deposit, refund, opening, adjustment
+    transaction_ref = db.Column(db.String(64), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_ledger_entry_account_created', 'account_id', 'created_at'),
+        # Latest entry of an account, read from the index alone
+        db.Index('ix_ledger_entry_account_id', 'account_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<LedgerEntry {self.account_id} {self.amount_minor}>'
+
+
+class BalanceSnapshot(db.Model):
+    """An account's ledger balance including every entry up to ``as_of``."""
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    as_of = db.Column(db.DateTime, nullable=False)
+    balance_minor = db.Column(db.BigInteger, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'as_of', name='uq_balance_snapshot_account_as_of'),
+    )
+    
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.account_id} {self.as_of}>'
+
+
+class ExchangeRate(db.Model):
+    """The price of one unit of ``base_currency`` in ``quote_currency``."""
+    id = db.Column(db.Integer, primary_key=True)
+    base_currency = db.Column(db.String(3), nullable=False)
+    quote_currency = db.Column(db.String(3), nullable=False)
+    rate = db.Column(db.Numeric(24, 10), nullable=False)
+    source = db.Column(db.String(64))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('base_currency', 'quote_currency', name='uq_exchange_rate_pair'),
+    )
+    
+    def __repr__(self):
+        return f'<ExchangeRate {self.base_currency}/{self.quote_currency} {self.rate}>'
+
+
+class IdempotencyKey(db.Model):
+    """The stored response of an incoming B2B transfer, keyed by sender and transfer id.
+    
+    A retried or replayed transfer with the same key gets this response back
+    instead of being credited again. Rows are purged after ``expires_at``.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(160), unique=True, index=True, nullable=False)
+    response = db.Column(db.Text)
+    status_code = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
+
+
 class BankSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     bank_name = db.Column(db.String(128))
@@ -85,7 +283,7 @@ class BankSettings(db.Model):
     private_key = db.Column(db.Text)
     public_key = db.Column(db.Text)
     central_bank_url = db.Column(db.String(256))
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<BankSettings {self.bank_name}>'
@@ -0,0 +1,8 @@
+"""A local Central Bank and partner banks with real keys and injected faults.
+
+Run it with ``flask simulate-banks``, or start a ``SimulatorServer`` from
+code (the benchmark suite does).
+"""
+from .faults import LatencyDistribution, FaultProfile
+from .banks import KeyRing, SimulatedBank
+from .server import create_simulator_app, SimulatorServer
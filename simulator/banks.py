@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+from collections import Counter
+
+from ..utils.crypto import generate_key_pair, load_private_key, public_key_to_jwk, jwk_thumbprint, generate_jwt
+from .faults import FaultProfile
+
+
+class KeyRing:
+    """A bank's RS256 signing keys.
+
+    The newest key signs; it and the ``keep - 1`` keys before it are
+    published in the JWKS, so tokens signed just before a rotation still
+    verify. With ``rotate_every`` seconds set, a new key is made on first
+    use after that interval.
+    """
+
+    def __init__(self, keep=2, rotate_every=0):
+        self.keep = max(1, keep)
+        self.rotate_every = rotate_every
+        self.keys = []
+        self.rotated_at = 0.0
+        self.rotations = 0
+        self.lock = threading.Lock()
+        self.rotate()
+
+    def rotate(self):
+        """Make a new signing key and return its kid."""
+        with self.lock:
+            return self._rotate()
+
+    def _rotate(self):
+        # Called with self.lock held
+        private_pem, _ = generate_key_pair()
+        private_key = load_private_key(private_pem)
+        kid = jwk_thumbprint(private_key.public_key())
+        self.keys = ([(kid, private_key)] + self.keys)[:self.keep]
+        self.rotated_at = time.monotonic()
+        self.rotations += 1
+        return kid
+
+    def _current_keys(self):
+        # Checked under the lock, so concurrent callers rotate only once
+        with self.lock:
+            if self.rotate_every and time.monotonic() - self.rotated_at >= self.rotate_every:
+                self._rotate()
+            return self.keys
+
+    def signing_key(self):
+        """Return ``(kid, private_key)`` of the current signing key."""
+        return self._current_keys()[0]
+
+    def jwks(self):
+        return {'keys': [public_key_to_jwk(private_key.public_key(), kid) for kid, private_key in self._current_keys()]}
+
+
+class SimulatedBank:
+    """A partner bank: its prefix, keys, fault profile and request counters."""
+
+    def __init__(self, prefix, name=None, faults=None, keys=None):
+        self.prefix = prefix
+        self.name = name or f'Partner {prefix}'
+        self.faults = faults or FaultProfile()
+        self.keys = keys or KeyRing()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def account_number(self):
+        return f'{self.prefix}{uuid.uuid4().hex[:12]}'
+
+    def sign(self, payload):
+        """Sign a B2B payload with the current key, adding jti, iat and exp."""
+        kid, private_key = self.keys.signing_key()
+        issued_at = int(time.time())
+        claims = {'jti': uuid.uuid4().hex, 'iat': issued_at, 'exp': issued_at + 300}
+        return generate_jwt(dict(payload, **claims), private_key, kid=kid)
+
+    def as_dict(self):
+        return {
+            'prefix': self.prefix,
+            'name': self.name,
+            'faults': self.faults.as_dict(),
+            'kids': [kid for kid, _ in self.keys.keys],
+            'key_rotations': self.keys.rotations - 1,
+            'stats': dict(self.stats)
+        }
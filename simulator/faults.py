@@ -0,0 +1,107 @@
+import random
+import threading
+
+
+class LatencyDistribution:
+    """Samples response delays, in seconds.
+
+    Built from a spec in milliseconds: ``none``, ``fixed:50``,
+    ``uniform:10,200``, ``normal:80,20`` (mean and standard deviation),
+    ``lognormal:50,0.8`` (median and sigma, for realistic long tails) or
+    ``exponential:40`` (mean).
+    """
+    ARITY = {'none': 0, 'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exponential': 1}
+
+    def __init__(self, kind='none', params=(), rng=None):
+        if kind not in self.ARITY:
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        if len(params) != self.ARITY[kind]:
+            raise ValueError(f"Latency distribution {kind} takes {self.ARITY[kind]} parameters")
+        self.kind = kind
+        self.params = tuple(float(param) for param in params)
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec, rng=None):
+        """Build a distribution from a spec like ``lognormal:50,0.8``."""
+        kind, _, params = (spec or 'none').partition(':')
+        try:
+            values = [float(value) for value in params.split(',') if value.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        return cls(kind.strip().lower(), values, rng)
+
+    def sample(self):
+        kind, params, rng = self.kind, self.params, self.rng
+        if kind == 'none':
+            milliseconds = 0.0
+        elif kind == 'fixed':
+            milliseconds = params[0]
+        elif kind == 'uniform':
+            milliseconds = rng.uniform(*params)
+        elif kind == 'normal':
+            milliseconds = rng.normalvariate(*params)
+        elif kind == 'lognormal':
+            # The median of a log-normal distribution is exp(mu)
+            milliseconds = params[0] * rng.lognormvariate(0.0, params[1])
+        else:
+            milliseconds = rng.expovariate(1.0 / params[0]) if params[0] else 0.0
+        return max(0.0, milliseconds) / 1000.0
+
+    def __str__(self):
+        if self.kind == 'none':
+            return 'none'
+        return f"{self.kind}:{','.join(f'{param:g}' for param in self.params)}"
+
+
+class FaultProfile:
+    """How a simulated endpoint misbehaves.
+
+    Every request is delayed by a sample of ``latency``. Then
+    ``error_rate`` of requests fail with ``error_status``, and
+    ``timeout_rate`` of them hang for ``hang_seconds`` (longer than a
+    client's read timeout) before answering 504.
+    """
+
+    def __init__(self, latency=None, error_rate=0.0, error_status=503, timeout_rate=0.0, hang_seconds=30.0, rng=None):
+        self.rng = rng or random.Random()
+        self.latency = latency if isinstance(latency, LatencyDistribution) else LatencyDistribution.parse(latency, self.rng)
+        self.error_rate = float(error_rate)
+        self.error_status = int(error_status)
+        self.timeout_rate = float(timeout_rate)
+        self.hang_seconds = float(hang_seconds)
+        self.lock = threading.Lock()
+
+    def decide(self):
+        """Return ``(outcome, delay)``; outcome is 'ok', 'error' or 'timeout'."""
+        with self.lock:
+            delay = self.latency.sample()
+            roll = self.rng.random()
+        if roll < self.timeout_rate:
+            return 'timeout', delay + self.hang_seconds
+        if roll < self.timeout_rate + self.error_rate:
+            return 'error', delay
+        return 'ok', delay
+
+    def update(self, latency=None, error_rate=None, error_status=None, timeout_rate=None, hang_seconds=None):
+        """Change some settings in place, e.g. from the admin API."""
+        with self.lock:
+            if latency is not None:
+                self.latency = LatencyDistribution.parse(latency, self.rng)
+            if error_rate is not None:
+                self.error_rate = float(error_rate)
+            if error_status is not None:
+                self.error_status = int(error_status)
+            if timeout_rate is not None:
+                self.timeout_rate = float(timeout_rate)
+            if hang_seconds is not None:
+                self.hang_seconds = float(hang_seconds)
+
+    def as_dict(self):
+        return {
+            'latency': str(self.latency),
+            'error_rate': self.error_rate,
+            'error_status': self.error_status,
+            'timeout_rate': self.timeout_rate,
+            'hang_seconds': self.hang_seconds
+        }
@@ -0,0 +1,319 @@
+import threading
+import time
+import uuid
+import jwt
+import requests
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from ..utils.crypto import jwk_to_public_key, verify_jwt
+from ..utils.money import to_minor, to_payload_amount
+from .faults import FaultProfile
+
+
+class _SenderKeys:
+    """Public keys of the banks that send to our partners, from their JWKS.
+
+    Keys are cached by ``(prefix, kid)``; an unknown kid refetches the
+    sending bank's JWKS, so rotated keys are picked up.
+    """
+
+    def __init__(self, registry, fixed=None, timeout=5):
+        self.registry = registry
+        self.fixed = fixed or {}
+        self.timeout = timeout
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def get(self, prefix, kid):
+        if prefix in self.fixed:
+            return self.fixed[prefix]
+        key = self.keys.get((prefix, kid))
+        if key is None and prefix in self.registry:
+            response = requests.get(self.registry[prefix]['jwks_url'], timeout=self.timeout)
+            response.raise_for_status()
+            with self.lock:
+                for jwk in response.json().get('keys', []):
+                    self.keys[(prefix, jwk.get('kid'))] = jwk_to_public_key(jwk)
+            key = self.keys.get((prefix, kid))
+        return key
+
+
+def create_simulator_app(partners, api_key='sim-api-key', central_bank_faults=None, sender_keys=None,
+                         bank_prefixes=('BNK',), jwks_max_age=300):
+    """Build a Flask app simulating the Central Bank and partner banks.
+
+    Central Bank: ``POST /register`` hands out prefixes (from
+    ``bank_prefixes``, then ``S01``, ``S02``...) and the API key, and
+    ``GET /banks/<prefix>`` returns partners and registered banks.
+
+    Every partner (a ``SimulatedBank``) serves
+    ``/partners/<prefix>/transactions/jwks``, ``.../b2b`` and
+    ``.../b2b/batch``. Incoming JWTs are verified against the sending
+    bank's JWKS, fetched from the URL it registered (or against
+    ``sender_keys``, a dict of prefix to public key object). ``POST
+    /partners/<prefix>/send`` makes the partner send signed transfers to a
+    registered bank.
+
+    The Central Bank and each partner misbehave according to their
+    ``FaultProfile``. ``/admin/...`` endpoints show counters, change fault
+    profiles and rotate partner keys while the simulator runs.
+    """
+    app = Flask(__name__)
+    partners = {partner.prefix: partner for partner in partners}
+    central_bank_faults = central_bank_faults or FaultProfile()
+    registry = {}
+    issued_prefixes = list(bank_prefixes)
+    keys = _SenderKeys(registry, sender_keys)
+    central_bank_stats = {'register': 0, 'lookups': 0}
+
+    def misbehave(faults):
+        """Delay the request, and return an error response if it should fail."""
+        outcome, delay = faults.decide()
+        if delay:
+            time.sleep(delay)
+        if outcome == 'error':
+            return jsonify({'error': 'Simulated failure'}), faults.error_status
+        if outcome == 'timeout':
+            return jsonify({'error': 'Simulated timeout'}), 504
+        return None
+
+    def get_partner(prefix):
+        partner = partners.get(prefix)
+        if partner is None:
+            return None, (jsonify({'error': 'Bank not found'}), 404)
+        return partner, None
+
+    def receive(partner, token):
+        """Verify one incoming JWT; return its transfers or raise ValueError."""
+        try:
+            header = jwt.get_unverified_header(token)
+            payload = jwt.decode(token, options={'verify_signature': False})
+        except jwt.InvalidTokenError:
+            raise ValueError('Invalid JWT')
+        transfers = payload.get('transfers') if 'transfers' in payload else [payload]
+        prefix = str((transfers[0] if transfers else {}).get('accountFrom') or '')[:3]
+        try:
+            public_key = keys.get(prefix, header.get('kid'))
+        except requests.RequestException:
+            partner.count('jwks_fetch_failed')
+            raise ValueError('Could not fetch the sending bank\'s JWKS')
+        if public_key is None:
+            raise ValueError('Public key not found')
+        verified = verify_jwt(token, public_key, leeway=30)
+        if not verified:
+            raise ValueError('Invalid JWT signature')
+        return verified.get('transfers') if 'transfers' in verified else [verified]
+
+    @app.route('/register', methods=['POST'])
+    def register():
+        error = misbehave(central_bank_faults)
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        if not data.get('transaction_url') or not data.get('jwks_url'):
+            return jsonify({'error': 'transaction_url and jwks_url are required'}), 400
+        # A bank registering again keeps its prefix
+        prefix = next((prefix for prefix, bank in registry.items() if bank['jwks_url'] == data['jwks_url']), None)
+        if prefix is None:
+            prefix = issued_prefixes.pop(0) if issued_prefixes else f'S{len(registry) + 1:02d}'
+        registry[prefix] = {
+            'bank_name': data.get('bank_name') or prefix,
+            'transaction_url': data['transaction_url'],
+            'jwks_url': data['jwks_url']
+        }
+        central_bank_stats['register'] += 1
+        return jsonify({'bank_prefix': prefix, 'api_key': api_key})
+
+    @app.route('/banks/<prefix>', methods=['GET'])
+    def bank_details(prefix):
+        error = misbehave(central_bank_faults)
+        if error:
+            return error
+        if request.headers.get('Authorization') != f'Bearer {api_key}':
+            return jsonify({'error': 'Unauthorized'}), 401
+        central_bank_stats['lookups'] += 1
+        if prefix in partners:
+            base = f'{request.host_url}partners/{prefix}'
+            return jsonify({
+                'bank_name': partners[prefix].name,
+                'transaction_url': f'{base}/transactions/b2b',
+                'jwks_url': f'{base}/transactions/jwks'
+            })
+        if prefix in registry:
+            return jsonify(registry[prefix])
+        return jsonify({'error': 'Bank not found'}), 404
+
+    @app.route('/partners/<prefix>/transactions/jwks', methods=['GET'])
+    def partner_jwks(prefix):
+        partner, error = get_partner(prefix)
+        if error:
+            return error
+        error = misbehave(partner.faults)
+        if error:
+            return error
+        partner.count('jwks')
+        response = jsonify(partner.keys.jwks())
+        response.cache_control.max_age = jwks_max_age
+        return response
+
+    @app.route('/partners/<prefix>/transactions/b2b', methods=['POST'])
+    def partner_b2b(prefix):
+        partner, error = get_partner(prefix)
+        if error:
+            return error
+        error = misbehave(partner.faults)
+        if error:
+            partner.count('failed')
+            return error
+        data = request.get_json(silent=True) or {}
+        if 'jwt' not in data:
+            return jsonify({'error': 'Invalid request format'}), 400
+        try:
+            receive(partner, data['jwt'])
+        except ValueError as e:
+            partner.count('rejected')
+            return jsonify({'error': str(e)}), 400
+        partner.count('received')
+        return jsonify({'receiverName': f'{partner.name} customer'})
+
+    @app.route('/partners/<prefix>/transactions/b2b/batch', methods=['POST'])
+    def partner_b2b_batch(prefix):
+        partner, error = get_partner(prefix)
+        if error:
+            return error
+        error = misbehave(partner.faults)
+        if error:
+            partner.count('failed')
+            return error
+        data = request.get_json(silent=True) or {}
+        tokens = data['jwts'] if 'jwts' in data else [data['jwt']] if 'jwt' in data else None
+        if not tokens:
+            return jsonify({'error': 'Invalid request format'}), 400
+        results = []
+        for token in tokens:
+            try:
+                transfers = receive(partner, token)
+            except ValueError as e:
+                partner.count('rejected')
+                results.append({'error': str(e), 'status': 400})
+                continue
+            partner.count('received', len(transfers))
+            results.extend({'receiverName': f'{partner.name} customer', 'status': 200} for _ in transfers)
+        return jsonify({'results': results})
+
+    @app.route('/partners/<prefix>/send', methods=['POST'])
+    def partner_send(prefix):
+        """Send ``count`` transfers from the partner to a registered bank."""
+        partner, error = get_partner(prefix)
+        if error:
+            return error
+        data = request.get_json(silent=True) or {}
+        account_to = str(data.get('accountTo') or '')
+        destination = registry.get(account_to[:3])
+        if destination is None:
+            return jsonify({'error': 'Destination bank not registered'}), 404
+        currency = data.get('currency', 'EUR')
+        try:
+            amount_minor = int(data['amountMinor']) if 'amountMinor' in data else to_minor(str(data.get('amount', '1.00')), currency)
+        except ValueError:
+            return jsonify({'error': 'Invalid amount'}), 400
+        transfers = [
+            {
+                'accountFrom': data.get('accountFrom') or partner.account_number(),
+                'accountTo': account_to,
+                'currency': currency,
+                'amount': to_payload_amount(amount_minor, currency),
+                'amountMinor': amount_minor,
+                'explanation': data.get('explanation', 'Simulated transfer'),
+                'senderName': data.get('senderName', f'{partner.name} customer'),
+                'transferId': uuid.uuid4().hex
+            }
+            for _ in range(int(data.get('count', 1)))
+        ]
+        responses = []
+        try:
+            if data.get('batch'):
+                response = requests.post(destination['transaction_url'].rstrip('/') + '/batch',
+                                         json={'jwt': partner.sign({'transfers': transfers})}, timeout=30)
+                responses.append({'status': response.status_code, 'body': response.json()})
+            else:
+                for transfer in transfers:
+                    response = requests.post(destination['transaction_url'], json={'jwt': partner.sign(transfer)}, timeout=30)
+                    responses.append({'status': response.status_code, 'body': response.json()})
+        except (requests.RequestException, ValueError) as e:
+            return jsonify({'error': f'Delivery failed: {e}', 'responses': responses}), 502
+        partner.count('sent', len(transfers))
+        return jsonify({'responses': responses})
+
+    @app.route('/admin/stats', methods=['GET'])
+    def admin_stats():
+        return jsonify({
+            'central_bank': dict(central_bank_stats, faults=central_bank_faults.as_dict()),
+            'registered': registry,
+            'partners': {prefix: partner.as_dict() for prefix, partner in partners.items()}
+        })
+
+    @app.route('/admin/central-bank/faults', methods=['PUT'])
+    def admin_central_bank_faults():
+        try:
+            central_bank_faults.update(**(request.get_json(silent=True) or {}))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(central_bank_faults.as_dict())
+
+    @app.route('/admin/partners/<prefix>/faults', methods=['PUT'])
+    def admin_partner_faults(prefix):
+        partner, error = get_partner(prefix)
+        if error:
+            return error
+        try:
+            partner.faults.update(**(request.get_json(silent=True) or {}))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(partner.faults.as_dict())
+
+    @app.route('/admin/partners/<prefix>/rotate-keys', methods=['POST'])
+    def admin_rotate_keys(prefix):
+        partner, error = get_partner(prefix)
+        if error:
+            return error
+        return jsonify({'kid': partner.keys.rotate()})
+
+    return app
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class SimulatorServer:
+    """Runs a simulator app on a local port in a background thread.
+
+    Use as a context manager; ``url`` is the Central Bank URL to configure
+    the app under test with. Arguments after ``partners`` are passed to
+    ``create_simulator_app``.
+    """
+
+    def __init__(self, partners, host='127.0.0.1', port=0, quiet=True, **options):
+        self.partners = partners
+        self.app = create_simulator_app(partners, **options)
+        self.server = make_server(host, port, self.app, threaded=True,
+                                  request_handler=_QuietRequestHandler if quiet else None)
+        self.url = f'http://{host}:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,9 +1,7 @@
 from flask import request, jsonify, current_app
 from flask_login import login_required
 from . import transactions_bp
-from ..models import BankSettings
-from ..utils.crypto import generate_jwks
-from ..utils.transaction_handler import process_incoming_transaction
+from ..utils.settings import get_key_material
 import base64
 import json
 
@@ -18,6 +16,7 @@ def b2b_transaction():
         jwt_token = data['jwt']
         
         # Process the incoming transaction
+        from ..utils.transaction_handler import process_incoming_transaction
         response, status_code = process_incoming_transaction(jwt_token)
         
         return jsonify(response), status_code
@@ -25,19 +24,44 @@ def b2b_transaction():
         current_app.logger.error(f"Error processing B2B transaction: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@transactions_bp.route('/b2b/batch', methods=['POST'])
+def b2b_batch_transaction():
+    """Endpoint for receiving a batch of transactions from another bank."""
+    try:
+        data = request.get_json()
+        if not data or ('jwts' not in data and 'jwt' not in data):
+            return jsonify({'error': 'Invalid request format'}), 400
+        
+        jwt_tokens = data['jwts'] if 'jwts' in data else [data['jwt']]
+        if not isinstance(jwt_tokens, list) or not jwt_tokens:
+            return jsonify({'error': 'Invalid request format'}), 400
+        if len(jwt_tokens) > current_app.config.get('B2B_BATCH_MAX_ITEMS', 1000):
+            return jsonify({'error': 'Too many transfers in one batch'}), 413
+        
+        from ..utils.transaction_handler import process_incoming_batch
+        results = process_incoming_batch(jwt_tokens)
+        
+        return jsonify({'results': results}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error processing B2B batch: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @transactions_bp.route('/jwks', methods=['GET'])
 def jwks():
     """JWKS endpoint for exposing the bank's public key."""
     try:
-        # Get the bank settings
-        bank_settings = BankSettings.query.first()
-        if not bank_settings or not bank_settings.public_key:
+        # The JWKS document is serialized once per key version
+        key_material = get_key_material()
+        if not key_material or not key_material.jwks_bytes:
             return jsonify({'error': 'Bank not properly configured with keys'}), 500
         
-        # Generate JWKS from the public key
-        jwks_data = generate_jwks(bank_settings.public_key)
+        response = current_app.response_class(key_material.jwks_bytes, mimetype='application/json')
+        response.set_etag(key_material.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config.get('JWKS_MAX_AGE', 300)
         
-        return jsonify(jwks_data)
+        # Answers If-None-Match with 304 Not Modified
+        return response.make_conditional(request)
     except Exception as e:
         current_app.logger.error(f"Error serving JWKS: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
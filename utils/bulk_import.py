@@ -0,0 +1,345 @@
+import csv
+import json
+import re
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy import insert, select, func
+
+from ..models import User, Account, Transaction
+from .. import db
+from .money import to_minor
+from .settings import get_bank_settings
+from .ledger import post_entries, post_transaction_entries, rebuild_balances, backfill_ledger
+
+# Statuses an imported transaction may have
+TRANSACTION_STATUSES = ('completed', 'failed', 'pending', 'processing')
+
+
+class InvalidRecord:
+    """An input line that could not be read as a record."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def read_records(source, file_format=None):
+    """Yield dicts from an open CSV or NDJSON file, one record at a time.
+
+    ``file_format`` defaults to the file name's extension (``.csv`` is CSV,
+    anything else NDJSON). An NDJSON line that does not parse is yielded as
+    an InvalidRecord, so the import reports it and goes on.
+    """
+    if file_format is None:
+        file_format = 'csv' if str(getattr(source, 'name', '')).lower().endswith('.csv') else 'ndjson'
+    if file_format == 'csv':
+        for record in csv.DictReader(source):
+            # Empty CSV cells mean "not given"
+            yield {key: value for key, value in record.items() if value not in ('', None)}
+    else:
+        for line in source:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield InvalidRecord(f'invalid JSON: {e}')
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _valid_records(chunk, start, stats):
+    # (line, record) of the chunk's records; anything else is a line error
+    records = []
+    for line, record in enumerate(chunk, start):
+        if isinstance(record, dict):
+            records.append((line, record))
+        elif isinstance(record, InvalidRecord):
+            stats.error(line, record.message)
+        else:
+            stats.error(line, 'not a JSON object')
+    return records
+
+def _amount_minor(record, currency, field='amount'):
+    value = record.get(f'{field}_minor')
+    if value is not None:
+        # Minor units are whole by definition; refuse 1.9 rather than truncate it
+        if isinstance(value, str) and re.fullmatch(r'\s*[+-]?\d+\s*', value):
+            return int(value)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f'{field}_minor must be an integer, not {value!r}')
+        return value
+    if record.get(field) is not None:
+        return to_minor(str(record[field]), currency)
+    return None
+
+def _created_at(record):
+    value = record.get('created_at')
+    if not value:
+        return datetime.utcnow()
+    if not isinstance(value, str):
+        raise ValueError(f'created_at must be an ISO 8601 string, not {value!r}')
+    return datetime.fromisoformat(value)
+
+def _max_id(column):
+    return db.session.execute(select(func.coalesce(func.max(column), 0))).scalar()
+
+class ImportStats:
+    """Counters of one import run."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.skipped += 1
+        # Keep the first few so a bad file does not fill memory
+        if len(self.errors) < 20:
+            self.errors.append(f'record {line}: {message}')
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'elapsed': round(elapsed, 3),
+            'rows_per_second': round(self.rows / elapsed, 1) if elapsed else None
+        }
+
+
+def import_accounts(records, chunk_size=5000, rebuild=True, progress=None):
+    """Bulk insert users and accounts from records.
+
+    Each record has ``username`` and optionally ``full_name``, ``email``,
+    ``password_hash``, ``account_number``, ``currency`` and an opening
+    ``balance`` (or ``balance_minor``). Missing users are created without a
+    password. Existing account numbers are skipped, so a failed import can be
+    re-run. Opening balances are written as completed incoming transactions
+    with their ledger entries, and the balances of the new accounts are then
+    rebuilt from the ledger.
+
+    Every chunk is inserted with multi-row core INSERTs and committed on its
+    own. ``progress`` is called with the stats after each chunk.
+    """
+    stats = ImportStats()
+    first_account_id = _max_id(Account.id) + 1
+    bank_prefix = None
+    for chunk in _chunks(records, chunk_size):
+        start = stats.rows + 1
+        stats.rows += len(chunk)
+        chunk = _valid_records(chunk, start, stats)
+
+        usernames = {str(record['username']) for _, record in chunk if record.get('username')}
+        user_ids = dict(db.session.execute(
+            select(User.username, User.id).where(User.username.in_(usernames))
+        ).all())
+        new_users = {}
+        for _, record in chunk:
+            username = str(record.get('username') or '')
+            if username and username not in user_ids and username not in new_users:
+                new_users[username] = {
+                    'username': username,
+                    'full_name': record.get('full_name'),
+                    'email': record.get('email'),
+                    'password_hash': record.get('password_hash'),
+                    'is_admin': False,
+                    'created_at': datetime.utcnow()
+                }
+        if new_users:
+            db.session.execute(insert(User), list(new_users.values()))
+            user_ids.update(db.session.execute(
+                select(User.username, User.id).where(User.username.in_(list(new_users)))
+            ).all())
+
+        numbers = {str(record['account_number']) for _, record in chunk if record.get('account_number')}
+        existing = set(db.session.execute(
+            select(Account.account_number).where(Account.account_number.in_(numbers))
+        ).scalars()) if numbers else set()
+
+        accounts = []
+        opening_balances = {}
+        for line, record in chunk:
+            username = str(record.get('username') or '')
+            if not username:
+                stats.error(line, 'missing username')
+                continue
+            currency = str(record.get('currency') or 'EUR').upper()
+            try:
+                balance_minor = _amount_minor(record, currency, 'balance') or 0
+            except ValueError as e:
+                stats.error(line, str(e))
+                continue
+            account_number = record.get('account_number')
+            if account_number is None:
+                if bank_prefix is None:
+                    settings = get_bank_settings()
+                    bank_prefix = settings.bank_prefix if settings else 'BNK'
+                account_number = Account.generate_account_number(bank_prefix)
+            account_number = str(account_number)
+            if account_number in existing:
+                stats.error(line, f'account {account_number} already exists')
+                continue
+            existing.add(account_number)
+            accounts.append({
+                'account_number': account_number,
+                'user_id': user_ids[username],
+                'balance_minor': 0,
+                'balance_shards': 0,
+                'currency': currency,
+                'is_active': True,
+                'created_at': datetime.utcnow()
+            })
+            if balance_minor:
+                opening_balances[account_number] = (balance_minor, currency)
+
+        if accounts:
+            db.session.execute(insert(Account), accounts)
+            stats.inserted += len(accounts)
+        if opening_balances:
+            account_ids = dict(db.session.execute(
+                select(Account.account_number, Account.id)
+                .where(Account.account_number.in_(list(opening_balances)))
+            ).all())
+            now = datetime.utcnow()
+            opening_transactions = [
+                {
+                    'transaction_id': uuid.uuid4().hex,
+                    'account_from_id': None,
+                    'account_to_id': account_ids[number],
+                    'amount_minor': amount_minor,
+                    'currency': currency,
+                    'explanation': 'Opening balance',
+                    'status': 'completed',
+                    'is_internal': False,
+                    'created_at': now,
+                    'completed_at': now,
+                    'attempts': 0
+                }
+                for number, (amount_minor, currency) in opening_balances.items()
+            ]
+            db.session.execute(insert(Transaction), opening_transactions)
+            post_entries([
+                {
+                    'account_id': row['account_to_id'],
+                    'amount_minor': row['amount_minor'],
+                    'kind': 'opening',
+                    'transaction_ref': row['transaction_id'],
+                    'created_at': now
+                }
+                for row in opening_transactions
+            ])
+        db.session.commit()
+        if progress:
+            progress(stats)
+
+    if rebuild:
+        rebuild_balances(Account.id >= first_account_id)
+        db.session.commit()
+    return stats.as_dict()
+
+def import_transactions(records, chunk_size=5000, rebuild=True, progress=None):
+    """Bulk insert transactions from records.
+
+    Each record has ``account_from`` and/or ``account_to`` (account numbers;
+    numbers that are not ours are stored as the external account), an
+    ``amount`` (or ``amount_minor``) and ``currency``, and optionally
+    ``transaction_id``, ``explanation``, ``status`` (default completed),
+    ``created_at``, ``sender_name`` and ``receiver_name``. Existing
+    transaction ids are skipped. Ledger entries are written for every
+    imported transaction (accounts that predate the ledger are backfilled
+    first), and afterwards the balances of every account the import touched
+    are rebuilt from the ledger.
+    """
+    stats = ImportStats()
+    first_transaction_id = _max_id(Transaction.id) + 1
+    for chunk in _chunks(records, chunk_size):
+        start = stats.rows + 1
+        stats.rows += len(chunk)
+        chunk = _valid_records(chunk, start, stats)
+
+        numbers = set()
+        for _, record in chunk:
+            numbers.update(str(record[key]) for key in ('account_from', 'account_to') if record.get(key))
+        account_ids = dict(db.session.execute(
+            select(Account.account_number, Account.id).where(Account.account_number.in_(numbers))
+        ).all()) if numbers else {}
+        given_ids = {str(record['transaction_id']) for _, record in chunk if record.get('transaction_id')}
+        existing = set(db.session.execute(
+            select(Transaction.transaction_id).where(Transaction.transaction_id.in_(given_ids))
+        ).scalars()) if given_ids else set()
+
+        rows = []
+        for line, record in chunk:
+            account_from = str(record.get('account_from') or '') or None
+            account_to = str(record.get('account_to') or '') or None
+            from_id = account_ids.get(account_from)
+            to_id = account_ids.get(account_to)
+            if from_id is None and to_id is None:
+                stats.error(line, 'neither account belongs to this bank')
+                continue
+            currency = str(record.get('currency') or 'EUR').upper()
+            try:
+                amount_minor = _amount_minor(record, currency)
+                created_at = _created_at(record)
+            except ValueError as e:
+                stats.error(line, str(e))
+                continue
+            if amount_minor is None or amount_minor <= 0:
+                stats.error(line, 'missing or non-positive amount')
+                continue
+            status = record.get('status', 'completed')
+            if status not in TRANSACTION_STATUSES:
+                stats.error(line, f'unknown status {status!r}')
+                continue
+            transaction_id = str(record.get('transaction_id') or uuid.uuid4().hex)
+            if transaction_id in existing:
+                stats.error(line, f'transaction {transaction_id} already exists')
+                continue
+            existing.add(transaction_id)
+            rows.append({
+                'transaction_id': transaction_id,
+                'account_from_id': from_id,
+                'account_to_id': to_id,
+                # The counterparty at another bank
+                'account_to_external': account_from if from_id is None else (account_to if to_id is None else None),
+                'amount_minor': amount_minor,
+                'currency': currency,
+                'explanation': record.get('explanation'),
+                'status': status,
+                'is_internal': from_id is not None and to_id is not None,
+                'created_at': created_at,
+                'completed_at': created_at if status == 'completed' else None,
+                'sender_name': record.get('sender_name'),
+                'receiver_name': record.get('receiver_name'),
+                'attempts': 0
+            })
+
+        if rows:
+            # Give accounts not yet on the ledger their history first, so
+            # the rebuild below does not drop their existing balance
+            backfill_ledger(Account.id.in_(set(account_ids.values())))
+            db.session.execute(insert(Transaction), rows)
+            post_transaction_entries(Transaction.transaction_id.in_([row['transaction_id'] for row in rows]))
+            stats.inserted += len(rows)
+        db.session.commit()
+        if progress:
+            progress(stats)
+
+    if rebuild and stats.inserted:
+        imported = select(Transaction.account_from_id).where(Transaction.id >= first_transaction_id) \
+            .union(select(Transaction.account_to_id).where(Transaction.id >= first_transaction_id))
+        rebuild_balances(Account.id.in_(imported))
+        db.session.commit()
+    return stats.as_dict()
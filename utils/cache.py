@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live.
+
+    An expired entry is kept for a further ``stale_ttl`` seconds so callers
+    can serve it while they refresh it in the background.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, stale_ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """Return ``(found, value, is_stale)`` for a key."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None, False
+
+            value, expires_at, stale_until = entry
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, value, False
+            if now < stale_until:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                return True, value, True
+
+            del self._entries[key]
+            self.misses += 1
+            return False, None, False
+
+    def peek(self, key):
+        """Return True if a fresh or stale value is cached, without counting a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() < entry[2]
+
+    def get(self, key, default=None):
+        """Return a fresh or stale value, or ``default`` if there is none."""
+        found, value, _ = self.lookup(key)
+        return value if found else default
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entry if full."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at, expires_at + self.stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drop one key, or every key when ``key`` is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return the hit/miss counters and current size."""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -1,9 +1,12 @@
-import requests
 import json
+import threading
 from flask import current_app
 import os
 from ..models import BankSettings
 from .. import db
+from .cache import TTLCache
+from .http import get_http_client
+from .settings import get_bank_settings, invalidate_bank_settings
 
 def register_with_central_bank():
     """Register the bank with the Central Bank."""
@@ -34,10 +37,11 @@ def register_with_central_bank():
         }
         
         # Send the registration request to the Central Bank
-        response = requests.post(
+        response = get_http_client().post(
             f"{current_app.config.get('CENTRAL_BANK_URL')}/register",
             json=registration_data,
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json'},
+            breaker_key='central-bank'
         )
         
         if response.status_code == 200:
@@ -50,6 +54,7 @@ def register_with_central_bank():
             
             db.session.add(bank_settings)
             db.session.commit()
+            invalidate_bank_settings()
             
             return {
                 'success': True,
@@ -68,8 +73,104 @@ def register_with_central_bank():
             'error': str(e)
         }
 
+class BankDirectory:
+    """Cache of Central Bank lookups keyed by bank prefix.
+
+    Successful lookups are kept for ``ttl`` seconds and unknown prefixes for
+    ``negative_ttl`` seconds. Other failures (the Central Bank being down)
+    are kept for ``failure_ttl`` seconds, unless details that can still be
+    served are cached. Expired entries are served for up to ``stale_ttl``
+    seconds more while a background thread refreshes them.
+    """
+
+    def __init__(self, fetch, max_size=1024, ttl=300, negative_ttl=30, stale_ttl=600, failure_ttl=5):
+        self._fetch = fetch
+        self._cache = TTLCache(max_size=max_size, ttl=ttl, stale_ttl=stale_ttl)
+        self.negative_ttl = negative_ttl
+        self.failure_ttl = failure_ttl
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, bank_prefix):
+        """Return the bank details for a prefix, fetching them if needed."""
+        found, details, is_stale = self._cache.lookup(bank_prefix)
+        if found:
+            if is_stale:
+                self._refresh_in_background(bank_prefix)
+            return dict(details)
+        return dict(self._load(bank_prefix))
+
+    def peek(self, bank_prefix):
+        """Return True if ``get`` would answer from the cache."""
+        return self._cache.peek(bank_prefix)
+
+    def store(self, bank_prefix, details):
+        """Cache a lookup result fetched elsewhere (e.g. by the async ingress)."""
+        if details.get('success'):
+            self._cache.set(bank_prefix, details)
+        elif details.get('not_found'):
+            self._cache.set(bank_prefix, details, ttl=self.negative_ttl)
+        elif self.failure_ttl and not self._cache.peek(bank_prefix):
+            # Remembered briefly so every transfer does not retry it
+            self._cache.set(bank_prefix, details, ttl=self.failure_ttl)
+
+    def invalidate(self, bank_prefix=None):
+        """Forget one prefix, or the whole directory when none is given."""
+        self._cache.invalidate(bank_prefix)
+
+    def stats(self):
+        return self._cache.stats()
+
+    def _load(self, bank_prefix):
+        details = self._fetch(bank_prefix)
+        self.store(bank_prefix, details)
+        return details
+
+    def _refresh_in_background(self, bank_prefix):
+        with self._lock:
+            if bank_prefix in self._refreshing:
+                return
+            self._refreshing.add(bank_prefix)
+
+        app = current_app._get_current_object()
+
+        def refresh():
+            try:
+                with app.app_context():
+                    self._load(bank_prefix)
+            except Exception as e:
+                app.logger.error(f"Error refreshing bank details for {bank_prefix}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(bank_prefix)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+def get_bank_directory():
+    """Return the bank directory cache for the current application."""
+    directory = current_app.extensions.get('bank_directory')
+    if directory is None:
+        config = current_app.config
+        directory = BankDirectory(
+            fetch_bank_details,
+            max_size=config.get('BANK_DIRECTORY_MAX_SIZE', 1024),
+            ttl=config.get('BANK_DIRECTORY_TTL', 300),
+            negative_ttl=config.get('BANK_DIRECTORY_NEGATIVE_TTL', 30),
+            stale_ttl=config.get('BANK_DIRECTORY_STALE_TTL', 600),
+            failure_ttl=config.get('BANK_DIRECTORY_FAILURE_TTL', 5)
+        )
+        current_app.extensions['bank_directory'] = directory
+    return directory
+
+def invalidate_bank_details(bank_prefix=None):
+    """Drop cached Central Bank details for a prefix (or for every prefix)."""
+    directory = current_app.extensions.get('bank_directory')
+    if directory is not None:
+        directory.invalidate(bank_prefix)
+
 def get_bank_details(bank_prefix):
-    """Get bank details from the Central Bank by bank prefix."""
+    """Get bank details from the Central Bank by bank prefix, using the cache."""
     if current_app.config.get('TEST_MODE'):
         # Mock response in test mode
         return {
@@ -79,37 +180,59 @@ def get_bank_details(bank_prefix):
             'jwks_url': 'http://localhost:5001/transactions/jwks'
         }
     
+    return get_bank_directory().get(bank_prefix)
+
+def bank_details_request(bank_prefix):
+    """Return the URL and headers of a Central Bank lookup.
+    
+    Returns ``(None, error)`` with an error result if we are not registered.
+    """
+    # Get the bank settings for API key
+    bank_settings = get_bank_settings()
+    if not bank_settings or not bank_settings.api_key:
+        return None, {
+            'success': False,
+            'error': 'Bank not registered with Central Bank'
+        }
+    
+    return (
+        f"{current_app.config.get('CENTRAL_BANK_URL')}/banks/{bank_prefix}",
+        {
+            'Authorization': f"Bearer {bank_settings.api_key}",
+            'Content-Type': 'application/json'
+        }
+    ), None
+
+def bank_details_from_response(status_code, data, text):
+    """Turn a Central Bank lookup response into a bank details result."""
+    if status_code == 200 and isinstance(data, dict):
+        return {
+            'success': True,
+            'bank_name': data.get('bank_name'),
+            'transaction_url': data.get('transaction_url'),
+            'jwks_url': data.get('jwks_url')
+        }
+    return {
+        'success': False,
+        'not_found': status_code == 404,
+        'error': f"Failed to get bank details: {text}"
+    }
+
+def fetch_bank_details(bank_prefix):
+    """Fetch bank details from the Central Bank, bypassing the cache."""
     try:
-        # Get the bank settings for API key
-        bank_settings = BankSettings.query.first()
-        if not bank_settings or not bank_settings.api_key:
-            return {
-                'success': False,
-                'error': 'Bank not registered with Central Bank'
-            }
+        request, error = bank_details_request(bank_prefix)
+        if error:
+            return error
         
         # Send the request to the Central Bank
-        response = requests.get(
-            f"{current_app.config.get('CENTRAL_BANK_URL')}/banks/{bank_prefix}",
-            headers={
-                'Authorization': f"Bearer {bank_settings.api_key}",
-                'Content-Type': 'application/json'
-            }
+        url, headers = request
+        response = get_http_client().get(url, headers=headers, breaker_key='central-bank')
+        return bank_details_from_response(
+            response.status_code,
+            response.json() if response.status_code == 200 else None,
+            response.text
         )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return {
-                'success': True,
-                'bank_name': data.get('bank_name'),
-                'transaction_url': data.get('transaction_url'),
-                'jwks_url': data.get('jwks_url')
-            }
-        else:
-            return {
-                'success': False,
-                'error': f"Failed to get bank details: {response.text}"
-            }
     except Exception as e:
         current_app.logger.error(f"Error getting bank details: {str(e)}")
         return {
@@ -4,8 +4,11 @@ from cryptography.hazmat.backends import default_backend
 import jwt
 import json
 import base64
+import time
 from flask import current_app
 
+from .metrics import record_jwt
+
 def generate_key_pair():
     """Generate an RSA key pair for JWT signing."""
     # Generate private key
@@ -46,47 +49,87 @@ def load_public_key(public_key_pem):
         backend=default_backend()
     )
 
-def generate_jwt(payload, private_key_pem, kid='1'):
-    """Generate a JWT token signed with the private key."""
+def generate_jwt(payload, private_key, kid='1'):
+    """Generate a JWT token signed with a private key object or PEM string."""
     headers = {
         'alg': 'RS256',
         'kid': kid
     }
     
-    return jwt.encode(
+    started = time.perf_counter()
+    token = jwt.encode(
         payload=payload,
-        key=private_key_pem,
+        key=private_key,
         algorithm='RS256',
         headers=headers
     )
+    record_jwt('sign', time.perf_counter() - started)
+    return token
 
-def verify_jwt(token, public_key_pem):
-    """Verify a JWT token using the public key."""
+def verify_jwt(token, public_key, leeway=0):
+    """Verify a JWT token using a public key object or PEM string.
+    
+    ``exp`` and ``iat`` are checked when present, allowing ``leeway`` seconds
+    of clock skew.
+    """
     try:
         return jwt.decode(
             token,
-            public_key_pem,
-            algorithms=['RS256']
+            public_key,
+            algorithms=['RS256'],
+            leeway=leeway
         )
     except jwt.InvalidTokenError as e:
         current_app.logger.error(f"JWT verification failed: {str(e)}")
         return None
 
-def generate_jwks(public_key_pem, kid='1'):
-    """Generate a JWKS (JSON Web Key Set) from a public key."""
-    public_key = load_public_key(public_key_pem)
-    
-    # Get the public key in DER format
+def base64url_encode_int(value):
+    """Encode an integer as an unpadded base64url string (as used in JWKs)."""
+    return base64.urlsafe_b64encode(value.to_bytes((value.bit_length() + 7) // 8, byteorder='big')).decode('utf-8').rstrip('=')
+
+def public_key_to_jwk(public_key, kid='1'):
+    """Convert a cryptography RSA public key object to a JWK."""
     public_numbers = public_key.public_numbers()
-    
-    # Convert to JWK format
-    jwk = {
+    return {
         'kty': 'RSA',
         'use': 'sig',
         'kid': kid,
         'alg': 'RS256',
-        'n': base64.urlsafe_b64encode(public_numbers.n.to_bytes((public_numbers.n.bit_length() + 7) // 8, byteorder='big')).decode('utf-8').rstrip('='),
-        'e': base64.urlsafe_b64encode(public_numbers.e.to_bytes((public_numbers.e.bit_length() + 7) // 8, byteorder='big')).decode('utf-8').rstrip('=')
+        'n': base64url_encode_int(public_numbers.n),
+        'e': base64url_encode_int(public_numbers.e)
     }
+
+def jwk_thumbprint(public_key):
+    """Compute the RFC 7638 thumbprint of an RSA public key, used as its kid."""
+    jwk = public_key_to_jwk(public_key)
+    canonical = json.dumps({'e': jwk['e'], 'kty': 'RSA', 'n': jwk['n']}, separators=(',', ':'), sort_keys=True)
+    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+    digest.update(canonical.encode('utf-8'))
+    return base64.urlsafe_b64encode(digest.finalize()).decode('utf-8').rstrip('=')
+
+def generate_jwks(public_key_pem, kid='1'):
+    """Generate a JWKS (JSON Web Key Set) from a public key."""
+    return {'keys': [public_key_to_jwk(load_public_key(public_key_pem), kid)]}
+
+def base64url_decode_int(value):
+    """Decode an unpadded base64url string (as used in JWKs) to an integer."""
+    padded = value + '=' * (-len(value) % 4)
+    return int.from_bytes(base64.urlsafe_b64decode(padded.encode('utf-8')), byteorder='big')
+
+def jwk_to_public_key(jwk):
+    """Convert an RSA JWK to a cryptography public key object."""
+    if jwk.get('kty') != 'RSA':
+        raise ValueError(f"Unsupported key type: {jwk.get('kty')}")
     
-    return {'keys': [jwk]}
+    public_numbers = rsa.RSAPublicNumbers(
+        e=base64url_decode_int(jwk['e']),
+        n=base64url_decode_int(jwk['n'])
+    )
+    return public_numbers.public_key(default_backend())
+
+def jwk_to_pem(jwk):
+    """Convert an RSA JWK to a PEM encoded public key."""
+    return jwk_to_public_key(jwk).public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
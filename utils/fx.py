@@ -0,0 +1,226 @@
+import json
+import threading
+import time
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+from types import MappingProxyType
+from flask import current_app
+
+from ..models import ExchangeRate
+from .. import db
+from .money import exponent
+
+
+class RateUnavailable(Exception):
+    """Raised when there is no exchange rate between two currencies."""
+
+
+class RateSnapshot:
+    """An immutable set of exchange rates.
+
+    All direct, inverse and cross rates (through ``base_currency``) are
+    worked out once when the snapshot is built, so a lookup is a single
+    dict read. Replace the snapshot instead of changing it.
+    """
+
+    def __init__(self, rates, base_currency='EUR', version=None):
+        self.version = version
+        self.base_currency = base_currency
+        matrix = {}
+        for (base, quote), rate in rates.items():
+            rate = Decimal(rate)
+            if rate > 0:
+                matrix[(base, quote)] = rate
+                matrix.setdefault((quote, base), 1 / rate)
+
+        # Cross rates between any two currencies quoted against the base
+        quoted = {quote: rate for (base, quote), rate in matrix.items() if base == base_currency}
+        for from_currency, from_rate in quoted.items():
+            for to_currency, to_rate in quoted.items():
+                if from_currency != to_currency:
+                    matrix.setdefault((from_currency, to_currency), to_rate / from_rate)
+        self._rates = MappingProxyType(matrix)
+
+    @property
+    def currencies(self):
+        return sorted({currency for pair in self._rates for currency in pair})
+
+    def rate(self, from_currency, to_currency):
+        """Return the Decimal rate from one currency to another. Raises RateUnavailable."""
+        if from_currency == to_currency:
+            return Decimal(1)
+        try:
+            return self._rates[(from_currency, to_currency)]
+        except KeyError:
+            raise RateUnavailable(f"No exchange rate from {from_currency} to {to_currency}") from None
+
+    def convert(self, amount_minor, from_currency, to_currency):
+        """Convert integer minor units of one currency to another."""
+        return self.convert_many([amount_minor], from_currency, to_currency)[0]
+
+    def convert_many(self, amounts_minor, from_currency, to_currency):
+        """Convert a sequence of minor unit amounts with one rate lookup.
+
+        Results are rounded half to even to the target currency's minor
+        unit, so rounding does not bias totals in either direction.
+        """
+        if from_currency == to_currency:
+            return [int(amount) for amount in amounts_minor]
+        factor = self.rate(from_currency, to_currency).scaleb(exponent(to_currency) - exponent(from_currency))
+        one = Decimal(1)
+        return [int((factor * amount).quantize(one, rounding=ROUND_HALF_EVEN)) for amount in amounts_minor]
+
+    def convert_totals(self, totals, to_currency):
+        """Sum a ``{currency: minor}`` dict into one amount of ``to_currency``."""
+        return sum(self.convert(minor, currency, to_currency) for currency, minor in totals.items())
+
+
+class RateProvider:
+    """Source of exchange rates for ``flask load-fx-rates``.
+
+    Subclasses return ``{(base, quote): Decimal}`` from ``fetch_rates``.
+    """
+    name = None
+
+    def fetch_rates(self):
+        raise NotImplementedError
+
+
+class StaticRateProvider(RateProvider):
+    """Rates given in code or config, e.g. ``'EUR/USD=1.08,EUR/GBP=0.85'``."""
+    name = 'static'
+
+    def __init__(self, rates):
+        if isinstance(rates, str):
+            rates = dict(item.split('=', 1) for item in rates.split(',') if item.strip())
+        self.rates = {}
+        for pair, rate in rates.items():
+            base, quote = pair.split('/') if isinstance(pair, str) else pair
+            self.rates[(base.strip().upper(), quote.strip().upper())] = _parse_rate(rate)
+
+    def fetch_rates(self):
+        return dict(self.rates)
+
+
+class FileRateProvider(RateProvider):
+    """Rates from a JSON file: ``{"base": "EUR", "rates": {"USD": "1.08"}}``."""
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch_rates(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        base = data.get('base', 'EUR').upper()
+        return {
+            (base, quote.upper()): _parse_rate(rate)
+            for quote, rate in data.get('rates', {}).items()
+        }
+
+
+def _parse_rate(rate):
+    try:
+        # Go through str() so float rates keep their shortest decimal form
+        value = Decimal(str(rate).strip())
+    except InvalidOperation as e:
+        raise ValueError(f"Invalid exchange rate: {rate!r}") from e
+    if not value.is_finite() or value <= 0:
+        raise ValueError(f"Invalid exchange rate: {rate!r}")
+    return value
+
+def get_rate_provider(name=None):
+    """Build the rate provider selected by FX_RATE_PROVIDER."""
+    name = name or current_app.config.get('FX_RATE_PROVIDER', 'file')
+    if name == 'static':
+        return StaticRateProvider(current_app.config.get('FX_STATIC_RATES', ''))
+    if name == 'file':
+        return FileRateProvider(current_app.config.get('FX_RATES_FILE'))
+    raise ValueError(f"Unknown FX rate provider: {name}")
+
+
+class _RateHolder:
+    def __init__(self, check_interval, base_currency):
+        self.check_interval = check_interval
+        self.base_currency = base_currency
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return snapshot
+
+        with self.lock:
+            if self.snapshot is not None and time.monotonic() - self.checked_at < self.check_interval:
+                return self.snapshot
+
+            # Only the table version is read unless the rates changed
+            version = tuple(db.session.query(
+                db.func.count(ExchangeRate.id), db.func.max(ExchangeRate.updated_at)
+            ).one())
+            if self.snapshot is None or self.snapshot.version != version:
+                rows = db.session.query(
+                    ExchangeRate.base_currency, ExchangeRate.quote_currency, ExchangeRate.rate
+                ).all()
+                # Swapped in as a whole; readers keep whichever snapshot they got
+                self.snapshot = RateSnapshot(
+                    {(base, quote): rate for base, quote, rate in rows},
+                    base_currency=self.base_currency,
+                    version=version
+                )
+            self.checked_at = time.monotonic()
+            return self.snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshot = None
+            self.checked_at = 0.0
+
+
+def _get_holder():
+    holder = current_app.extensions.get('fx_rates')
+    if holder is None:
+        holder = _RateHolder(
+            current_app.config.get('FX_CHECK_INTERVAL', 60),
+            current_app.config.get('FX_BASE_CURRENCY', 'EUR')
+        )
+        current_app.extensions['fx_rates'] = holder
+    return holder
+
+def get_rates():
+    """Return the current RateSnapshot, reloading it if the rate table changed."""
+    return _get_holder().get()
+
+def invalidate_rates():
+    """Drop the cached snapshot, e.g. after loading new rates."""
+    _get_holder().invalidate()
+
+def convert(amount_minor, from_currency, to_currency):
+    """Convert minor units with the current rates. Raises RateUnavailable."""
+    if from_currency == to_currency:
+        return int(amount_minor)
+    return get_rates().convert(amount_minor, from_currency, to_currency)
+
+def convert_many(amounts_minor, from_currency, to_currency):
+    """Convert many minor unit amounts with the current rates in one pass."""
+    if from_currency == to_currency:
+        return [int(amount) for amount in amounts_minor]
+    return get_rates().convert_many(amounts_minor, from_currency, to_currency)
+
+def store_rates(rates, source=None):
+    """Insert or update ``{(base, quote): rate}`` in the rate table and commit."""
+    existing = {
+        (rate.base_currency, rate.quote_currency): rate
+        for rate in ExchangeRate.query.all()
+    }
+    for (base, quote), value in rates.items():
+        row = existing.get((base, quote))
+        if row is None:
+            db.session.add(ExchangeRate(base_currency=base, quote_currency=quote, rate=value, source=source))
+        elif row.rate != value or row.source != source:
+            row.rate = value
+            row.source = source
+    db.session.commit()
+    invalidate_rates()
+    return len(rates)
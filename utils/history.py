@@ -0,0 +1,87 @@
+import base64
+from datetime import datetime
+from sqlalchemy import select, union, or_, and_, func
+from sqlalchemy.orm import joinedload
+
+from ..models import Transaction, LedgerEntry
+from .. import db
+
+
+def encode_cursor(transaction):
+    """Encode a transaction's ``(created_at, id)`` position as an opaque cursor."""
+    raw = f"{transaction.created_at.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor into ``(created_at, id)``. Raises ValueError if it is invalid."""
+    try:
+        raw = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('utf-8')).decode('utf-8')
+        created_at, transaction_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(transaction_id)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def _before(position):
+    created_at, transaction_id = position
+    return or_(
+        Transaction.created_at < created_at,
+        and_(Transaction.created_at == created_at, Transaction.id < transaction_id)
+    )
+
+def _newest_ids(column, account_ids, position, limit):
+    # Each side walks its own (account, created_at, id) index in order
+    stmt = select(Transaction.id).where(column.in_(account_ids))
+    if position:
+        stmt = stmt.where(_before(position))
+    stmt = stmt.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit)
+    return select(stmt.subquery().c.id)
+
+def transaction_history(account_ids, limit=50, cursor=None):
+    """Return a page of the transactions sent or received by the given accounts.
+
+    Newest first, ordered by ``(created_at, id)``. The sent and received
+    sides are each read from their composite index, combined with a UNION
+    (so a transfer between two of the accounts appears once) and loaded in
+    a single query with both counterparties. Returns
+    ``(transactions, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    account_ids = list(account_ids)
+    if not account_ids:
+        return [], None
+
+    position = decode_cursor(cursor) if cursor else None
+    ids = union(
+        _newest_ids(Transaction.account_from_id, account_ids, position, limit + 1),
+        _newest_ids(Transaction.account_to_id, account_ids, position, limit + 1)
+    ).subquery()
+
+    transactions = db.session.execute(
+        select(Transaction)
+        .join(ids, Transaction.id == ids.c.id)
+        .options(joinedload(Transaction.sender), joinedload(Transaction.receiver))
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(limit + 1)
+    ).scalars().all()
+
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        return transactions, encode_cursor(transactions[-1])
+    return transactions, None
+
+def history_version(account_ids):
+    """Return a value that changes whenever the accounts' history or balances do.
+
+    Made of the accounts' latest ledger entry (every new transaction and
+    balance change adds one) and the latest status change of their outgoing
+    transfers. Both are read from indexes in a single query, without
+    loading any transactions.
+    """
+    account_ids = list(account_ids)
+    if not account_ids:
+        return None
+    latest_entry = select(func.max(LedgerEntry.id)) \
+        .where(LedgerEntry.account_id.in_(account_ids)).scalar_subquery()
+    latest_update = select(func.max(Transaction.updated_at)) \
+        .where(Transaction.account_from_id.in_(account_ids)).scalar_subquery()
+    entry_id, updated_at = db.session.execute(select(latest_entry, latest_update)).one()
+    return entry_id, updated_at.isoformat() if updated_at else None
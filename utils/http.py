@@ -0,0 +1,165 @@
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import current_app
+
+from .metrics import record_http, status_outcome
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fails calls to a host fast after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds. It then lets a single trial
+    call through (half-open); success closes it, failure opens it again.
+    Callers must record an outcome for every allowed call, including one
+    that ends in an unexpected exception, or the trial slot stays taken.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        """Return True if a call may be made now."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class HttpClient:
+    """Shared HTTP transport for Central Bank and partner bank calls.
+
+    One ``requests`` session keeps a pool of keep-alive connections per host.
+    Every call gets connect/read timeouts. Only idempotent methods are
+    retried, and each destination has its own circuit breaker.
+    """
+
+    def __init__(self, pool_connections=32, pool_maxsize=32, connect_timeout=3.05, read_timeout=10,
+                 retries=2, retry_backoff=0.2, breaker_threshold=5, breaker_reset=30):
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=retry_backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def breaker(self, key):
+        """Return the circuit breaker for a destination key."""
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+            return breaker
+
+    def request(self, method, url, breaker_key=None, **kwargs):
+        """Send a request through the pool.
+
+        ``breaker_key`` names the destination for the circuit breaker and
+        defaults to the URL's host. Raises CircuitOpenError when that
+        destination's breaker is open.
+        """
+        key = breaker_key or urlsplit(url).netloc
+        breaker = self.breaker(key)
+        if not breaker.allow():
+            record_http(key, method, 'circuit_open', 0.0)
+            raise CircuitOpenError(f"Circuit breaker open for {key}")
+
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except BaseException as e:
+            # Whatever ended the call, a half-open trial must be given back
+            breaker.record_failure()
+            if isinstance(e, requests.RequestException):
+                record_http(key, method, 'error', time.perf_counter() - started)
+            raise
+
+        record_http(key, method, status_outcome(response.status_code), time.perf_counter() - started)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def breaker_states(self):
+        """Return the state of every circuit breaker by destination."""
+        with self._lock:
+            return {key: breaker.state for key, breaker in self._breakers.items()}
+
+
+def get_http_client():
+    """Return the shared HTTP client for the current application."""
+    client = current_app.extensions.get('http_client')
+    if client is None:
+        config = current_app.config
+        client = HttpClient(
+            pool_connections=config.get('HTTP_POOL_CONNECTIONS', 32),
+            pool_maxsize=config.get('HTTP_POOL_MAXSIZE', 32),
+            connect_timeout=config.get('HTTP_CONNECT_TIMEOUT', 3.05),
+            read_timeout=config.get('HTTP_READ_TIMEOUT', 10),
+            retries=config.get('HTTP_RETRIES', 2),
+            retry_backoff=config.get('HTTP_RETRY_BACKOFF', 0.2),
+            breaker_threshold=config.get('CIRCUIT_BREAKER_THRESHOLD', 5),
+            breaker_reset=config.get('CIRCUIT_BREAKER_RESET', 30)
+        )
+        current_app.extensions['http_client'] = client
+    return client
@@ -0,0 +1,45 @@
+import json
+from datetime import datetime, timedelta
+
+from ..models import IdempotencyKey
+from .. import db
+
+
+def idempotency_key(transfer):
+    """Return the dedup key of an incoming transfer, or None if it has no id."""
+    transfer_id = transfer.get('transferId')
+    if not transfer_id:
+        return None
+    return f"{str(transfer.get('accountFrom') or '')[:3]}:{transfer_id}"[:160]
+
+def find_processed(keys):
+    """Return ``{key: (response, status_code)}`` for keys that were already processed."""
+    keys = [key for key in keys if key]
+    if not keys:
+        return {}
+    rows = db.session.query(IdempotencyKey.key, IdempotencyKey.response, IdempotencyKey.status_code) \
+        .filter(IdempotencyKey.key.in_(keys)).all()
+    return {key: (json.loads(response), status_code) for key, response, status_code in rows}
+
+def record_processed(key, response, status_code, ttl):
+    """Store the response for a key in the current DB transaction."""
+    now = datetime.utcnow()
+    db.session.add(IdempotencyKey(
+        key=key,
+        response=json.dumps(response),
+        status_code=status_code,
+        created_at=now,
+        expires_at=now + timedelta(seconds=ttl)
+    ))
+
+def purge_expired(batch_size=10000):
+    """Delete expired keys in batches. Returns the number of rows deleted."""
+    deleted = 0
+    while True:
+        ids = [row_id for (row_id,) in db.session.query(IdempotencyKey.id)
+               .filter(IdempotencyKey.expires_at < datetime.utcnow())
+               .limit(batch_size).all()]
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.query.filter(IdempotencyKey.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
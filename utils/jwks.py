@@ -0,0 +1,220 @@
+import re
+import threading
+import time
+from flask import current_app
+
+from .crypto import jwk_to_public_key
+from .http import get_http_client
+
+_MAX_AGE_RE = re.compile(r'max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+def parse_cache_control(header, default_ttl, max_ttl):
+    """Return how many seconds a response may be cached for."""
+    if not header:
+        return default_ttl
+
+    directives = header.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+
+    match = _MAX_AGE_RE.search(header)
+    if match:
+        return min(int(match.group(1)), max_ttl)
+    return default_ttl
+
+
+class _JWKSEntry:
+    __slots__ = ('jwks_url', 'keys', 'etag', 'expires_at', 'fetched_at')
+
+    def __init__(self, jwks_url):
+        self.jwks_url = jwks_url
+        self.keys = {}
+        self.etag = None
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+
+
+class JWKSCache:
+    """Per-bank cache of parsed JWKS public keys, indexed by ``(prefix, kid)``.
+
+    Keys are stored as loaded ``cryptography`` public key objects so a cache
+    hit needs no network call and no key parsing. Expiry follows the
+    partner's Cache-Control header, and refreshes send If-None-Match with the
+    last ETag. An unknown kid triggers at most one refetch per bank every
+    ``refetch_interval`` seconds, and a failed fetch is not retried for as
+    long.
+    """
+
+    def __init__(self, fetch=None, default_ttl=300, max_ttl=86400, refetch_interval=30):
+        self._fetch = fetch or self._http_fetch
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.refetch_interval = refetch_interval
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refetches = 0
+
+    def get_key(self, bank_prefix, jwks_url, kid):
+        """Return the public key object for a bank's kid, or None if unknown."""
+        entry = self._entries.get(bank_prefix)
+        now = time.monotonic()
+        if entry is not None and entry.jwks_url == jwks_url and now < entry.expires_at:
+            key = entry.keys.get(kid)
+            if key is not None:
+                self.hits += 1
+                return key
+
+        self.misses += 1
+        with self._bank_lock(bank_prefix):
+            # Another thread may have refreshed the entry while we waited
+            entry = self._entries.get(bank_prefix)
+            if entry is None or entry.jwks_url != jwks_url:
+                entry = _JWKSEntry(jwks_url)
+                self._refresh(bank_prefix, entry)
+            elif time.monotonic() >= entry.expires_at:
+                self._refresh(bank_prefix, entry)
+
+            key = entry.keys.get(kid)
+            if key is None and time.monotonic() - entry.fetched_at >= self.refetch_interval:
+                # The bank may have rotated its keys; refetch once
+                self.refetches += 1
+                self._refresh(bank_prefix, entry, conditional=False)
+                key = entry.keys.get(kid)
+            return key
+
+    def fetch_plan(self, bank_prefix, jwks_url, kid):
+        """Return ``(needed, etag)``: whether ``get_key`` would fetch the
+        bank's JWKS now, and the ETag it would send with the request."""
+        entry = self._entries.get(bank_prefix)
+        now = time.monotonic()
+        if entry is None or entry.jwks_url != jwks_url:
+            return True, None
+        if now >= entry.expires_at:
+            return True, entry.etag if entry.keys else None
+        if kid not in entry.keys and now - entry.fetched_at >= self.refetch_interval:
+            return True, None
+        return False, None
+
+    def store(self, bank_prefix, jwks_url, response):
+        """Apply a JWKS response fetched elsewhere (e.g. by the async ingress).
+
+        ``response`` is ``(status, jwks, headers)``, or None if the fetch
+        failed.
+        """
+        with self._bank_lock(bank_prefix):
+            entry = self._entries.get(bank_prefix)
+            if entry is None or entry.jwks_url != jwks_url:
+                entry = _JWKSEntry(jwks_url)
+            if response is None:
+                self._keep_stale(bank_prefix, entry)
+            else:
+                self._apply(bank_prefix, entry, *response)
+
+    def invalidate(self, bank_prefix=None):
+        """Forget the keys of one bank, or of every bank."""
+        with self._lock:
+            if bank_prefix is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(bank_prefix, None)
+
+    def stats(self):
+        return {
+            'banks': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refetches': self.refetches
+        }
+
+    def _bank_lock(self, bank_prefix):
+        with self._lock:
+            lock = self._locks.get(bank_prefix)
+            if lock is None:
+                lock = self._locks[bank_prefix] = threading.Lock()
+            return lock
+
+    def _refresh(self, bank_prefix, entry, conditional=True):
+        etag = entry.etag if conditional and entry.keys else None
+        try:
+            status, jwks, headers = self._fetch(bank_prefix, entry.jwks_url, etag)
+        except Exception as e:
+            current_app.logger.error(f"Error fetching JWKS for bank {bank_prefix}: {str(e)}")
+            self._keep_stale(bank_prefix, entry)
+            return
+        self._apply(bank_prefix, entry, status, jwks, headers)
+
+    def _apply(self, bank_prefix, entry, status, jwks, headers):
+        if status == 304:
+            entry.fetched_at = time.monotonic()
+        elif status == 200:
+            entry.fetched_at = time.monotonic()
+            entry.keys = self._parse_keys(bank_prefix, jwks)
+            entry.etag = headers.get('ETag')
+        else:
+            current_app.logger.error(f"JWKS endpoint of bank {bank_prefix} returned {status}")
+            self._keep_stale(bank_prefix, entry)
+            return
+
+        ttl = parse_cache_control(headers.get('Cache-Control'), self.default_ttl, self.max_ttl)
+        entry.expires_at = entry.fetched_at + ttl
+        with self._lock:
+            self._entries[bank_prefix] = entry
+
+    def _keep_stale(self, bank_prefix, entry):
+        # Keep verifying with the keys we already have rather than failing
+        # every transfer while the partner's JWKS endpoint is down. Without
+        # keys the failure itself is cached, so the endpoint is not retried
+        # on every transfer either
+        entry.fetched_at = time.monotonic()
+        entry.expires_at = entry.fetched_at + self.refetch_interval
+        with self._lock:
+            self._entries[bank_prefix] = entry
+
+    @staticmethod
+    def _parse_keys(bank_prefix, jwks):
+        keys = {}
+        for jwk in (jwks or {}).get('keys', []):
+            if jwk.get('use', 'sig') != 'sig' or jwk.get('alg', 'RS256') != 'RS256':
+                continue
+            try:
+                keys[jwk.get('kid')] = jwk_to_public_key(jwk)
+            except (KeyError, ValueError) as e:
+                current_app.logger.error(f"Invalid JWK {jwk.get('kid')} from bank {bank_prefix}: {str(e)}")
+        return keys
+
+    @staticmethod
+    def request_headers(etag):
+        """Headers of a JWKS request, conditional if we have an ETag."""
+        headers = {'Accept': 'application/json'}
+        if etag:
+            headers['If-None-Match'] = etag
+        return headers
+
+    @staticmethod
+    def _http_fetch(bank_prefix, jwks_url, etag):
+        headers = JWKSCache.request_headers(etag)
+        response = get_http_client().get(jwks_url, headers=headers, breaker_key=f'bank:{bank_prefix}')
+        jwks = response.json() if response.status_code == 200 else None
+        return response.status_code, jwks, response.headers
+
+
+def get_jwks_cache():
+    """Return the partner JWKS cache for the current application."""
+    cache = current_app.extensions.get('jwks_cache')
+    if cache is None:
+        config = current_app.config
+        cache = JWKSCache(
+            default_ttl=config.get('JWKS_CACHE_TTL', 300),
+            max_ttl=config.get('JWKS_CACHE_MAX_TTL', 86400),
+            refetch_interval=config.get('JWKS_REFETCH_INTERVAL', 30)
+        )
+        current_app.extensions['jwks_cache'] = cache
+    return cache
+
+def get_partner_public_key(bank_prefix, jwks_url, kid):
+    """Return a partner bank's public key object for a kid, or None."""
+    return get_jwks_cache().get_key(bank_prefix, jwks_url, kid)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import threading
+
+
+class BankKeyMaterial:
+    """Our bank's key pair loaded into key objects, plus the serialized JWKS.
+
+    Built once per key version so signing and serving the JWKS never parse
+    PEM or re-encode the modulus. The PEMs are parsed (and ``cryptography``
+    imported) on first use of a key, not when the settings are loaded.
+    """
+
+    def __init__(self, private_key_pem, public_key_pem, version=None):
+        self.version = version
+        self.private_key_pem = private_key_pem
+        self.public_key_pem = public_key_pem
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            from .crypto import load_private_key, load_public_key, public_key_to_jwk, jwk_thumbprint
+            private_key = load_private_key(self.private_key_pem) if self.private_key_pem else None
+            public_key = load_public_key(self.public_key_pem) if self.public_key_pem else None
+            if public_key is None and private_key is not None:
+                public_key = private_key.public_key()
+
+            if public_key is not None:
+                self._kid = jwk_thumbprint(public_key)
+                jwks = {'keys': [public_key_to_jwk(public_key, self._kid)]}
+                self._jwks_bytes = json.dumps(jwks, separators=(',', ':')).encode('utf-8')
+                self._etag = hashlib.sha256(self._jwks_bytes).hexdigest()
+            else:
+                self._kid = None
+                self._jwks_bytes = None
+                self._etag = None
+            self._private_key = private_key
+            self._public_key = public_key
+            self._loaded = True
+
+    def _get(self, name):
+        if not self._loaded:
+            self._load()
+        return getattr(self, name)
+
+    @property
+    def private_key(self):
+        return self._get('_private_key')
+
+    @property
+    def public_key(self):
+        return self._get('_public_key')
+
+    @property
+    def kid(self):
+        return self._get('_kid')
+
+    @property
+    def jwks_bytes(self):
+        return self._get('_jwks_bytes')
+
+    @property
+    def etag(self):
+        return self._get('_etag')
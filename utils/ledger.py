@@ -0,0 +1,254 @@
+from datetime import datetime
+from sqlalchemy import insert, select, update, func, case, literal, and_, or_
+
+from ..models import Account, AccountBalanceShard, Transaction, LedgerEntry, BalanceSnapshot
+from .. import db
+
+# Transaction statuses whose amount has left the sending account
+DEBITED_STATUSES = ('completed', 'pending', 'processing')
+
+
+def post_entries(entries, session=None):
+    """Append ledger entries with one multi-row INSERT. Does not commit.
+
+    ``entries`` are dicts with ``account_id``, ``amount_minor`` (negative for
+    a debit) and optionally ``kind``, ``transaction_ref`` and ``created_at``.
+    """
+    session = session or db.session
+    now = datetime.utcnow()
+    rows = [
+        {
+            'account_id': entry['account_id'],
+            'amount_minor': entry['amount_minor'],
+            'kind': entry.get('kind') or 'transfer',
+            'transaction_ref': entry.get('transaction_ref'),
+            'created_at': entry.get('created_at') or now
+        }
+        for entry in entries
+    ]
+    if rows:
+        session.execute(insert(LedgerEntry), rows)
+
+def _leg_posted(account_id_column):
+    return select(LedgerEntry.id).where(
+        LedgerEntry.account_id == account_id_column,
+        LedgerEntry.transaction_ref == Transaction.transaction_id
+    ).exists()
+
+def post_transaction_entries(condition, account_ids=None, session=None, unposted_only=False):
+    """Write the ledger legs of existing transactions with INSERT ... SELECT.
+
+    Completed credits become credit legs (in the converted amount where
+    there is one) and every debit that has not failed a debit leg, dated at
+    the transaction's creation. ``condition`` selects the transactions and
+    ``account_ids``, if given, the accounts whose legs are written. With
+    ``unposted_only``, legs already in the ledger are skipped. Used for
+    bulk imports and backfills. Does not commit.
+    """
+    session = session or db.session
+    credited = case(
+        (Transaction.converted_amount_minor.isnot(None), Transaction.converted_amount_minor),
+        else_=Transaction.amount_minor
+    )
+    credit_legs = select(
+        Transaction.account_to_id, credited, literal('transfer'), Transaction.transaction_id, Transaction.created_at
+    ).where(condition, Transaction.account_to_id.isnot(None), Transaction.status == 'completed')
+    debit_legs = select(
+        Transaction.account_from_id, -Transaction.amount_minor, literal('transfer'), Transaction.transaction_id, Transaction.created_at
+    ).where(condition, Transaction.account_from_id.isnot(None), Transaction.status.in_(DEBITED_STATUSES))
+    if account_ids is not None:
+        credit_legs = credit_legs.where(Transaction.account_to_id.in_(account_ids))
+        debit_legs = debit_legs.where(Transaction.account_from_id.in_(account_ids))
+    if unposted_only:
+        credit_legs = credit_legs.where(~_leg_posted(Transaction.account_to_id))
+        debit_legs = debit_legs.where(~_leg_posted(Transaction.account_from_id))
+
+    columns = ['account_id', 'amount_minor', 'kind', 'transaction_ref', 'created_at']
+    session.execute(insert(LedgerEntry).from_select(columns, credit_legs))
+    session.execute(insert(LedgerEntry).from_select(columns, debit_legs))
+
+def rebuild_balances(condition=None, session=None):
+    """Set account balances to the sum of their ledger entries in one UPDATE.
+
+    Shard balances of the rebuilt accounts are reset, since the entries
+    already include the credits that landed on them. ``condition`` limits
+    the accounts rebuilt. Does not commit.
+    """
+    session = session or db.session
+    total = select(func.coalesce(func.sum(LedgerEntry.amount_minor), 0)) \
+        .where(LedgerEntry.account_id == Account.id) \
+        .scalar_subquery()
+    stmt = update(Account).values(balance_minor=total).execution_options(synchronize_session=False)
+    shards = update(AccountBalanceShard).values(balance_minor=0).execution_options(synchronize_session=False)
+    if condition is not None:
+        stmt = stmt.where(condition)
+        shards = shards.where(AccountBalanceShard.account_id.in_(select(Account.id).where(condition)))
+    session.execute(shards)
+    return session.execute(stmt).rowcount
+
+def _ledger_totals(account_ids, session):
+    return dict(session.execute(
+        select(LedgerEntry.account_id, func.sum(LedgerEntry.amount_minor))
+        .where(LedgerEntry.account_id.in_(account_ids))
+        .group_by(LedgerEntry.account_id)
+    ).all())
+
+def _materialized_balances(account_ids, session):
+    balances = dict(session.execute(
+        select(Account.id, Account.balance_minor).where(Account.id.in_(account_ids))
+    ).all())
+    for account_id, shard_total in session.execute(
+        select(AccountBalanceShard.account_id, func.sum(AccountBalanceShard.balance_minor))
+        .where(AccountBalanceShard.account_id.in_(account_ids))
+        .group_by(AccountBalanceShard.account_id)
+    ):
+        balances[account_id] = (balances[account_id] or 0) + int(shard_total or 0)
+    return {account_id: int(balance or 0) for account_id, balance in balances.items()}
+
+def _account_id_chunks(session, condition=None, size=1000):
+    stmt = select(Account.id).order_by(Account.id)
+    if condition is not None:
+        stmt = stmt.where(condition)
+    account_ids = session.execute(stmt).scalars().all()
+    for start in range(0, len(account_ids), size):
+        yield account_ids[start:start + size]
+
+def backfill_ledger(condition=None, session=None):
+    """Bring accounts from before the ledger onto it.
+
+    Every account without an 'opening' entry gets the legs of its
+    transactions that are not in the ledger yet, then an 'opening' entry
+    dated at the account's creation for the difference between its
+    materialized balance and its ledger sum (e.g. balances from before the
+    ledger), so the entries sum to the current balance. The opening entry
+    is posted even when the difference is zero, which marks the account as
+    backfilled. ``condition`` limits the accounts considered. Returns the
+    number of accounts backfilled. Does not commit.
+    """
+    session = session or db.session
+    has_opening = select(LedgerEntry.id).where(
+        LedgerEntry.account_id == Account.id, LedgerEntry.kind == 'opening'
+    ).exists()
+    without_opening = ~has_opening if condition is None else and_(condition, ~has_opening)
+    backfilled = 0
+    for chunk in _account_id_chunks(session, without_opening):
+        post_transaction_entries(
+            or_(Transaction.account_to_id.in_(chunk), Transaction.account_from_id.in_(chunk)),
+            account_ids=chunk,
+            session=session,
+            unposted_only=True
+        )
+        ledger_totals = _ledger_totals(chunk, session)
+        balances = _materialized_balances(chunk, session)
+        created = dict(session.execute(
+            select(Account.id, Account.created_at).where(Account.id.in_(chunk))
+        ).all())
+        post_entries([
+            {
+                'account_id': account_id,
+                'amount_minor': balance - int(ledger_totals.get(account_id) or 0),
+                'kind': 'opening',
+                'created_at': created[account_id] or datetime.utcnow()
+            }
+            for account_id, balance in balances.items()
+        ], session)
+        backfilled += len(chunk)
+    return backfilled
+
+def ledger_drift(session=None):
+    """Yield ``(account_id, balance, ledger_total)`` for accounts whose
+    materialized balance differs from the sum of their entries."""
+    session = session or db.session
+    for chunk in _account_id_chunks(session):
+        ledger_totals = _ledger_totals(chunk, session)
+        for account_id, balance in _materialized_balances(chunk, session).items():
+            ledger_total = int(ledger_totals.get(account_id) or 0)
+            if balance != ledger_total:
+                yield account_id, balance, ledger_total
+
+def _latest_snapshot_times(account_ids, at):
+    latest = select(BalanceSnapshot.account_id, func.max(BalanceSnapshot.as_of).label('as_of')) \
+        .where(BalanceSnapshot.account_id.in_(account_ids), BalanceSnapshot.as_of <= at)
+    return latest.group_by(BalanceSnapshot.account_id).subquery()
+
+def _latest_snapshots(account_ids, at, session):
+    latest = _latest_snapshot_times(account_ids, at)
+    return {
+        account_id: (as_of, balance_minor)
+        for account_id, as_of, balance_minor in session.execute(
+            select(BalanceSnapshot.account_id, BalanceSnapshot.as_of, BalanceSnapshot.balance_minor)
+            .join(latest, and_(
+                BalanceSnapshot.account_id == latest.c.account_id,
+                BalanceSnapshot.as_of == latest.c.as_of
+            ))
+        )
+    }
+
+def _entry_sums(account_ids, at, session):
+    # Entries after each account's latest snapshot (all of them if it has
+    # none), up to and including ``at``
+    latest = _latest_snapshot_times(account_ids, at)
+    stmt = select(LedgerEntry.account_id, func.sum(LedgerEntry.amount_minor)) \
+        .outerjoin(latest, latest.c.account_id == LedgerEntry.account_id) \
+        .where(
+            LedgerEntry.account_id.in_(account_ids),
+            LedgerEntry.created_at <= at,
+            or_(latest.c.as_of.is_(None), LedgerEntry.created_at > latest.c.as_of)
+        ) \
+        .group_by(LedgerEntry.account_id)
+    return {account_id: int(total or 0) for account_id, total in session.execute(stmt)}
+
+def balances_at(account_ids, at, session=None):
+    """Return ``{account_id: balance_minor}`` as of a point in time.
+
+    Each balance is the account's nearest snapshot at or before ``at`` plus
+    the entries between the snapshot and ``at``, read through the
+    ``(account_id, created_at)`` index, so the cost depends on the time
+    since the last snapshot rather than on the account's whole history.
+    """
+    session = session or db.session
+    account_ids = list(account_ids)
+    if not account_ids:
+        return {}
+    snapshots = _latest_snapshots(account_ids, at, session)
+    tails = _entry_sums(account_ids, at, session)
+    return {
+        account_id: snapshots.get(account_id, (None, 0))[1] + tails.get(account_id, 0)
+        for account_id in account_ids
+    }
+
+def balance_at(account_id, at, session=None):
+    """Return an account's balance in minor units as of a point in time."""
+    return balances_at([account_id], at, session)[account_id]
+
+def take_snapshots(as_of, session=None, chunk_size=1000):
+    """Snapshot the balance as of ``as_of`` of every account with new entries.
+
+    Incremental: each account's new snapshot is its previous one plus the
+    entries since. Accounts without new entries keep their previous
+    snapshot, which is still current. ``as_of`` should lag the current time
+    enough that no transaction still in flight can add entries dated before
+    it. Commits after each chunk; returns the number of snapshots taken.
+    """
+    session = session or db.session
+    taken = 0
+    for chunk in _account_id_chunks(session, size=chunk_size):
+        snapshots = _latest_snapshots(chunk, as_of, session)
+        # Accounts already snapshotted at this time are skipped
+        pending = [account_id for account_id in chunk if snapshots.get(account_id, (None,))[0] != as_of]
+        if not pending:
+            continue
+        tails = _entry_sums(pending, as_of, session)
+        rows = [
+            {
+                'account_id': account_id,
+                'as_of': as_of,
+                'balance_minor': snapshots.get(account_id, (None, 0))[1] + total
+            }
+            for account_id, total in tails.items()
+        ]
+        if rows:
+            session.execute(insert(BalanceSnapshot), rows)
+            taken += len(rows)
+        session.commit()
+    return taken
@@ -0,0 +1,249 @@
+import threading
+import time
+from collections import defaultdict
+from flask import current_app, g, request, has_app_context, has_request_context, Response
+from .query_timing import add_query_listener
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return f'{value:g}' if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Counters and histograms, rendered in the Prometheus text format.
+
+    Metrics are created on first use; ``describe`` sets their help text
+    and, for histograms, their buckets. Labels are passed as keyword
+    arguments and keep the order they were given in. Collectors are
+    called at render time and return gauges as ``(name, help, [(labels,
+    value), ...])``, or other metric types with the type appended, e.g.
+    counters kept elsewhere as ``(name, help, samples, 'counter')``.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.histograms = defaultdict(dict)
+        self.help = {}
+        self.buckets = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text, buckets=None):
+        self.help[name] = help_text
+        if buckets is not None:
+            self.buckets[name] = tuple(buckets)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            self.counters[name][key] += amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            series = self.histograms[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self.buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                self._header(lines, name, 'counter')
+                for labels, value in series.items():
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            for name, series in sorted(self.histograms.items()):
+                self._header(lines, name, 'histogram')
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(labels, [("le", _format_value(float(bound)))])} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        for collector in self.collectors:
+            for name, help_text, samples, *kind in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind[0] if kind else "gauge"}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append(f'# HELP {name} {self.help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+
+def get_metrics():
+    """Return the app's MetricsRegistry, or None when metrics are disabled."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('metrics')
+
+def _add_timing(name, seconds, count=1):
+    """Add to the timings of the current request (for Server-Timing)."""
+    if has_request_context():
+        timings = g.get('metrics_timings')
+        if timings is not None:
+            timings[name][0] += seconds
+            timings[name][1] += count
+
+def destination_label(breaker_key):
+    """Name an outbound destination: 'central-bank', a bank prefix, or the host."""
+    if breaker_key.startswith('bank:'):
+        return breaker_key[len('bank:'):]
+    return breaker_key
+
+def record_http(breaker_key, method, outcome, seconds, metrics=None):
+    """Record an outbound call to the Central Bank or a partner bank.
+
+    ``outcome`` is a status class ('2xx', '4xx'...), 'error' or
+    'circuit_open'. ``metrics`` is for callers outside an app context.
+    """
+    if metrics is None:
+        metrics = get_metrics()
+    if metrics is None:
+        return
+    destination = destination_label(breaker_key)
+    metrics.observe('bank_outbound_request_duration_seconds', seconds,
+                    destination=destination, method=method, outcome=outcome)
+    _add_timing('central-bank' if destination == 'central-bank' else 'partner-bank', seconds)
+
+def record_jwt(operation, seconds, tokens=1):
+    """Record signing or verifying ``tokens`` JWTs in one call."""
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    metrics.observe('bank_jwt_duration_seconds', seconds, operation=operation)
+    metrics.inc('bank_jwt_tokens_total', tokens, operation=operation)
+    _add_timing(f'jwt-{operation}', seconds, tokens)
+
+def status_outcome(status_code):
+    return f'{status_code // 100}xx'
+
+
+def _record_query(statement, seconds):
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    metrics.inc('bank_db_queries_total')
+    metrics.inc('bank_db_query_seconds_total', seconds)
+    _add_timing('db', seconds)
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_timings = defaultdict(lambda: [0.0, 0])
+
+def _after_request(response):
+    started = g.get('metrics_started')
+    metrics = get_metrics()
+    if started is None or metrics is None:
+        return response
+    elapsed = time.perf_counter() - started
+    timings = g.metrics_timings
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('bank_request_duration_seconds', elapsed,
+                    endpoint=endpoint, method=request.method, status=status_outcome(response.status_code))
+    db_seconds, db_queries = timings['db'] if 'db' in timings else (0.0, 0)
+    metrics.observe('bank_request_db_queries', db_queries, endpoint=endpoint)
+    metrics.observe('bank_request_db_seconds', db_seconds, endpoint=endpoint)
+
+    if current_app.debug:
+        parts = [f'{name};dur={seconds * 1000:.2f};desc="{count} calls"' for name, (seconds, count) in timings.items()]
+        parts.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+def _metrics_view():
+    return Response(current_app.extensions['metrics'].render(), content_type=CONTENT_TYPE)
+
+def _runtime_gauges(app):
+    def collect():
+        gauges = []
+        executor = app.extensions.get('verification_executor')
+        if executor is not None:
+            stats = executor.stats()
+            gauges.append(('bank_jwt_verify_queue_depth', 'Tokens waiting for or being verified on the pool.',
+                           [((('mode', stats['mode']),), stats['pending'])]))
+            gauges.append(('bank_jwt_verify_queue_depth_peak', 'Highest verification queue depth seen.',
+                           [((('mode', stats['mode']),), stats.get('queue_depth_peak', 0))]))
+            gauges.append(('bank_jwt_verify_rejected_total', 'Tokens rejected because the verification queue was full.',
+                           [((('mode', stats['mode']),), stats.get('rejected', 0))], 'counter'))
+        client = app.extensions.get('http_client')
+        if client is not None:
+            states = client.breaker_states()
+            gauges.append(('bank_circuit_breaker_open', 'Whether the circuit breaker of a destination is open.',
+                           [((('destination', destination_label(key)),), int(state == 'open'))
+                            for key, state in sorted(states.items())]))
+        return gauges
+    return collect
+
+def init_metrics(app):
+    """Instrument the app and serve ``/metrics`` when METRICS_ENABLED is set.
+
+    Times every request, the DB queries it makes, outbound calls to the
+    Central Bank and partner banks, and JWT signing and verification. In
+    debug mode, responses carry a ``Server-Timing`` header with the
+    request's breakdown.
+    """
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    metrics = MetricsRegistry()
+    metrics.describe('bank_request_duration_seconds', 'Time spent handling requests.')
+    metrics.describe('bank_request_db_queries', 'DB queries made per request.', QUERY_COUNT_BUCKETS)
+    metrics.describe('bank_request_db_seconds', 'Time spent in DB queries per request.')
+    metrics.describe('bank_db_queries_total', 'DB queries executed.')
+    metrics.describe('bank_db_query_seconds_total', 'Time spent in DB queries.')
+    metrics.describe('bank_outbound_request_duration_seconds',
+                     'Latency of calls to the Central Bank and partner banks, by destination and outcome.')
+    metrics.describe('bank_jwt_duration_seconds', 'Time spent signing or verifying JWTs, per call.')
+    metrics.describe('bank_jwt_tokens_total', 'JWTs signed or verified.')
+    metrics.collectors.append(_runtime_gauges(app))
+    app.extensions['metrics'] = metrics
+
+    from .. import db
+    with app.app_context():
+        engine = db.engine
+    add_query_listener(engine, _record_query)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', _metrics_view)
@@ -0,0 +1,95 @@
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+# Number of minor units digits per ISO 4217 currency
+CURRENCY_EXPONENTS = {
+    'EUR': 2,
+    'USD': 2,
+    'GBP': 2,
+    'SEK': 2,
+    'NOK': 2,
+    'CHF': 2,
+    'JPY': 0,
+    'KWD': 3
+}
+DEFAULT_EXPONENT = 2
+
+# Amounts up to this many significant digits survive a round trip through a
+# JSON number (an IEEE 754 double) exactly
+_MAX_JSON_DIGITS = 15
+
+
+def exponent(currency):
+    """Return the number of minor unit digits of a currency."""
+    return CURRENCY_EXPONENTS.get((currency or '').upper(), DEFAULT_EXPONENT)
+
+def to_minor(amount, currency):
+    """Convert a Decimal, int, str or float amount to integer minor units.
+
+    Raises ValueError if the amount has more fractional digits than the
+    currency allows, instead of rounding money silently.
+    """
+    if isinstance(amount, bool):
+        raise ValueError(f"Invalid amount: {amount!r}")
+    try:
+        # repr() of a float is the shortest string that round-trips, so
+        # 0.1 becomes Decimal('0.1') rather than its binary expansion
+        value = Decimal(repr(amount)) if isinstance(amount, float) else Decimal(amount)
+    except (InvalidOperation, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid amount: {amount!r}") from e
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {amount!r}")
+
+    minor = value.scaleb(exponent(currency))
+    if minor != minor.to_integral_value():
+        raise ValueError(f"Amount {amount} has too many decimal places for {currency}")
+    return int(minor)
+
+def from_minor(minor, currency):
+    """Convert integer minor units to a Decimal with the currency's precision."""
+    digits = exponent(currency)
+    return Decimal(int(minor)).scaleb(-digits).quantize(Decimal(1).scaleb(-digits))
+
+def format_amount(minor, currency):
+    """Format minor units for display, e.g. ``1234.50 EUR``."""
+    return f"{from_minor(minor, currency)} {currency}"
+
+def to_payload_amount(minor, currency):
+    """Return an amount for a JSON payload that parses back to exactly ``minor``.
+
+    Whole amounts are sent as integers. Other amounts are sent as floats whose
+    shortest representation is the exact decimal value, which holds for up
+    to 15 significant digits.
+    """
+    value = from_minor(minor, currency)
+    if value == value.to_integral_value():
+        return int(value)
+    if len(value.as_tuple().digits) > _MAX_JSON_DIGITS:
+        raise ValueError(f"Amount {value} cannot be sent exactly as a JSON number")
+    return float(value)
+
+def parse_payload_amount(transfer, currency):
+    """Read a transfer payload's amount as minor units.
+
+    Prefers the exact ``amountMinor`` integer when the sender included it.
+    Raises ValueError for missing, inexact or non-positive amounts.
+    """
+    if 'amountMinor' in transfer:
+        minor = transfer['amountMinor']
+        if isinstance(minor, bool) or not isinstance(minor, int):
+            raise ValueError(f"Invalid amountMinor: {minor!r}")
+    else:
+        amount = transfer.get('amount')
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+            raise ValueError(f"Invalid amount: {amount!r}")
+        minor = to_minor(amount, currency)
+    if minor <= 0:
+        raise ValueError('Amount must be positive')
+    return minor
+
+def totals_by_currency(rows):
+    """Sum ``(currency, minor)`` pairs into a dict of exact per-currency totals."""
+    totals = defaultdict(int)
+    for currency, minor in rows:
+        totals[currency] += minor
+    return dict(totals)
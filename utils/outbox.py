@@ -0,0 +1,300 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import update, func
+
+from ..models import Transaction
+from .. import db
+from .cache import TTLCache
+from .transaction_handler import (
+    deliver_outgoing_transaction,
+    deliver_outgoing_batch,
+    complete_outgoing_transaction,
+    fail_outgoing_transaction
+)
+
+OUTBOX_STATUSES = ('pending', 'processing')
+
+
+def claim_transaction(transaction_id, lease):
+    """Lease a due outgoing transaction to the calling worker.
+
+    Moves it to 'processing' and returns ``(transaction, lease_until)``, or
+    returns None when another worker holds it or it is no longer pending.
+    ``lease_until`` identifies the lease: pass it when updating the
+    transaction so nothing is written once the lease has passed to another
+    worker. An expired lease (a worker that died mid-delivery) can be
+    claimed again.
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Transaction)
+        .where(
+            Transaction.id == transaction_id,
+            Transaction.status.in_(OUTBOX_STATUSES),
+            Transaction.next_attempt_at <= now
+        )
+        .values(
+            status='processing',
+            attempts=Transaction.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=lease)
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    transaction = db.session.get(Transaction, transaction_id)
+    # As stored, so it compares equal on any database
+    return transaction, transaction.next_attempt_at
+
+def renew_lease(transaction, lease_until, lease):
+    """Extend a lease that is still held. Returns the new ``lease_until``, or None if it was lost."""
+    renewed_until = datetime.utcnow() + timedelta(seconds=lease)
+    renewed = db.session.execute(
+        update(Transaction)
+        .where(
+            Transaction.id == transaction.id,
+            Transaction.status == 'processing',
+            Transaction.next_attempt_at == lease_until
+        )
+        .values(next_attempt_at=renewed_until)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    if not renewed:
+        return None
+    db.session.refresh(transaction)
+    return transaction.next_attempt_at
+
+def retry_delay(attempts, base, maximum):
+    """Exponential backoff with jitter for the given attempt number."""
+    delay = min(maximum, base * 2 ** max(attempts - 1, 0))
+    return delay * (0.5 + random.random() / 2)
+
+def schedule_retry(transaction, error_message, delay, lease_until=None):
+    """Put a leased transaction back in the outbox to be retried later.
+
+    With ``lease_until``, only while that lease is still held.
+    """
+    conditions = [Transaction.id == transaction.id, Transaction.status == 'processing']
+    if lease_until is not None:
+        conditions.append(Transaction.next_attempt_at == lease_until)
+    rescheduled = db.session.execute(
+        update(Transaction)
+        .where(*conditions)
+        .values(
+            status='pending',
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+            error_message=(error_message or 'Unknown error')[:256]
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return bool(rescheduled)
+
+def pending_transfers_by_bank(limit=100):
+    """Return the ids of due outgoing transfers grouped by destination bank prefix."""
+    due = db.session.query(Transaction.id, Transaction.account_to_external) \
+        .filter(
+            Transaction.status.in_(OUTBOX_STATUSES),
+            Transaction.next_attempt_at <= datetime.utcnow(),
+            Transaction.is_internal.is_(False)
+        ) \
+        .order_by(Transaction.next_attempt_at) \
+        .limit(limit).all()
+    db.session.rollback()
+
+    by_bank = defaultdict(list)
+    for transaction_id, account_to in due:
+        by_bank[account_to[:3]].append(transaction_id)
+    return dict(by_bank)
+
+def outbox_status():
+    """Count outgoing B2B transactions by status."""
+    rows = db.session.query(Transaction.status, func.count(Transaction.id)) \
+        .filter(Transaction.is_internal.is_(False), Transaction.account_from_id.isnot(None)) \
+        .group_by(Transaction.status).all()
+    return {status: count for status, count in rows}
+
+
+class OutboxWorker:
+    """Delivers pending outgoing B2B transfers with a pool of threads.
+
+    At most ``per_bank`` deliveries to the same destination bank run at once,
+    so one slow partner cannot take every worker. With ``b2b_batch_size`` > 1,
+    due transfers to the same bank are sent together to its batch endpoint
+    (falling back to single transfers if it has none, and trying batches
+    again after ``b2b_batch_retry`` seconds). Failed deliveries are
+    retried with exponential backoff until ``max_attempts`` is reached, and
+    then the transfer fails and the reserved funds are released.
+    """
+
+    def __init__(self, app, workers=8, per_bank=4, max_attempts=8, backoff_base=2,
+                 backoff_max=300, poll_interval=1.0, lease=60, batch_size=100, b2b_batch_size=1,
+                 b2b_batch_retry=600):
+        self.app = app
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.batch_size = batch_size
+        self.b2b_batch_size = max(1, b2b_batch_size)
+        # Banks whose batch endpoint was missing, until it is worth trying again
+        self._no_batch_banks = TTLCache(max_size=10000, ttl=b2b_batch_retry)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox')
+        self._bank_slots = defaultdict(lambda: threading.BoundedSemaphore(per_bank))
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.counters = defaultdict(int)
+
+    @classmethod
+    def from_config(cls, app, **overrides):
+        """Create a worker configured from the app's OUTBOX_* settings."""
+        config = app.config
+        options = {
+            'workers': config.get('OUTBOX_WORKERS', 8),
+            'per_bank': config.get('OUTBOX_PER_BANK_CONCURRENCY', 4),
+            'max_attempts': config.get('OUTBOX_MAX_ATTEMPTS', 8),
+            'backoff_base': config.get('OUTBOX_BACKOFF_BASE', 2),
+            'backoff_max': config.get('OUTBOX_BACKOFF_MAX', 300),
+            'poll_interval': config.get('OUTBOX_POLL_INTERVAL', 1.0),
+            'lease': config.get('OUTBOX_LEASE', 60),
+            'batch_size': config.get('OUTBOX_BATCH_SIZE', 100),
+            'b2b_batch_size': config.get('OUTBOX_B2B_BATCH_SIZE', 1),
+            'b2b_batch_retry': config.get('OUTBOX_B2B_BATCH_RETRY', 600)
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(app, **options)
+
+    def run(self, once=False):
+        """Poll the outbox until stopped, or until it is drained if ``once``."""
+        try:
+            while not self._stopping.is_set():
+                submitted = self.poll()
+                if once and not submitted and not self._in_flight:
+                    break
+                if not submitted:
+                    self._stopping.wait(self.poll_interval)
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def stop(self):
+        self._stopping.set()
+
+    def poll(self):
+        """Hand due transactions to the pool. Returns how many were submitted."""
+        with self.app.app_context():
+            due = pending_transfers_by_bank(self.batch_size)
+
+        submitted = 0
+        for bank_prefix, transaction_ids in due.items():
+            with self._lock:
+                transaction_ids = [tid for tid in transaction_ids if tid not in self._in_flight]
+            chunk_size = 1 if self._no_batch_banks.get(bank_prefix) else self.b2b_batch_size
+            for start in range(0, len(transaction_ids), chunk_size):
+                chunk = transaction_ids[start:start + chunk_size]
+                if not self._bank_slots[bank_prefix].acquire(blocking=False):
+                    # This bank is at its concurrency limit; try next poll
+                    break
+                with self._lock:
+                    self._in_flight.update(chunk)
+                self._executor.submit(self._process, chunk, bank_prefix)
+                submitted += len(chunk)
+        return submitted
+
+    def stats(self):
+        """Return delivery counters and the number of in-flight transfers."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self._in_flight)
+        return stats
+
+    def _count(self, name, bank_prefix):
+        with self._lock:
+            self.counters[name] += 1
+            self.counters[f'{name}:{bank_prefix}'] += 1
+
+    def _process(self, transaction_ids, bank_prefix):
+        started = time.monotonic()
+        delivered = 0
+        try:
+            with self.app.app_context():
+                if len(transaction_ids) > 1:
+                    delivered = self._deliver_batch(transaction_ids, bank_prefix)
+                else:
+                    delivered = self._deliver_each(transaction_ids, bank_prefix)
+                if delivered:
+                    self.app.logger.info(
+                        f"Outbox delivered {delivered} transaction(s) to {bank_prefix} "
+                        f"in {time.monotonic() - started:.3f}s"
+                    )
+        except Exception as e:
+            self.app.logger.error(f"Error delivering outbox transactions {transaction_ids}: {str(e)}")
+            self._count('errors', bank_prefix)
+        finally:
+            with self._lock:
+                self._in_flight.difference_update(transaction_ids)
+            self._bank_slots[bank_prefix].release()
+
+    def _deliver_each(self, transaction_ids, bank_prefix):
+        # Each transfer is claimed just before it is sent, so its lease
+        # only has to cover its own delivery
+        delivered = 0
+        for transaction_id in transaction_ids:
+            claimed = claim_transaction(transaction_id, self.lease)
+            if claimed is None:
+                continue
+            transaction, lease_until = claimed
+            self._apply_result(transaction, deliver_outgoing_transaction(transaction), bank_prefix, lease_until)
+            delivered += 1
+        return delivered
+
+    def _deliver_batch(self, transaction_ids, bank_prefix):
+        claimed = [claim_transaction(tid, self.lease) for tid in transaction_ids]
+        claimed = [claim for claim in claimed if claim is not None]
+        if not claimed:
+            return 0
+
+        transactions = [transaction for transaction, _ in claimed]
+        if len(transactions) > 1:
+            results = deliver_outgoing_batch(transactions)
+        else:
+            results = [deliver_outgoing_transaction(transactions[0])]
+        if results is not None:
+            for (transaction, lease_until), result in zip(claimed, results):
+                self._apply_result(transaction, result, bank_prefix, lease_until)
+            return len(claimed)
+
+        # The bank has no batch endpoint; send one by one, renewing each
+        # lease right before its transfer is sent
+        self._no_batch_banks.set(bank_prefix, True)
+        delivered = 0
+        for transaction, lease_until in claimed:
+            lease_until = renew_lease(transaction, lease_until, self.lease)
+            if lease_until is None:
+                continue
+            self._apply_result(transaction, deliver_outgoing_transaction(transaction), bank_prefix, lease_until)
+            delivered += 1
+        return delivered
+
+    def _apply_result(self, transaction, result, bank_prefix, lease_until):
+        # Each update only applies while our lease is held; a transfer whose
+        # lease expired belongs to another worker now
+        if result['outcome'] == 'completed':
+            applied = complete_outgoing_transaction(transaction, result.get('receiver_name'), lease_until)
+            name = 'completed'
+        elif result['outcome'] == 'retry' and transaction.attempts < self.max_attempts:
+            delay = retry_delay(transaction.attempts, self.backoff_base, self.backoff_max)
+            applied = schedule_retry(transaction, result.get('error'), delay, lease_until)
+            name = 'retried'
+        else:
+            applied = fail_outgoing_transaction(transaction, result.get('error'), lease_until)
+            name = 'failed'
+        self._count(name if applied else 'lease_lost', bank_prefix)
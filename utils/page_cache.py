@@ -0,0 +1,239 @@
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from flask import current_app, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event
+
+from .. import db
+from ..models import invalidate_shard_totals
+from .cache import TTLCache
+from .history import history_version
+
+
+class LocalCacheBackend:
+    """In-process LRU cache. Each worker process has its own."""
+    shared = False
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.cache = TTLCache(max_size=max_size, ttl=ttl)
+
+    def get_many(self, keys):
+        values = {}
+        for key in keys:
+            found, value, _ = self.cache.lookup(key)
+            if found:
+                values[key] = value
+        return values
+
+    def set(self, key, value, ttl=None):
+        self.cache.set(key, value, ttl=ttl)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.cache.invalidate(key)
+
+    def clear(self):
+        self.cache.invalidate()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+class SharedMemoryBackend:
+    """Stand-in for a shared cache server, for development and tests.
+
+    Values are pickled and kept in one store for every app in the process,
+    so code that works against it also works against a real shared backend.
+    """
+    shared = True
+    _store = {}
+    _lock = threading.Lock()
+
+    def __init__(self, ttl=300, **kwargs):
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        values = {}
+        with self._lock:
+            for key in keys:
+                entry = self._store.get(key)
+                if entry is not None and entry[1] > now:
+                    values[key] = pickle.loads(entry[0])
+        return values
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store[key] = (pickle.dumps(value), time.monotonic() + (self.ttl if ttl is None else ttl))
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._store.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+    def stats(self):
+        return {'size': len(self._store)}
+
+
+class RedisCacheBackend:
+    """Cache shared by all workers in a Redis server (needs the redis package)."""
+    shared = True
+
+    def __init__(self, url, ttl=300, prefix='bank:page:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('PAGE_CACHE_BACKEND=redis needs the redis package') from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        raw = self.client.mget([self.prefix + key for key in keys])
+        return {key: pickle.loads(value) for key, value in zip(keys, raw) if value is not None}
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=int(self.ttl if ttl is None else ttl))
+
+    def delete_many(self, keys):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+    def stats(self):
+        return {'backend': 'redis'}
+
+
+class NullCacheBackend:
+    """Caches nothing (PAGE_CACHE_BACKEND=none)."""
+    shared = True
+
+    def get_many(self, keys):
+        return {}
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class PageCache:
+    """Caches rendered fragments and summaries per account.
+
+    Every account has a generation token in the cache. Fragment keys include
+    the tokens of the accounts they show, and committing a change to an
+    account replaces its token, so stale fragments are never read again and
+    simply age out. A missing (e.g. evicted) token is replaced by a new one,
+    which can only cause a miss.
+
+    Tokens are only replaced in the process that commits. With a backend
+    that is not shared between processes, keys therefore also include the
+    accounts' history version, so a change committed by another worker, the
+    outbox worker or a CLI job is seen too.
+    """
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+
+    def _generations(self, account_ids):
+        keys = [f'gen:{account_id}' for account_id in account_ids]
+        tokens = self.backend.get_many(keys)
+        for key in keys:
+            if key not in tokens:
+                tokens[key] = uuid.uuid4().hex
+                self.backend.set(key, tokens[key], ttl=self.ttl * 2)
+        return [tokens[key] for key in keys]
+
+    def key(self, name, account_ids, *parts):
+        """Build the cache key of a fragment that shows the given accounts."""
+        account_ids = sorted(account_ids)
+        version = None if self.backend.shared else history_version(account_ids)
+        raw = repr((name, account_ids, self._generations(account_ids), version, parts))
+        return f'{name}:{hashlib.sha256(raw.encode("utf-8")).hexdigest()}'
+
+    def get_or_set(self, name, account_ids, build, *parts):
+        """Return the cached value for the fragment, building it on a miss."""
+        key = self.key(name, account_ids, *parts)
+        cached = self.backend.get_many([key])
+        if key in cached:
+            return cached[key]
+        value = build()
+        self.backend.set(key, value, ttl=self.ttl)
+        return value
+
+    def invalidate_accounts(self, account_ids):
+        """Replace the generation tokens of changed accounts."""
+        for account_id in account_ids:
+            self.backend.set(f'gen:{account_id}', uuid.uuid4().hex, ttl=self.ttl * 2)
+
+
+def _create_backend(config):
+    name = config.get('PAGE_CACHE_BACKEND', 'local')
+    ttl = config.get('PAGE_CACHE_TTL', 300)
+    if name == 'local':
+        return LocalCacheBackend(config.get('PAGE_CACHE_MAX_SIZE', 10000), ttl)
+    if name == 'shared-memory':
+        return SharedMemoryBackend(ttl)
+    if name == 'redis':
+        return RedisCacheBackend(config.get('PAGE_CACHE_URL'), ttl)
+    if name == 'none':
+        return NullCacheBackend()
+    raise ValueError(f"Unknown page cache backend: {name}")
+
+def get_page_cache():
+    """Return this app's PageCache."""
+    cache = current_app.extensions.get('page_cache')
+    if cache is None:
+        cache = PageCache(_create_backend(current_app.config), current_app.config.get('PAGE_CACHE_TTL', 300))
+        current_app.extensions['page_cache'] = cache
+    return cache
+
+def cached_fragment(name, account_ids, render, *parts):
+    """Return a rendered HTML fragment from the cache, rendering it on a miss."""
+    return Markup(get_page_cache().get_or_set(name, account_ids, lambda: str(render()), *parts))
+
+def touch_accounts(session, *account_ids):
+    """Note that the session changed these accounts.
+
+    Their cached fragments and shard sums are invalidated when the session
+    commits, and forgotten if it rolls back.
+    """
+    session.info.setdefault('touched_accounts', set()).update(account_ids)
+
+def _after_commit(session):
+    touched = session.info.pop('touched_accounts', None)
+    if touched:
+        invalidate_shard_totals(touched)
+        if has_app_context():
+            get_page_cache().invalidate_accounts(touched)
+
+def _after_rollback(session, previous_transaction):
+    session.info.pop('touched_accounts', None)
+
+def init_page_cache(app):
+    """Hook the commit-time invalidation into the app's DB sessions."""
+    if not event.contains(db.session, 'after_commit', _after_commit):
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_soft_rollback', _after_rollback)
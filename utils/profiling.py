@@ -0,0 +1,218 @@
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from flask import current_app, g, request, has_request_context
+from .query_timing import add_query_listener
+
+
+def _frame_name(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+def collapse_stack(frame):
+    """Return a frame's stack, outermost first, as a collapsed-stack line."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stacks of watched threads every ``interval`` seconds.
+
+    One daemon thread serves every request being watched and sleeps while
+    there are none. Each watched thread gets a Counter of collapsed
+    stacks, the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.watched = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, thread_id):
+        stacks = Counter()
+        with self._lock:
+            self.watched[thread_id] = stacks
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return stacks
+
+    def unwatch(self, thread_id):
+        with self._lock:
+            return self.watched.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            if not self.watched:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self.watched.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+
+class RequestProfiler:
+    """Profiles a sample of requests, and every slow one, to files.
+
+    A ``sample_rate`` fraction of requests to ``endpoints`` (every
+    endpoint when empty) run under cProfile. With ``slow_threshold`` set,
+    all of them are also stack-sampled, which is cheap enough to leave
+    on, and kept if they take at least that many seconds. cProfile
+    traces one request at a time; a request sampled while another is
+    being traced is only stack-sampled.
+
+    Each kept request is written to ``directory`` as ``<name>.txt`` (the
+    route, timing, a summary of its DB queries and the top functions),
+    ``<name>.prof`` (pstats, when traced) and ``<name>.collapsed``
+    (collapsed stacks for flame graphs). Only the newest ``max_profiles``
+    are kept.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, slow_threshold=0.0, endpoints=(), stack_interval=0.005,
+                 max_profiles=500):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.endpoints = frozenset(endpoints)
+        self.max_profiles = max_profiles
+        self.sampler = StackSampler(stack_interval)
+        self._tracing = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app):
+        """Create a profiler configured from the app's PROFILE_* settings."""
+        config = app.config
+        endpoints = [name.strip() for name in config.get('PROFILE_ENDPOINTS', '').split(',') if name.strip()]
+        return cls(
+            os.path.join(app.instance_path, config.get('PROFILE_DIR', 'profiles')),
+            sample_rate=config.get('PROFILE_SAMPLE_RATE', 0.0),
+            slow_threshold=config.get('PROFILE_SLOW_THRESHOLD', 0.0),
+            endpoints=endpoints,
+            stack_interval=config.get('PROFILE_STACK_INTERVAL', 0.005),
+            max_profiles=config.get('PROFILE_MAX_FILES', 500)
+        )
+
+    def start(self):
+        """Start profiling the current request if it is sampled or may be slow."""
+        if self.endpoints and request.endpoint not in self.endpoints:
+            return
+        sampled = self.sample_rate and random.random() < self.sample_rate
+        if not sampled and not self.slow_threshold:
+            return
+        state = g.profile = {'sampled': bool(sampled), 'queries': defaultdict(lambda: [0, 0.0]), 'profiler': None}
+        if sampled and self._tracing.acquire(blocking=False):
+            import cProfile
+            state['profiler'] = cProfile.Profile()
+            state['profiler'].enable()
+        state['thread_id'] = threading.get_ident()
+        state['stacks'] = self.sampler.watch(state['thread_id'])
+        state['started'] = time.perf_counter()
+
+    def finish(self, response):
+        """Stop profiling the current request and write it out if it is kept."""
+        state = g.pop('profile', None)
+        if state is None:
+            return response
+        elapsed = time.perf_counter() - state['started']
+        self._stop(state)
+        slow = self.slow_threshold and elapsed >= self.slow_threshold
+        if state['sampled'] or slow:
+            try:
+                self._write(state, elapsed, response.status_code, 'slow' if slow else 'sampled')
+            except OSError as e:
+                current_app.logger.error(f"Could not write request profile: {str(e)}")
+        return response
+
+    def abort(self, exc=None):
+        """Clean up after a request that ended without a response."""
+        state = g.pop('profile', None)
+        if state is not None:
+            self._stop(state)
+
+    def _stop(self, state):
+        if state['profiler'] is not None:
+            state['profiler'].disable()
+            self._tracing.release()
+        self.sampler.unwatch(state['thread_id'])
+
+    def _write(self, state, elapsed, status_code, reason):
+        os.makedirs(self.directory, exist_ok=True)
+        endpoint = request.endpoint or 'unmatched'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{elapsed * 1000:.0f}ms-{uuid.uuid4().hex[:6]}"
+        path = os.path.join(self.directory, name)
+
+        queries = state['queries']
+        lines = [
+            f'{request.method} {request.path} ({endpoint}) -> {status_code}',
+            f'Duration: {elapsed * 1000:.1f} ms ({reason})',
+            f"DB: {sum(count for count, _ in queries.values())} queries, "
+            f"{sum(seconds for _, seconds in queries.values()) * 1000:.1f} ms",
+            ''
+        ]
+        if queries:
+            lines.append(f"{'count':>6} {'total ms':>9}  statement")
+            for statement, (count, seconds) in sorted(queries.items(), key=lambda item: -item[1][1]):
+                lines.append(f"{count:>6} {seconds * 1000:>9.2f}  {' '.join(statement.split())[:200]}")
+            lines.append('')
+
+        profiler = state['profiler']
+        if profiler is not None:
+            import io
+            import pstats
+            profiler.dump_stats(path + '.prof')
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+            lines.append(stream.getvalue())
+        with open(path + '.txt', 'w') as f:
+            f.write('\n'.join(lines))
+
+        if state['stacks']:
+            with open(path + '.collapsed', 'w') as f:
+                for stack, count in state['stacks'].most_common():
+                    f.write(f'{stack} {count}\n')
+        self._prune()
+
+    def _prune(self):
+        names = sorted(entry[:-len('.txt')] for entry in os.listdir(self.directory) if entry.endswith('.txt'))
+        for name in names[:max(0, len(names) - self.max_profiles)]:
+            for suffix in ('.txt', '.prof', '.collapsed'):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def _record_query(statement, seconds):
+    if has_request_context() and 'profile' in g:
+        totals = g.profile['queries'][statement]
+        totals[0] += 1
+        totals[1] += seconds
+
+def init_profiling(app):
+    """Profile sampled and slow requests when PROFILE_ENABLED is set."""
+    if not app.config.get('PROFILE_ENABLED'):
+        return
+    profiler = RequestProfiler.from_config(app)
+    app.extensions['request_profiler'] = profiler
+
+    from .. import db
+    with app.app_context():
+        engine = db.engine
+    add_query_listener(engine, _record_query)
+    app.before_request(profiler.start)
+    app.after_request(profiler.finish)
+    app.teardown_request(profiler.abort)
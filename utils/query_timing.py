@@ -0,0 +1,47 @@
+import threading
+import time
+import weakref
+from sqlalchemy import event
+
+# Callbacks per engine, called with (statement, seconds) after each query
+_listeners = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The start time lives on the statement's execution context, so a
+    # statement that fails takes it with it instead of leaving it behind
+    started = getattr(context, '_query_started', None)
+    if started is None:
+        return
+    context._query_started = None
+    seconds = time.perf_counter() - started
+    for callback in _listeners.get(conn.engine, ()):
+        callback(statement, seconds)
+
+def add_query_listener(engine, callback):
+    """Call ``callback(statement, seconds)`` after each query on ``engine``.
+
+    Callbacks run on the thread that made the query, so they can use
+    ``flask.g`` or thread-locals to credit it to the current request.
+    Every callback shares one pair of engine events.
+    """
+    with _lock:
+        callbacks = _listeners.setdefault(engine, [])
+        if callback not in callbacks:
+            # Copy on write, so queries running now iterate a stable list
+            _listeners[engine] = callbacks + [callback]
+        if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+def remove_query_listener(engine, callback):
+    """Stop calling a callback added with :func:`add_query_listener`."""
+    with _lock:
+        callbacks = _listeners.get(engine, [])
+        if callback in callbacks:
+            _listeners[engine] = [other for other in callbacks if other != callback]
@@ -0,0 +1,110 @@
+import threading
+import time
+from flask import current_app
+
+from ..models import BankSettings
+from .. import db
+from .keys import BankKeyMaterial
+
+# Columns copied into the snapshot
+SETTINGS_FIELDS = ('bank_name', 'bank_prefix', 'api_key', 'transaction_url', 'jwks_url', 'central_bank_url')
+
+
+class BankSettingsSnapshot:
+    """An immutable copy of our bank's settings row.
+
+    Holds the columns in ``SETTINGS_FIELDS`` and the parsed key material
+    (``keys``), and is identified by the row's ``(id, updated_at)``
+    version. Replace the snapshot instead of changing it.
+    """
+    __slots__ = ('version',) + SETTINGS_FIELDS + ('keys',)
+
+    def __init__(self, bank_settings, version, keys=None):
+        object.__setattr__(self, 'version', version)
+        for field in SETTINGS_FIELDS:
+            object.__setattr__(self, field, getattr(bank_settings, field))
+        # Key objects are reused from the previous snapshot if the PEMs did not change
+        if keys is None or keys.private_key_pem != bank_settings.private_key or keys.public_key_pem != bank_settings.public_key:
+            keys = BankKeyMaterial(bank_settings.private_key, bank_settings.public_key, version=version)
+        object.__setattr__(self, 'keys', keys)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BankSettingsSnapshot is immutable')
+
+    @property
+    def private_key(self):
+        return self.keys.private_key
+
+    @property
+    def public_key(self):
+        return self.keys.public_key
+
+    def __repr__(self):
+        return f'<BankSettingsSnapshot {self.bank_name} {self.version}>'
+
+
+class _SettingsHolder:
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self.snapshot = None
+        self.loaded = False
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _fresh(self):
+        return self.loaded and time.monotonic() - self.checked_at < self.check_interval
+
+    def get(self):
+        if self._fresh():
+            return self.snapshot
+
+        with self.lock:
+            if self._fresh():
+                return self.snapshot
+
+            # Only the version columns are read unless the row changed
+            row = db.session.query(BankSettings.id, BankSettings.updated_at).first()
+            version = tuple(row) if row else None
+            if version is None:
+                self.snapshot = None
+            elif self.snapshot is None or self.snapshot.version != version:
+                previous = self.snapshot
+                self.snapshot = BankSettingsSnapshot(
+                    db.session.get(BankSettings, version[0]),
+                    version,
+                    keys=previous.keys if previous else None
+                )
+            self.loaded = True
+            self.checked_at = time.monotonic()
+            return self.snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded = False
+            self.checked_at = 0.0
+
+
+def _get_holder():
+    holder = current_app.extensions.get('bank_settings')
+    if holder is None:
+        holder = _SettingsHolder(current_app.config.get('BANK_SETTINGS_CHECK_INTERVAL', 30))
+        current_app.extensions['bank_settings'] = holder
+    return holder
+
+def get_bank_settings():
+    """Return a snapshot of our bank's settings, or None if there are none.
+
+    The row is read once and then only its version is re-checked, at most
+    every BANK_SETTINGS_CHECK_INTERVAL seconds, so other processes pick up
+    changes made through the database.
+    """
+    return _get_holder().get()
+
+def invalidate_bank_settings():
+    """Re-read the settings on next use, e.g. after a command changed them."""
+    _get_holder().invalidate()
+
+def get_key_material():
+    """Return our bank's parsed key material, or None if the bank has no settings."""
+    bank_settings = get_bank_settings()
+    return bank_settings.keys if bank_settings else None
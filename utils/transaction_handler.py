@@ -1,68 +1,151 @@
 import requests
 import json
+import jwt
 from flask import current_app
-from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from collections import defaultdict
+from datetime import datetime, timedelta
+import time
 import uuid
 
-from ..models import Transaction, Account, BankSettings
+from ..models import Transaction, Account
 from .. import db
-from .crypto import generate_jwt, verify_jwt, load_public_key
-from .central_bank import get_bank_details, validate_bank
+from .crypto import generate_jwt, jwk_to_pem
+from .central_bank import get_bank_details, invalidate_bank_details
+from .jwks import get_partner_public_key
+from .settings import get_bank_settings, get_key_material
+from .http import get_http_client
+from .money import to_payload_amount, parse_payload_amount
+from .fx import get_rates, RateUnavailable
+from .transfer_engine import debit, credit
+from .ledger import post_entries
+from .page_cache import touch_accounts
+from .idempotency import idempotency_key, find_processed, record_processed
+from .verification import get_verification_executor, VerificationBusy
 
-def process_outgoing_transaction(account_from, account_to, amount, currency, explanation, sender_name):
-    """Process an outgoing transaction to another bank."""
-    try:
-        # Create a transaction record with pending status
-        transaction = Transaction(
-            transaction_id=Transaction.generate_transaction_id(),
-            account_from_id=account_from.id,
-            account_to_external=account_to,
-            amount=amount,
-            currency=currency,
-            explanation=explanation,
-            status='pending',
-            is_internal=False
+# Partner responses that are worth retrying later
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def process_outgoing_transaction(account_from, account_to, amount_minor, currency, explanation, sender_name):
+    """Process an outgoing transaction to another bank.
+    
+    ``amount_minor`` is the amount in integer minor units of ``currency``.
+    
+    The funds are reserved and the transaction is stored before anything is
+    sent. In outbox mode (B2B_OUTBOX_ENABLED) delivery is left to the outbox
+    workers and the transfer is returned as pending. Otherwise it is sent
+    right away, and a transient failure also leaves it pending: the partner
+    may already have credited it, so it is redelivered with the same
+    transferId by ``flask outbox-worker`` instead of being refunded.
+    """
+    outbox = current_app.config.get('B2B_OUTBOX_ENABLED')
+    transaction = reserve_outgoing_transaction(
+        account_from, account_to, amount_minor, currency, explanation, sender_name,
+        status='pending' if outbox else 'processing'
+    )
+    if transaction is None:
+        return {
+            'success': False,
+            'error': 'Insufficient funds'
+        }
+    
+    if outbox:
+        return _queued(transaction)
+    
+    # The lease reserve_outgoing_transaction gave us, as stored
+    lease_until = transaction.next_attempt_at
+    result = deliver_outgoing_transaction(transaction)
+    if result['outcome'] == 'completed':
+        complete_outgoing_transaction(transaction, result.get('receiver_name'), lease_until)
+        return {
+            'success': True,
+            'transaction_id': transaction.transaction_id,
+            'receiver_name': result.get('receiver_name')
+        }
+    
+    if result['outcome'] == 'retry':
+        from .outbox import schedule_retry, retry_delay
+        config = current_app.config
+        delay = retry_delay(transaction.attempts, config.get('OUTBOX_BACKOFF_BASE', 2),
+                            config.get('OUTBOX_BACKOFF_MAX', 300))
+        schedule_retry(transaction, result.get('error'), delay, lease_until)
+        return _queued(transaction)
+    
+    if not fail_outgoing_transaction(transaction, result.get('error'), lease_until):
+        # The lease ran out and an outbox worker owns the transfer now
+        return _queued(transaction)
+    return {
+        'success': False,
+        'error': transaction.error_message
+    }
+
+def _queued(transaction):
+    return {
+        'success': True,
+        'pending': True,
+        'transaction_id': transaction.transaction_id
+    }
+
+def reserve_outgoing_transaction(account_from, account_to, amount_minor, currency, explanation, sender_name, status='pending'):
+    """Debit the sender and store the outgoing transaction in one DB transaction.
+    
+    Returns the new transaction, or None if the account has insufficient funds.
+    """
+    transaction_id = Transaction.generate_transaction_id()
+    if not debit(account_from.id, amount_minor, reference=transaction_id):
+        db.session.rollback()
+        return None
+    
+    transaction = Transaction(
+        transaction_id=transaction_id,
+        account_from_id=account_from.id,
+        account_to_external=account_to,
+        amount_minor=amount_minor,
+        currency=currency,
+        explanation=explanation,
+        sender_name=sender_name,
+        status=status,
+        is_internal=False,
+        attempts=1 if status == 'processing' else 0,
+        # A 'processing' transaction is leased to the caller; the outbox
+        # workers only pick it up if the lease runs out
+        next_attempt_at=datetime.utcnow() + timedelta(
+            seconds=current_app.config.get('OUTBOX_LEASE', 60) if status == 'processing' else 0
         )
-        db.session.add(transaction)
-        db.session.commit()
-        
-        # Extract the bank prefix from the destination account
-        bank_prefix = account_to[:3]
-        
+    )
+    db.session.add(transaction)
+    db.session.commit()
+    return transaction
+
+def deliver_outgoing_transaction(transaction):
+    """Sign and send a reserved transaction to the destination bank.
+    
+    Does not change the transaction. Returns a dict whose ``outcome`` is
+    'completed', 'retry' (a transient failure) or 'failed'.
+    """
+    bank_prefix = transaction.account_to_external[:3]
+    try:
         # Get the destination bank details from Central Bank
         bank_details = get_bank_details(bank_prefix)
         if not bank_details.get('success'):
-            transaction.status = 'failed'
-            transaction.error_message = f"Failed to get destination bank details: {bank_details.get('error')}"
-            db.session.commit()
             return {
-                'success': False,
-                'error': transaction.error_message
+                'outcome': 'failed' if bank_details.get('not_found') else 'retry',
+                'error': f"Failed to get destination bank details: {bank_details.get('error')}"
             }
         
-        # Get our bank settings
-        bank_settings = BankSettings.query.first()
-        if not bank_settings or not bank_settings.private_key:
-            transaction.status = 'failed'
-            transaction.error_message = "Bank not properly configured with keys"
-            db.session.commit()
+        # Get our signing key (parsed once per key version)
+        key_material = get_key_material()
+        if not key_material or not key_material.private_key:
             return {
-                'success': False,
-                'error': transaction.error_message
+                'outcome': 'failed',
+                'error': "Bank not properly configured with keys"
             }
         
-        # Prepare the transaction payload
-        payload = {
-            'accountFrom': account_from.account_number,
-            'accountTo': account_to,
-            'currency': currency,
-            'amount': amount,
-            'explanation': explanation,
-            'senderName': sender_name
-        }
-        
         # Generate JWT with the transaction payload
-        jwt_token = generate_jwt(payload, bank_settings.private_key)
+        payload = dict(build_outgoing_payload(transaction), **jwt_claims())
+        jwt_token = generate_jwt(payload, key_material.private_key, kid=key_material.kid)
         
         # Send the JWT to the destination bank's transaction endpoint
         if current_app.config.get('TEST_MODE'):
@@ -70,52 +153,176 @@ def process_outgoing_transaction(account_from, account_to, amount, currency, exp
             response_data = {'receiverName': 'Test Receiver'}
             response_status = 200
         else:
-            response = requests.post(
+            http_client = get_http_client()
+            response = http_client.post(
                 bank_details.get('transaction_url'),
                 json={'jwt': jwt_token},
-                headers={'Content-Type': 'application/json'}
+                headers={'Content-Type': 'application/json'},
+                timeout=(http_client.timeout[0], current_app.config.get('B2B_HTTP_TIMEOUT', 10)),
+                breaker_key=f'bank:{bank_prefix}'
             )
-            response_data = response.json() if response.text else {}
+            try:
+                response_data = response.json() if response.text else {}
+            except ValueError:
+                response_data = {}
             response_status = response.status_code
-        
-        # Process the response
-        if response_status == 200:
-            # Update transaction status and debit sender's account
-            transaction.status = 'completed'
-            transaction.completed_at = datetime.utcnow()
-            transaction.receiver_name = response_data.get('receiverName')
-            
-            # Debit the sender's account
-            account_from.balance -= amount
-            
-            db.session.commit()
-            
-            return {
-                'success': True,
-                'transaction_id': transaction.transaction_id,
-                'receiver_name': transaction.receiver_name
-            }
-        else:
-            # Update transaction status to failed
-            transaction.status = 'failed'
-            transaction.error_message = f"Transaction failed: {response_data.get('error', 'Unknown error')}"
-            db.session.commit()
-            
-            return {
-                'success': False,
-                'error': transaction.error_message
-            }
+    except requests.RequestException as e:
+        invalidate_bank_details(bank_prefix)
+        return {
+            'outcome': 'retry',
+            'error': f"Transaction failed: {str(e)}"
+        }
     except Exception as e:
         current_app.logger.error(f"Error processing outgoing transaction: {str(e)}")
-        if transaction:
-            transaction.status = 'failed'
-            transaction.error_message = str(e)
-            db.session.commit()
-        
         return {
-            'success': False,
+            'outcome': 'failed',
             'error': str(e)
         }
+    
+    if response_status == 200:
+        return {
+            'outcome': 'completed',
+            'receiver_name': response_data.get('receiverName')
+        }
+    
+    # The cached bank details may be out of date; look them up again
+    # on the next transfer to this bank
+    invalidate_bank_details(bank_prefix)
+    return {
+        'outcome': 'retry' if response_status in RETRYABLE_STATUS_CODES else 'failed',
+        'error': f"Transaction failed: {response_data.get('error', 'Unknown error')}"
+    }
+
+def build_outgoing_payload(transaction):
+    """Build the B2B transfer payload for an outgoing transaction."""
+    return {
+        'accountFrom': transaction.sender.account_number,
+        'accountTo': transaction.account_to_external,
+        'currency': transaction.currency,
+        'amount': to_payload_amount(transaction.amount_minor, transaction.currency),
+        'amountMinor': transaction.amount_minor,
+        'explanation': transaction.explanation,
+        'senderName': transaction.sender_name,
+        # Stable across retries, so the receiving bank can drop duplicates
+        'transferId': transaction.transaction_id
+    }
+
+def jwt_claims():
+    """Return fresh ``jti``, ``iat`` and ``exp`` claims for an outgoing B2B JWT."""
+    issued_at = int(time.time())
+    return {
+        'jti': uuid.uuid4().hex,
+        'iat': issued_at,
+        'exp': issued_at + current_app.config.get('B2B_JWT_TTL', 300)
+    }
+
+def deliver_outgoing_batch(transactions):
+    """Send several reserved transactions to one destination bank in one request.
+    
+    All transfers go in a single signed JWT to the bank's batch endpoint
+    (its transaction URL plus ``/batch``). Returns one result per transaction
+    in the same form as deliver_outgoing_transaction, or None if the bank
+    does not accept batches.
+    """
+    bank_prefix = transactions[0].account_to_external[:3]
+    try:
+        bank_details = get_bank_details(bank_prefix)
+        if not bank_details.get('success'):
+            outcome = 'failed' if bank_details.get('not_found') else 'retry'
+            error = f"Failed to get destination bank details: {bank_details.get('error')}"
+            return [{'outcome': outcome, 'error': error} for _ in transactions]
+        
+        key_material = get_key_material()
+        if not key_material or not key_material.private_key:
+            return [{'outcome': 'failed', 'error': "Bank not properly configured with keys"} for _ in transactions]
+        
+        payload = {'transfers': [build_outgoing_payload(transaction) for transaction in transactions], **jwt_claims()}
+        jwt_token = generate_jwt(payload, key_material.private_key, kid=key_material.kid)
+        
+        if current_app.config.get('TEST_MODE'):
+            # Mock response in test mode
+            return [{'outcome': 'completed', 'receiver_name': 'Test Receiver'} for _ in transactions]
+        
+        http_client = get_http_client()
+        response = http_client.post(
+            bank_details.get('transaction_url').rstrip('/') + '/batch',
+            json={'jwt': jwt_token},
+            headers={'Content-Type': 'application/json'},
+            timeout=(http_client.timeout[0], current_app.config.get('B2B_HTTP_TIMEOUT', 10)),
+            breaker_key=f'bank:{bank_prefix}'
+        )
+    except requests.RequestException as e:
+        invalidate_bank_details(bank_prefix)
+        return [{'outcome': 'retry', 'error': f"Transaction failed: {str(e)}"} for _ in transactions]
+    except Exception as e:
+        current_app.logger.error(f"Error processing outgoing batch: {str(e)}")
+        return [{'outcome': 'failed', 'error': str(e)} for _ in transactions]
+    
+    if response.status_code in (404, 405):
+        return None
+    
+    try:
+        items = response.json().get('results', []) if response.status_code == 200 else []
+    except ValueError:
+        items = []
+    if response.status_code != 200 or len(items) != len(transactions):
+        outcome = 'retry' if response.status_code in RETRYABLE_STATUS_CODES else 'failed'
+        return [{'outcome': outcome, 'error': f"Batch failed with status {response.status_code}"} for _ in transactions]
+    
+    results = []
+    for item in items:
+        status_code = item.get('status')
+        if status_code == 200:
+            results.append({'outcome': 'completed', 'receiver_name': item.get('receiverName')})
+        else:
+            results.append({
+                'outcome': 'retry' if status_code in RETRYABLE_STATUS_CODES else 'failed',
+                'error': f"Transaction failed: {item.get('error', 'Unknown error')}"
+            })
+    return results
+
+def _open_transaction(transaction, lease_until=None):
+    """Conditions matching a transaction that is still open, and still
+    leased to the caller when ``lease_until`` is given (see utils.outbox)."""
+    if lease_until is None:
+        return [Transaction.id == transaction.id, Transaction.status.in_(('pending', 'processing'))]
+    return [Transaction.id == transaction.id, Transaction.status == 'processing',
+            Transaction.next_attempt_at == lease_until]
+
+def complete_outgoing_transaction(transaction, receiver_name, lease_until=None):
+    """Mark a delivered transaction as completed. Returns False if it already was.
+    
+    With ``lease_until``, only while that outbox lease is still held.
+    """
+    completed = db.session.execute(
+        update(Transaction)
+        .where(*_open_transaction(transaction, lease_until))
+        .values(status='completed', completed_at=datetime.utcnow(), receiver_name=receiver_name)
+        .execution_options(synchronize_session='fetch')
+    ).rowcount
+    if completed:
+        touch_accounts(db.session, transaction.account_from_id)
+    db.session.commit()
+    return bool(completed)
+
+def fail_outgoing_transaction(transaction, error_message, lease_until=None):
+    """Mark a transaction as failed and release the reserved funds.
+    
+    The refund only happens for the call that moves the transaction to
+    'failed', so it is safe to call more than once. With ``lease_until``,
+    only while that outbox lease is still held.
+    """
+    failed = db.session.execute(
+        update(Transaction)
+        .where(*_open_transaction(transaction, lease_until))
+        .values(status='failed', error_message=(error_message or 'Unknown error')[:256])
+        .execution_options(synchronize_session='fetch')
+    ).rowcount
+    if failed:
+        credit(transaction.account_from_id, transaction.amount_minor,
+               reference=transaction.transaction_id, kind='refund')
+    db.session.commit()
+    return bool(failed)
 
 def process_incoming_transaction(jwt_token):
     """Process an incoming transaction from another bank."""
@@ -124,112 +331,297 @@ def process_incoming_transaction(jwt_token):
         if not jwt_token:
             return {'error': 'Missing JWT token'}, 400
         
-        # Extract the header to get the kid
-        header = jwt_token.split('.')[0]
-        header_data = json.loads(base64.b64decode(header + '==').decode('utf-8'))
+        transfers, error = verify_incoming_jwt(jwt_token)
+        if error:
+            return error
+        if len(transfers) != 1:
+            return {'error': 'Use the batch endpoint for multiple transfers'}, 400
         
-        # Extract the payload without verification
+        result = credit_incoming_transfers(transfers)[0]
+        status_code = result.pop('status')
+        return result, status_code
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error processing incoming transaction: {str(e)}")
+        return {'error': str(e)}, 500
+
+def process_incoming_batch(jwt_tokens):
+    """Process a batch of incoming transfers from another bank.
+    
+    Each token may carry a single transfer or a ``transfers`` list. Every
+    transfer is verified and validated on its own, and all accepted credits
+    are committed in one DB transaction. Returns one result per transfer,
+    in order, each with a ``status`` code.
+    """
+    results = []
+    accepted = []
+    for jwt_token, (transfers, error) in zip(jwt_tokens, verify_incoming_jwts(jwt_tokens)):
+        if error:
+            response, status_code = error
+            results.append(dict(response, status=status_code))
+            continue
+        for transfer in transfers:
+            accepted.append((len(results), transfer))
+            results.append(None)
+    
+    if accepted:
+        try:
+            credited = credit_incoming_transfers([transfer for _, transfer in accepted])
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error processing incoming batch: {str(e)}")
+            credited = [{'error': 'Internal server error', 'status': 500} for _ in accepted]
+        for (index, _), result in zip(accepted, credited):
+            results[index] = result
+    
+    return results
+
+def verify_incoming_jwt(jwt_token):
+    """Verify a JWT from another bank against the sending bank's public key.
+    
+    Returns ``(transfers, None)`` with the verified transfers (one, or the
+    token's ``transfers`` list), or ``(None, (response, status_code))``.
+    """
+    return verify_incoming_jwts([jwt_token])[0]
+
+def verify_incoming_jwts(jwt_tokens):
+    """Verify JWTs from other banks, returning one ``verify_incoming_jwt`` result per token.
+    
+    Public keys are resolved first, one token at a time; the signatures
+    are then checked together by the verification executor, which spreads
+    large batches over its worker pool.
+    """
+    results = []
+    pending = []
+    for jwt_token in jwt_tokens:
+        public_key, error = resolve_incoming_key(jwt_token) if jwt_token else (None, ({'error': 'Missing JWT token'}, 400))
+        if error:
+            results.append((None, error))
+            continue
+        pending.append((len(results), jwt_token, public_key))
+        results.append(None)
+    
+    if pending:
+        try:
+            verified = get_verification_executor().verify_many(
+                [(jwt_token, public_key) for _, jwt_token, public_key in pending],
+                leeway=current_app.config.get('B2B_JWT_LEEWAY', 0)
+            )
+        except VerificationBusy:
+            verified = [('busy', None)] * len(pending)
+        for (index, _, _), (outcome, value) in zip(pending, verified):
+            results[index] = incoming_transfers(outcome, value)
+    return results
+
+def resolve_incoming_key(jwt_token):
+    """Find the public key a B2B JWT must be verified with.
+    
+    Returns ``(public_key, None)`` or ``(None, (response, status_code))``.
+    """
+    try:
+        # Extract the header and payload without verification to find
+        # the sending bank and key
+        header_data = jwt.get_unverified_header(jwt_token)
         payload = jwt.decode(jwt_token, options={"verify_signature": False})
+    except jwt.InvalidTokenError:
+        return None, ({'error': 'Invalid JWT'}, 400)
+    
+    transfers = payload.get('transfers') if 'transfers' in payload else [payload]
+    if not isinstance(transfers, list) or not transfers:
+        return None, ({'error': 'Invalid transfer list'}, 400)
+    if len(transfers) > current_app.config.get('B2B_BATCH_MAX_ITEMS', 1000):
+        return None, ({'error': 'Too many transfers in one batch'}, 413)
+    
+    # Every transfer in one token must come from the same bank
+    sending_bank_prefixes = {str(transfer.get('accountFrom') or '')[:3] for transfer in transfers}
+    if len(sending_bank_prefixes) != 1 or '' in sending_bank_prefixes:
+        return None, ({'error': 'Missing source account'}, 400)
+    sending_bank_prefix = sending_bank_prefixes.pop()
+    
+    # Validate the sending bank and get its JWKS endpoint in one
+    # (cached) Central Bank lookup
+    bank_details = get_bank_details(sending_bank_prefix)
+    if not bank_details.get('success'):
+        if bank_details.get('not_found'):
+            return None, ({'error': 'Invalid sending bank'}, 400)
+        return None, ({'error': 'Failed to get sending bank details'}, 502)
+    
+    # Resolve the sending bank's public key (cached by bank prefix and kid)
+    if current_app.config.get('TEST_MODE'):
+        # In test mode transfers are signed with our own key pair
+        key_material = get_key_material()
+        public_key = key_material.public_key if key_material else None
+    else:
+        public_key = get_partner_public_key(
+            sending_bank_prefix,
+            bank_details.get('jwks_url'),
+            header_data.get('kid')
+        )
+    
+    if not public_key:
+        return None, ({'error': 'Public key not found'}, 400)
+    return public_key, None
+
+def legacy_senders():
+    """Return the bank prefixes allowed to send B2B tokens without exp or dedup ids."""
+    return {prefix.strip() for prefix in current_app.config.get('B2B_LEGACY_SENDERS', '').split(',') if prefix.strip()}
+
+def incoming_transfers(outcome, value):
+    """Turn a signature check from ``VerificationExecutor.verify_many`` into a ``verify_incoming_jwt`` result."""
+    if outcome == 'busy':
+        return None, ({'error': 'Too many transfers being verified, retry later'}, 503)
+    if outcome == 'invalid':
+        current_app.logger.error(f"JWT verification failed: {value}")
+        return None, ({'error': 'Invalid JWT signature'}, 400)
+    if outcome != 'ok':
+        return None, ({'error': f'JWT verification failed: {value}'}, 400)
+    verified_payload = value
+    transfers = verified_payload['transfers'] if 'transfers' in verified_payload else [verified_payload]
+    jti = verified_payload.get('jti')
+    
+    # A token must expire before the idempotency keys that catch its replays do
+    exp = verified_payload.get('exp')
+    max_lifetime = current_app.config.get('B2B_IDEMPOTENCY_TTL', 7 * 24 * 3600)
+    if exp is not None and exp - time.time() > max_lifetime:
+        return None, ({'error': 'JWT expires too far in the future'}, 400)
+    
+    # Only senders on the legacy allowlist may omit exp and transfer ids
+    sender = transfers[0].get('accountFrom') if transfers and isinstance(transfers[0], dict) else None
+    if str(sender or '')[:3] not in legacy_senders():
+        if exp is None:
+            return None, ({'error': 'Missing JWT claims: exp'}, 400)
+        if not jti and not all(isinstance(transfer, dict) and transfer.get('transferId') for transfer in transfers):
+            return None, ({'error': 'Missing transferId or JWT jti'}, 400)
+    
+    # Senders that do not send transfer ids are deduplicated by token id
+    if jti:
+        for index, transfer in enumerate(transfers):
+            if isinstance(transfer, dict) and not transfer.get('transferId'):
+                transfer['transferId'] = f"jti:{jti}:{index}"
+    return transfers, None
+
+def credit_incoming_transfers(transfers, retry_duplicates=True):
+    """Validate verified transfers and credit the receiving accounts.
+    
+    Accounts are loaded with one query and all credits are committed
+    together. Transfers whose idempotency key was already processed get the
+    stored response back without being credited again. Returns one result
+    dict (with a ``status`` code) per transfer.
+    """
+    keys = [idempotency_key(transfer) for transfer in transfers]
+    processed = find_processed(keys)
+    
+    bank_settings = get_bank_settings()
+    if not bank_settings:
+        return [{'error': 'Bank not properly configured', 'status': 500} for _ in transfers]
+    
+    account_numbers = {transfer.get('accountTo') for transfer in transfers if transfer.get('accountTo')}
+    accounts = {
+        account.account_number: account
+        for account in Account.query.options(joinedload(Account.owner))
+        .filter(Account.account_number.in_(account_numbers)).all()
+    } if account_numbers else {}
+    
+    results = []
+    credits = defaultdict(int)
+    shards = {}
+    entries = []
+    seen = {}
+    idempotency_ttl = current_app.config.get('B2B_IDEMPOTENCY_TTL', 7 * 24 * 3600)
+    for key, transfer in zip(keys, transfers):
+        # Replay the original response for a transfer we already processed,
+        # including a repeat of an earlier transfer in this same batch
+        if key in processed:
+            response, status_code = processed[key]
+            results.append(dict(response, status=status_code))
+            continue
+        if key in seen:
+            results.append(dict(seen[key]))
+            continue
         
         # Verify the receiving account exists
-        account_to = payload.get('accountTo')
+        account_to = transfer.get('accountTo')
         if not account_to:
-            return {'error': 'Missing destination account'}, 400
+            results.append({'error': 'Missing destination account', 'status': 400})
+            continue
         
         # Check if the account belongs to our bank
-        bank_settings = BankSettings.query.first()
-        if not bank_settings:
-            return {'error': 'Bank not properly configured'}, 500
-        
         if not account_to.startswith(bank_settings.bank_prefix):
-            return {'error': 'Account does not belong to this bank'}, 400
+            results.append({'error': 'Account does not belong to this bank', 'status': 400})
+            continue
         
-        # Find the account in our database
-        account = Account.query.filter_by(account_number=account_to).first()
+        account = accounts.get(account_to)
         if not account:
-            return {'error': 'Account not found'}, 404
-        
-        # Extract the sending bank prefix
-        account_from = payload.get('accountFrom')
-        if not account_from:
-            return {'error': 'Missing source account'}, 400
+            results.append({'error': 'Account not found', 'status': 404})
+            continue
         
-        sending_bank_prefix = account_from[:3]
-        
-        # Validate the sending bank with Central Bank
-        if not validate_bank(sending_bank_prefix):
-            return {'error': 'Invalid sending bank'}, 400
-        
-        # Get the sending bank's JWKS endpoint
-        bank_details = get_bank_details(sending_bank_prefix)
-        if not bank_details.get('success'):
-            return {'error': 'Failed to get sending bank details'}, 502
-        
-        # Retrieve the sending bank's public key from its JWKS endpoint
-        if current_app.config.get('TEST_MODE'):
-            # Mock response in test mode
-            jwks_response = {'keys': [{'kid': header_data.get('kid'), 'n': '...', 'e': '...', 'kty': 'RSA', 'alg': 'RS256'}]}
-            jwks_status = 200
-        else:
-            jwks_response = requests.get(bank_details.get('jwks_url')).json()
-            jwks_status = 200  # Assuming successful response
-        
-        if jwks_status != 200:
-            return {'error': 'Failed to retrieve sending bank public key'}, 502
-        
-        # Find the key with matching kid
-        key = None
-        for k in jwks_response.get('keys', []):
-            if k.get('kid') == header_data.get('kid'):
-                key = k
-                break
-        
-        if not key:
-            return {'error': 'Public key not found'}, 400
-        
-        # Convert JWK to PEM format (simplified for brevity)
-        # In a real implementation, you would convert the JWK to PEM format
-        # For this example, we'll assume we have a function to do this
-        public_key_pem = convert_jwk_to_pem(key)  # This function would need to be implemented
-        
-        # Verify JWT signature using the public key
         try:
-            verified_payload = verify_jwt(jwt_token, public_key_pem)
-            if not verified_payload:
-                return {'error': 'Invalid JWT signature'}, 400
-        except Exception as e:
-            return {'error': f'JWT verification failed: {str(e)}'}, 400
+            amount_minor = parse_payload_amount(transfer, transfer.get('currency'))
+        except ValueError:
+            results.append({'error': 'Invalid amount', 'status': 400})
+            continue
+        
+        # Credit the account in its own currency
+        converted_amount = None
+        exchange_rate = None
+        if transfer.get('currency') != account.currency:
+            try:
+                rates = get_rates()
+                exchange_rate = rates.rate(transfer.get('currency'), account.currency)
+                converted_amount = rates.convert(amount_minor, transfer.get('currency'), account.currency)
+            except RateUnavailable:
+                results.append({'error': 'Unsupported currency', 'status': 400})
+                continue
         
         # Create a transaction record
-        transaction = Transaction(
-            transaction_id=Transaction.generate_transaction_id(),
+        transaction_id = Transaction.generate_transaction_id()
+        credited_amount = amount_minor if converted_amount is None else converted_amount
+        db.session.add(Transaction(
+            transaction_id=transaction_id,
             account_to_id=account.id,
-            account_to_external=account_from,
-            amount=payload.get('amount'),
-            currency=payload.get('currency'),
-            explanation=payload.get('explanation'),
+            account_to_external=transfer.get('accountFrom'),
+            amount_minor=amount_minor,
+            currency=transfer.get('currency'),
+            explanation=transfer.get('explanation'),
+            sender_name=transfer.get('senderName'),
             status='completed',
             is_internal=False,
             completed_at=datetime.utcnow(),
-            receiver_name=account.owner.full_name
-        )
-        
-        # Credit the receiver's account
-        account.balance += payload.get('amount')
+            receiver_name=account.owner.full_name,
+            converted_amount_minor=converted_amount,
+            converted_currency=account.currency if converted_amount is not None else None,
+            exchange_rate=exchange_rate
+        ))
+        credits[account.id] += credited_amount
+        shards[account.id] = account.balance_shards
+        entries.append({'account_id': account.id, 'amount_minor': credited_amount, 'transaction_ref': transaction_id})
         
-        db.session.add(transaction)
+        # Return the receiver's name to the sending bank, and remember it
+        # for retries in the same DB transaction as the credit
+        response = {'receiverName': account.owner.full_name}
+        if key:
+            record_processed(key, response, 200, idempotency_ttl)
+            seen[key] = dict(response, status=200)
+        results.append(dict(response, status=200))
+    
+    # Credit the receiving accounts, one atomic UPDATE per account in id
+    # order so concurrent batches lock rows in the same order, with one
+    # ledger entry per transfer
+    for account_id in sorted(credits):
+        credit(account_id, credits[account_id], shards=shards[account_id], record=False)
+    post_entries(entries)
+    try:
         db.session.commit()
-        
-        # Return the receiver's name to the sending bank
-        return {'receiverName': account.owner.full_name}, 200
-    except Exception as e:
-        current_app.logger.error(f"Error processing incoming transaction: {str(e)}")
-        return {'error': str(e)}, 500
+    except IntegrityError:
+        # A concurrent request processed one of these transfers first; start
+        # over so it is answered from the stored response
+        db.session.rollback()
+        if not retry_duplicates:
+            raise
+        return credit_incoming_transfers(transfers, retry_duplicates=False)
+    
+    return results
 
 def convert_jwk_to_pem(jwk):
     """Convert a JWK to PEM format."""
-    # This is a placeholder for the actual implementation
-    # In a real application, you would implement this function
-    # to convert a JWK to PEM format
-    # For example, using the cryptography library
-    return "-----BEGIN PUBLIC KEY-----\n...\n-----END PUBLIC KEY-----"
+    return jwk_to_pem(jwk)
@@ -0,0 +1,165 @@
+import random
+from sqlalchemy import update, select
+
+from ..models import Account, AccountBalanceShard, invalidate_shard_totals
+from .. import db
+from .ledger import post_entries
+from .page_cache import touch_accounts
+
+
+class InsufficientFunds(Exception):
+    """Raised when a debit would take an account balance below zero."""
+
+
+def debit(account_id, amount_minor, session=None, reference=None, kind='transfer', record=True):
+    """Atomically take money from an account if its balance covers it.
+
+    Runs ``UPDATE account SET balance_minor = balance_minor - :amount
+    WHERE id = :id AND balance_minor >= :amount``, so the check and the write
+    happen under the row lock and concurrent debits cannot overdraw the
+    account. If the account row alone is too low and the account is sharded,
+    its shards are consolidated into it and the debit is tried once more.
+    A debit ledger entry for ``reference`` is appended unless ``record`` is
+    False. Returns False if the balance was too low. Does not commit.
+    """
+    session = session or db.session
+    debited = _conditional_debit(account_id, amount_minor, session)
+    if not debited and consolidate_shards(account_id, session):
+        debited = _conditional_debit(account_id, amount_minor, session)
+    if debited:
+        touch_accounts(session, account_id)
+        if record:
+            post_entries([{'account_id': account_id, 'amount_minor': -amount_minor,
+                           'kind': kind, 'transaction_ref': reference}], session)
+    return debited
+
+def _conditional_debit(account_id, amount_minor, session):
+    return session.execute(
+        update(Account)
+        .where(Account.id == account_id, Account.balance_minor >= amount_minor)
+        .values(balance_minor=Account.balance_minor - amount_minor)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+def credit(account_id, amount_minor, session=None, shards=0, reference=None, kind='transfer', record=True):
+    """Atomically add money to an account. Does not commit.
+
+    Pass the account's ``balance_shards`` as ``shards`` to spread credits to
+    a hot account over its shard rows instead of its own row. A credit
+    ledger entry is appended unless ``record`` is False, for callers that
+    post their own, finer-grained entries. Returns False, recording
+    nothing, if the account does not exist.
+    """
+    session = session or db.session
+    credited = False
+    if shards:
+        credited = session.execute(
+            update(AccountBalanceShard)
+            .where(
+                AccountBalanceShard.account_id == account_id,
+                AccountBalanceShard.shard_no == random.randrange(shards)
+            )
+            .values(balance_minor=AccountBalanceShard.balance_minor + amount_minor)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+    if not credited:
+        credited = session.execute(
+            update(Account)
+            .where(Account.id == account_id)
+            .values(balance_minor=Account.balance_minor + amount_minor)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+    if credited:
+        touch_accounts(session, account_id)
+        if record:
+            post_entries([{'account_id': account_id, 'amount_minor': amount_minor,
+                           'kind': kind, 'transaction_ref': reference}], session)
+    return credited
+
+def transfer(from_account_id, to_account_id, amount_minor, session=None, to_shards=0, to_amount_minor=None,
+             reference=None):
+    """Move money between two accounts of this bank in the current DB transaction.
+
+    ``to_amount_minor`` is the amount credited when the destination account
+    is in another currency (defaults to ``amount_minor``). The two rows are
+    updated in ascending id order, so two opposite transfers between the
+    same accounts always lock them in the same order and cannot deadlock.
+    Both ledger legs carry ``reference``. Raises InsufficientFunds (after
+    rolling back) if the source balance is too low. Does not commit.
+    """
+    session = session or db.session
+    if to_amount_minor is None:
+        to_amount_minor = amount_minor
+    if from_account_id < to_account_id or to_shards:
+        if not debit(from_account_id, amount_minor, session, reference=reference):
+            session.rollback()
+            raise InsufficientFunds()
+        credit(to_account_id, to_amount_minor, session, shards=to_shards, reference=reference)
+    else:
+        credit(to_account_id, to_amount_minor, session, reference=reference)
+        if not debit(from_account_id, amount_minor, session, reference=reference):
+            session.rollback()
+            raise InsufficientFunds()
+
+def consolidate_shards(account_id, session=None):
+    """Fold an account's shard balances back into its own row.
+
+    All of the account's shard rows are locked first, so no credit can land
+    on one of them until the transaction ends. Returns the amount moved.
+    Does not commit.
+    """
+    session = session or db.session
+    shards = session.execute(
+        select(AccountBalanceShard.id, AccountBalanceShard.balance_minor)
+        .where(AccountBalanceShard.account_id == account_id)
+        .order_by(AccountBalanceShard.id)
+        .with_for_update()
+    ).all()
+    moved = 0
+    for shard_id, shard_balance in shards:
+        if not shard_balance:
+            continue
+        session.execute(
+            update(AccountBalanceShard)
+            .where(AccountBalanceShard.id == shard_id)
+            .values(balance_minor=AccountBalanceShard.balance_minor - shard_balance)
+            .execution_options(synchronize_session=False)
+        )
+        moved += shard_balance
+    if moved:
+        session.execute(
+            update(Account)
+            .where(Account.id == account_id)
+            .values(balance_minor=Account.balance_minor + moved)
+            .execution_options(synchronize_session=False)
+        )
+        invalidate_shard_totals([account_id])
+    return moved
+
+def set_balance_shards(account_id, shards, session=None):
+    """Turn sub-balance sharding on (``shards`` > 0) or off for an account.
+
+    Existing shards are consolidated first, and the now empty shards beyond
+    the new count are removed. Does not commit.
+    """
+    session = session or db.session
+    consolidate_shards(account_id, session)
+    existing = set(session.execute(
+        select(AccountBalanceShard.shard_no).where(AccountBalanceShard.account_id == account_id)
+    ).scalars())
+    for shard_no in range(shards):
+        if shard_no not in existing:
+            session.add(AccountBalanceShard(account_id=account_id, shard_no=shard_no, balance_minor=0))
+    session.execute(
+        AccountBalanceShard.__table__.delete().where(
+            AccountBalanceShard.account_id == account_id,
+            AccountBalanceShard.shard_no >= shards,
+            AccountBalanceShard.balance_minor == 0
+        )
+    )
+    session.execute(
+        update(Account)
+        .where(Account.id == account_id)
+        .values(balance_shards=shards)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,253 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import jwt
+from cryptography.hazmat.primitives import serialization
+from flask import current_app
+
+from .metrics import record_jwt
+
+VERIFY_MODES = ('inline', 'thread', 'process')
+
+# Public keys loaded in a pool process, by DER encoding
+_worker_keys = {}
+
+
+class VerificationBusy(Exception):
+    """Raised when the verification queue stays full for too long."""
+
+
+def _verify_one(token, public_key, leeway):
+    """Verify an RS256 token; return ``('ok', payload)``, ``('invalid', message)`` or ``('error', message)``."""
+    try:
+        return 'ok', jwt.decode(token, public_key, algorithms=['RS256'], leeway=leeway)
+    except jwt.InvalidTokenError as e:
+        return 'invalid', str(e)
+    except Exception as e:
+        return 'error', str(e)
+
+def _verify_chunk(items, leeway):
+    """Verify ``(token, public_key)`` pairs in a pool thread."""
+    return [_verify_one(token, public_key, leeway) for token, public_key in items]
+
+def _verify_chunk_der(items, leeway):
+    """Verify ``(token, public_key_der)`` pairs in a pool process.
+
+    Key objects cannot be pickled, so keys arrive DER encoded and are
+    loaded once per process.
+    """
+    results = []
+    for token, key_der in items:
+        public_key = _worker_keys.get(key_der)
+        if public_key is None:
+            public_key = _worker_keys[key_der] = serialization.load_der_public_key(key_der)
+        results.append(_verify_one(token, public_key, leeway))
+    return results
+
+def _warm_up():
+    """Run once in each new pool process, so it has imported this module."""
+    return os.getpid()
+
+
+class VerificationExecutor:
+    """Verifies incoming B2B JWT signatures, in parallel for large batches.
+
+    In ``inline`` mode every token is verified on the calling thread. In
+    ``thread`` and ``process`` mode, batches of at least ``min_batch``
+    tokens are split into chunks of up to ``chunk_size`` and verified on a
+    pool of ``workers`` threads or processes (``process`` scales with
+    cores; ``thread`` only as far as the RSA operations release the GIL).
+    By default the host's cores are shared out between the
+    ``host_processes`` app processes running on it.
+    Smaller batches stay inline, where the pool's overhead would cost
+    more than it saves.
+
+    At most ``max_pending`` tokens wait for or run in the pool. A batch
+    that does not fit waits up to ``queue_timeout`` seconds and then
+    raises VerificationBusy.
+    """
+
+    def __init__(self, mode='inline', workers=0, min_batch=16, chunk_size=64, max_pending=10000, queue_timeout=5.0,
+                 host_processes=1):
+        if mode not in VERIFY_MODES:
+            raise ValueError(f"Unknown verification executor: {mode}")
+        self.mode = mode
+        self.workers = workers or max(1, (os.cpu_count() or 1) // max(1, host_processes))
+        self.min_batch = max(1, min_batch)
+        self.chunk_size = max(1, chunk_size)
+        self.max_pending = max(1, max_pending)
+        self.queue_timeout = queue_timeout
+        self.pending = 0
+        self.counters = defaultdict(int)
+        self._pool = None
+        # DER encodings of the key objects seen, by id (keys are not hashable)
+        self._key_der = {}
+        self._lock = threading.Lock()
+        self._capacity = threading.Condition(self._lock)
+
+    @classmethod
+    def from_config(cls, config, **overrides):
+        """Create an executor configured from the B2B_VERIFY_* settings."""
+        options = {
+            'mode': config.get('B2B_VERIFY_EXECUTOR', 'inline'),
+            'workers': config.get('B2B_VERIFY_WORKERS', 0),
+            'min_batch': config.get('B2B_VERIFY_MIN_BATCH', 16),
+            'chunk_size': config.get('B2B_VERIFY_CHUNK_SIZE', 64),
+            'max_pending': config.get('B2B_VERIFY_MAX_PENDING', 10000),
+            'queue_timeout': config.get('B2B_VERIFY_QUEUE_TIMEOUT', 5.0),
+            'host_processes': config.get('B2B_VERIFY_HOST_PROCESSES', 1)
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**options)
+
+    def verify_many(self, items, leeway=0):
+        """Verify ``(token, public_key)`` pairs; return one ``(outcome, value)`` per pair, in order.
+
+        Outcome is 'ok' (value is the payload), 'invalid' (the token failed
+        verification) or 'error' (verification raised something else).
+        """
+        items = list(items)
+        if self.mode == 'inline' or len(items) < self.min_batch:
+            started = time.perf_counter()
+            results = _verify_chunk(items, leeway)
+            elapsed = time.perf_counter() - started
+            self._count(inline=len(items), inline_seconds=elapsed)
+            record_jwt('verify', elapsed, len(items))
+            return results
+
+        self._reserve(len(items))
+        started = time.perf_counter()
+        try:
+            results = self._run_pool(items, leeway)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._release(len(items), elapsed)
+        record_jwt('verify', elapsed, len(items))
+        return results
+
+    def start(self):
+        """Start the pool now instead of in the first large batch.
+
+        In ``process`` mode this returns once every worker process has
+        been spawned and imported the verification code, which takes
+        seconds. Does nothing in ``inline`` mode.
+        """
+        if self.mode == 'inline':
+            return
+        pool = self._get_pool()
+        if self.mode == 'process':
+            for future in [pool.submit(_warm_up) for _ in range(self.workers)]:
+                future.result()
+
+    def stats(self):
+        """Return counters, the current queue depth and its high-water mark."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(mode=self.mode, workers=self.workers, pending=self.pending, max_pending=self.max_pending)
+        return stats
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def _reserve(self, count):
+        """Wait for room for ``count`` tokens in the pool (backpressure)."""
+        # A batch larger than the whole queue only has to wait for an empty one
+        needed = min(count, self.max_pending)
+        deadline = time.monotonic() + self.queue_timeout
+        with self._capacity:
+            while self.pending + needed > self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters['rejected'] += count
+                    raise VerificationBusy('Verification queue is full')
+                self.counters['waits'] += 1
+                self._capacity.wait(remaining)
+            self.pending += count
+            self.counters['queue_depth_peak'] = max(self.counters['queue_depth_peak'], self.pending)
+            self.counters['submitted'] += count
+
+    def _release(self, count, seconds):
+        with self._capacity:
+            self.pending -= count
+            self.counters['completed'] += count
+            self.counters['pool_seconds'] += seconds
+            self._capacity.notify_all()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.mode == 'process':
+                    # Not forked: the app may already be running threads
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='verify')
+            return self._pool
+
+    def _der(self, public_key):
+        entry = self._key_der.get(id(public_key))
+        if entry is None or entry[0] is not public_key:
+            if len(self._key_der) >= 1024:
+                self._key_der.clear()
+            der = public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+            # Holding the key keeps its id from being reused
+            entry = self._key_der[id(public_key)] = (public_key, der)
+        return entry[1]
+
+    def _run_pool(self, items, leeway):
+        if self.mode == 'process':
+            # Keys that may still be PEM strings are verified as they are
+            items = [(token, self._der(key) if hasattr(key, 'public_bytes') else key) for token, key in items]
+            verify = _verify_chunk_der
+        else:
+            verify = _verify_chunk
+        # Spread the batch over every worker, in chunks of at most chunk_size
+        size = min(self.chunk_size, -(-len(items) // self.workers))
+        chunks = [items[start:start + size] for start in range(0, len(items), size)]
+        try:
+            pool = self._get_pool()
+            futures = [pool.submit(verify, chunk, leeway) for chunk in chunks]
+            return [result for future in futures for result in future.result()]
+        except BrokenProcessPool:
+            # A pool process died; start a new pool next time and finish this batch here
+            self.shutdown(wait=False)
+            self._count(pool_failures=1)
+            return _verify_chunk(items if verify is _verify_chunk else self._reload(items), leeway)
+
+    @staticmethod
+    def _reload(items):
+        return [(token, serialization.load_der_public_key(key) if isinstance(key, bytes) else key) for token, key in items]
+
+
+def get_verification_executor():
+    """Return the B2B JWT verification executor for the current application."""
+    executor = current_app.extensions.get('verification_executor')
+    if executor is None:
+        executor = VerificationExecutor.from_config(current_app.config)
+        current_app.extensions['verification_executor'] = executor
+    return executor
+
+def init_verification(app):
+    """Start the app's verification pool in the background."""
+    with app.app_context():
+        executor = get_verification_executor()
+
+    def start():
+        try:
+            executor.start()
+        except Exception as e:
+            app.logger.error(f"Could not start the JWT verification pool: {str(e)}")
+
+    threading.Thread(target=start, name='verify-prestart', daemon=True).start()